@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from fpdataviewer.mlab import writing
+from fpdataviewer.mlab.mlab import MLAB, MLABBasisSet, MLABConfiguration, MLABConfigurationHeader, StressTensor
+
+_elements = ["H", "C", "N", "O", "F", "Si", "P", "S", "Cl", "Br", "I", "Pb", "Bi", "Ag", "K", "Li"]
+
+
+def _create_headers(atoms: int, types: int, sections: int) -> list[MLABConfigurationHeader]:
+    atom_types = _elements[:types]
+    amounts = [len(part) for part in np.array_split(np.arange(atoms), types)]
+
+    return [MLABConfigurationHeader(name=f"synthetic-{i + 1}",
+                                    number_of_atom_types=types,
+                                    number_of_atoms=atoms,
+                                    number_of_atoms_per_type=tuple(zip(atom_types, amounts)))
+            for i in range(sections)]
+
+
+def generate_configurations(configurations: int,
+                            atoms: int,
+                            types: int,
+                            sections: int = 1,
+                            charges: bool = False,
+                            seed: int = 0) -> Iterator[MLABConfiguration]:
+    # Sections follow each other in blocks, like in files from consecutive training runs
+    rng = np.random.default_rng(seed)
+    headers = _create_headers(atoms, types, sections)
+    section_sizes = [len(part) for part in np.array_split(np.arange(configurations), sections)]
+
+    index = 0
+    for header, size in zip(headers, section_sizes):
+        for _ in range(size):
+            index += 1
+            length = (atoms * 12.) ** (1 / 3)
+            lattice_vectors = np.diag([length] * 3) + rng.normal(scale=0.05, size=(3, 3))
+
+            yield MLABConfiguration(index=index,
+                                    header=header,
+                                    ctifor=float(rng.uniform(1e-3, 1e-1)),
+                                    lattice_vectors=lattice_vectors,
+                                    positions=rng.uniform(0, length, size=(atoms, 3)),
+                                    energy=float(rng.normal(-5. * atoms, atoms * 0.01)),
+                                    forces=rng.normal(scale=0.5, size=(atoms, 3)),
+                                    stress=StressTensor(*rng.normal(scale=10., size=6).tolist()),
+                                    charges=rng.normal(scale=0.5, size=atoms) if charges else None)
+
+
+def create_global_header(configurations: int,
+                         atoms: int,
+                         types: int,
+                         sections: int = 1,
+                         basis_sets: int = 100,
+                         seed: int = 0) -> MLAB:
+    # Only what writing.write takes from its source: atom types, reference energies, masses and basis sets. Basis sets
+    # refer to random atoms of the right type in random configurations.
+    rng = np.random.default_rng(seed + 1)
+    header = _create_headers(atoms, types, sections)[0]
+    lookup = np.array(header.generate_type_lookup())
+
+    atom_types = [atom_type for atom_type, _ in header.number_of_atoms_per_type]
+    mlab_basis_sets = []
+    for atom_type in atom_types:
+        candidates = np.flatnonzero(lookup == atom_type) + 1
+        indices = np.column_stack([rng.integers(1, configurations + 1, size=basis_sets), rng.choice(candidates, size=basis_sets)])
+
+        mlab_basis_sets.append(MLABBasisSet(name=atom_type, indices=indices))
+
+    return MLAB(number_of_configurations=configurations,
+                max_number_of_atom_types=types,
+                max_number_of_atoms_per_system=atoms,
+                max_number_of_atoms_per_type=max(amount for _, amount in header.number_of_atoms_per_type),
+                atom_types=atom_types,
+                reference_energies=[0.] * types,
+                atomic_masses=rng.uniform(1., 200., size=types).tolist(),
+                numbers_of_basis_sets=[basis_sets] * types,
+                basis_sets=mlab_basis_sets,
+                configurations=[])
+
+
+def generate(path: Path,
+             configurations: int,
+             atoms: int,
+             types: int,
+             sections: int = 1,
+             basis_sets: int = 100,
+             charges: bool = False,
+             seed: int = 0,
+             workers: int = 1) -> None:
+    source = create_global_header(configurations, atoms, types, sections, basis_sets, seed)
+
+    with path.open(mode="wt") as file:
+        writing.write(file,
+                      source,
+                      generate_configurations(configurations, atoms, types, sections, charges, seed),
+                      workers=workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="writes a synthetic ML_AB file with random data")
+    parser.add_argument("output_file", type=Path, help="path to output file")
+    parser.add_argument("--configurations", "-n", type=int, default=1000, help="number of configurations")
+    parser.add_argument("--atoms", "-a", type=int, default=100, help="number of atoms per configuration")
+    parser.add_argument("--types", "-t", type=int, default=2, help=f"number of atom types (at most {len(_elements)})")
+    parser.add_argument("--sections", "-s", type=int, default=1, help="number of sections (systems with different names)")
+    parser.add_argument("--basis-sets", "-b", type=int, default=100, help="number of basis sets per atom type")
+    parser.add_argument("--charges", "-c", action="store_true", help="includes charges")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="number of processes formatting the output")
+    args = parser.parse_args()
+
+    generate(args.output_file, args.configurations, args.atoms, args.types, args.sections, args.basis_sets, args.charges, args.seed, args.workers)
+
+
+if __name__ == "__main__":
+    main()
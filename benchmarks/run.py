@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from fpdataviewer.mlab import parsing, validation
+
+sys.path.insert(0, str(Path(__file__).parent))
+from generate import generate
+
+# name: (configurations, atoms, types, sections, charges)
+cases = {
+    "small": (200, 64, 2, 1, False),
+    "many-atoms": (50, 1000, 3, 1, False),
+    "many-types": (200, 96, 6, 2, False),
+    "charges": (200, 64, 2, 1, True),
+}
+
+
+def _time(function: Callable[[], object], repeat: int) -> float:
+    # Best of several runs, which is the least disturbed by other processes
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def _load(path: Path, engine: str):
+    with path.open(mode="rt") as file:
+        return parsing.load(file, engine=engine)
+
+
+def run_case(path: Path, configurations: int, repeat: int) -> dict[str, float]:
+    size = path.stat().st_size
+    mlab = _load(path, "line")
+
+    benchmarks = {
+        "load[line]": lambda: _load(path, "line"),
+        "load[block]": lambda: _load(path, "block"),
+        "split": lambda: parsing.split(mlab),
+        "validate": lambda: validation.validate(mlab),
+    }
+
+    results = {}
+    for name, function in benchmarks.items():
+        seconds = _time(function, repeat)
+
+        results[name] = {
+            "seconds": seconds,
+            "configurations_per_second": configurations / seconds,
+            "megabytes_per_second": size / 1e6 / seconds,
+        }
+
+    return results
+
+
+def _get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results: dict, previous: dict) -> None:
+    print(f"{'case':<12} {'benchmark':<12} {'previous':>10} {'current':>10} {'ratio':>7}")
+
+    for case, benchmarks in results["cases"].items():
+        for name, result in benchmarks.items():
+            old = previous["cases"].get(case, {}).get(name)
+            if old is None:
+                continue
+
+            print(f"{case:<12} {name:<12} {old['seconds']:10.4f} {result['seconds']:10.4f} {result['seconds'] / old['seconds']:7.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="times parsing, splitting and validation of synthetic ML_AB files")
+    parser.add_argument("--output", "-o", type=Path, default=None, help="path to JSON file to store the results in")
+    parser.add_argument("--compare", "-c", type=Path, default=None, help="path to JSON file with earlier results to compare against")
+    parser.add_argument("--cases", nargs="*", default=list(cases), choices=list(cases), help="cases to run")
+    parser.add_argument("--scale", type=float, default=1., help="multiplies the number of configurations of every case")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="number of runs per benchmark, the fastest is kept")
+    args = parser.parse_args()
+
+    results = {
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for case in args.cases:
+            configurations, atoms, types, sections, charges = cases[case]
+            configurations = max(1, int(configurations * args.scale))
+
+            path = Path(directory) / f"ML_AB_{case}"
+            generate(path, configurations, atoms, types, sections, charges=charges)
+
+            print(f"\rrunning {case} ... ", end="", flush=True)
+            results["cases"][case] = run_case(path, configurations, args.repeat)
+
+    print("\r", end="")
+    for case, benchmarks in results["cases"].items():
+        for name, result in benchmarks.items():
+            print(f"{case:<12} {name:<12} {result['seconds']:10.4f} s {result['configurations_per_second']:12.1f} conf/s {result['megabytes_per_second']:8.2f} MB/s")
+
+    if args.compare is not None:
+        with args.compare.open(mode="rt") as file:
+            print()
+            compare(results, json.load(file))
+
+    if args.output is not None:
+        with args.output.open(mode="wt") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
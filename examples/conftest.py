@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path_factory, monkeypatch):
+    # The default cache directory follows XDG_CACHE_HOME, also in the fpdataviewer processes that tests start, so
+    # nothing is read from or written to the real cache of the user
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path_factory.mktemp("cache")))
@@ -0,0 +1,273 @@
+from copy import deepcopy
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from fpdataviewer.cli.analysis import bonds, neighbors, rdfs, results, sampling
+from fpdataviewer.cli.analysis.descriptor_store import DescriptorStore
+from fpdataviewer.cli.config import default_config, set_config
+from fpdataviewer.mlab import parsing
+from fpdataviewer.mlab.mlab import MLABConfigurationHeader
+
+
+def brute_force_rdf_bins(positions, lattice_vectors, type_ids, pair_mask, rmin, rmax, number_bins, images):
+    number_of_types = len(pair_mask)
+    counts = np.zeros((number_of_types, number_of_types, number_bins))
+    shifts = np.array([[x, y, z] for x in range(-images, images + 1) for y in range(-images, images + 1) for z in range(-images, images + 1)])
+
+    for conf_positions, lattice in zip(positions, lattice_vectors):
+        for shift in shifts:
+            distances = np.linalg.norm(conf_positions[None, :] + shift @ lattice - conf_positions[:, None], axis=2)
+            if not shift.any():
+                np.fill_diagonal(distances, np.inf)
+
+            centers, tos = np.nonzero((rmin <= distances) & (distances < rmax) & pair_mask[type_ids[:, None], type_ids[None, :]])
+            bins = ((distances[centers, tos] - rmin) / (rmax - rmin) * number_bins).astype(int)
+            np.add.at(counts, (type_ids[centers], type_ids[tos], bins), 1)
+
+    return counts
+
+
+def create_structures(seed, number_of_configurations, number_of_atoms):
+    rng = np.random.default_rng(seed)
+    lattice_vectors = np.array([[[4.0, 0.0, 0.0], [1.5, 3.5, 0.0], [0.7, 1.1, 3.0]],
+                                [[3.0, 0.0, 0.0], [-1.2, 4.0, 0.0], [0.3, -0.9, 5.0]]])[np.arange(number_of_configurations) % 2]
+    positions = rng.random((number_of_configurations, number_of_atoms, 3)) @ lattice_vectors \
+        + rng.normal(0, 2, (number_of_configurations, 1, 3))
+    type_ids = np.repeat(np.arange(3), [number_of_atoms // 4, number_of_atoms // 4, number_of_atoms - 2 * (number_of_atoms // 4)])
+
+    return positions, lattice_vectors, type_ids
+
+
+def calculate_rdf_bins(positions, lattice_vectors, type_ids, pair_mask, rmin, rmax, number_bins, threads=1):
+    neighbor_list = neighbors.build_neighbor_list(positions, lattice_vectors, rmax, np.arange(len(positions)), threads)
+
+    counts = np.zeros((len(pair_mask), len(pair_mask), number_bins))
+    rdfs._calculate_rdf_bins(neighbor_list.indptr, neighbor_list.indices, neighbor_list.distances, type_ids, pair_mask, rmin, rmax, number_bins, counts)
+
+    return counts
+
+
+@pytest.mark.parametrize("rmax", [1.5, 3.2, 6.5])
+def test_rdf_bins_triclinic(rmax):
+    # Also with rmax larger than the cell, which needs more than the nearest periodic images
+    positions, lattice_vectors, type_ids = create_structures(0, 2, 24)
+
+    # One pair of types is skipped
+    pair_mask = np.ones((3, 3), dtype=bool)
+    pair_mask[0, 2] = pair_mask[2, 0] = False
+
+    counts = calculate_rdf_bins(positions, lattice_vectors, type_ids, pair_mask, 0.5, rmax, 40)
+
+    assert np.array_equal(counts, brute_force_rdf_bins(positions, lattice_vectors, type_ids, pair_mask, 0.5, rmax, 40, 4))
+    assert not counts[0, 2].any()
+
+
+def test_neighbor_lists_parallel():
+    positions, lattice_vectors, type_ids = create_structures(1, 7, 40)
+
+    serial = neighbors.build_neighbor_list(positions, lattice_vectors, 4.6, np.arange(7), with_vectors=True)
+
+    for threads in [2, 3, 8]:
+        parallel = neighbors.build_neighbor_list(positions, lattice_vectors, 4.6, np.arange(7), threads, with_vectors=True)
+        assert np.array_equal(serial.indptr, parallel.indptr)
+        assert np.array_equal(serial.indices, parallel.indices)
+        assert np.array_equal(serial.vectors, parallel.vectors)
+
+    # Every pair is listed from both sides
+    centers = np.repeat(np.arange(40), np.diff(serial.indptr[3]))
+    listed = serial.indices[serial.indptr[3, 0]:serial.indptr[3, -1]]
+    assert sorted(zip(centers, listed)) == sorted(zip(listed, centers))
+
+    # Vectors are only kept when asked for
+    assert neighbors.build_neighbor_list(positions, lattice_vectors, 4.6, np.arange(7)).vectors is None
+
+
+def test_rdf_bins_parallel():
+    positions, lattice_vectors, type_ids = create_structures(1, 7, 40)
+    neighbor_list = neighbors.build_neighbor_list(positions, lattice_vectors, 5.0, np.arange(7))
+    pair_mask = np.ones((3, 3), dtype=bool)
+
+    serial = np.zeros((3, 3, 50))
+    rdfs._calculate_rdf_bins(neighbor_list.indptr, neighbor_list.indices, neighbor_list.distances, type_ids, pair_mask, 0.0, 5.0, 50, serial)
+
+    # More chunks than configurations as well
+    for threads in [2, 3, 8]:
+        parallel = np.zeros((3, 3, 50))
+        rdfs._calculate_rdf_bins_parallel(neighbor_list.indptr, neighbor_list.indices, neighbor_list.distances, type_ids, pair_mask,
+                                          0.0, 5.0, 50, parallel, threads)
+        assert np.array_equal(serial, parallel)
+
+
+def test_bond_bins_cubic():
+    # A simple cubic lattice of two types, every atom has six bonds at right angles (or straight)
+    grid = np.array([[x, y, z] for x in range(4) for y in range(4) for z in range(4)], dtype=float)
+    type_ids = np.array([(x + y + z) % 2 for x, y, z in grid.astype(int)])
+    order = np.argsort(type_ids, kind="stable")
+    positions, type_ids = (2. * grid[order])[None], type_ids[order]
+    lattice_vectors = np.eye(3)[None] * 8.
+
+    neighbor_list = neighbors.build_neighbor_list(positions, lattice_vectors, 3.5, np.arange(1), with_vectors=True)
+
+    coordination = np.zeros((2, 2, 33))
+    angles = np.zeros((2, 18))
+    bonds._calculate_bond_bins(neighbor_list.indptr, neighbor_list.indices, neighbor_list.vectors, neighbor_list.distances,
+                               type_ids, np.full((2, 2), 2.5), 18, coordination, angles)
+
+    assert coordination[0, 1, 6] == coordination[1, 0, 6] == 32
+    assert coordination[0, 0, 0] == coordination[1, 1, 0] == 32
+    assert angles[0, 9] == 32 * 12 and angles[0, 17] == 32 * 3
+    assert angles.sum() == 64 * 15
+
+
+def test_neighbor_lists_shared(monkeypatch):
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        section = parsing.split(parsing.load(file))[0]
+
+    config = deepcopy(default_config)
+    config["rdf"]["r_max"] = 6.0
+    set_config(config)
+
+    builds = []
+    build_neighbor_list = neighbors.build_neighbor_list
+    monkeypatch.setattr(neighbors, "build_neighbor_list", lambda *args, **kwargs: builds.append(args[2]) or build_neighbor_list(*args, **kwargs))
+    neighbors.clear_cache()
+
+    # Bonds reuse the lists that were built for the RDFs
+    rdfs.calculate_rdfs(section, with_vectors=True)
+    built = len(builds)
+    result = bonds.calculate_bonds(section)
+
+    assert built > 0 and len(builds) == built
+    assert result["coordination"][("Bi", "O")][0].sum() == pytest.approx(1.)
+    neighbors.clear_cache()
+
+
+def test_bonds_unknown_type(capsys):
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        section = parsing.split(parsing.load(file))[0]
+
+    # Types that are not elements have no covalent radius, their pairs are skipped instead of failing
+    header = section.header
+    types = tuple(("Xx" if atom_type == "O" else atom_type, amount) for atom_type, amount in header.number_of_atoms_per_type)
+    section = replace(section, header=replace(header, number_of_atoms_per_type=types))
+
+    config = deepcopy(default_config)
+    config["bonds"]["structures"] = 2
+    set_config(config)
+
+    result = bonds.calculate_bonds(section)
+
+    assert "Bi-Xx" in capsys.readouterr().out
+    assert list(result["coordination"]) == [("Bi", "Bi")]
+    assert result["coordination"][("Bi", "Bi")][0].sum() == pytest.approx(1.)
+
+
+def test_result_cache(tmp_path):
+    header = MLABConfigurationHeader(name="test", number_of_atom_types=1, number_of_atoms=2, number_of_atoms_per_type=(("Bi", 2),))
+    calculated = []
+
+    def calculate():
+        calculated.append(True)
+        return {"counts": np.arange(1000.)}
+
+    first = results.load_or_calculate(tmp_path, "hash", header, "rdf", {"bins": 10}, calculate)
+    second = results.load_or_calculate(tmp_path, "hash", header, "rdf", {"bins": 10}, calculate)
+    assert len(calculated) == 1
+    assert np.array_equal(first["counts"], second["counts"])
+
+    # Other files, sections, stages or settings are calculated again
+    results.load_or_calculate(tmp_path, "other hash", header, "rdf", {"bins": 10}, calculate)
+    results.load_or_calculate(tmp_path, "hash", header, "bonds", {"bins": 10}, calculate)
+    results.load_or_calculate(tmp_path, "hash", header, "rdf", {"bins": 20}, calculate)
+    assert len(calculated) == 4
+    assert len(list(tmp_path.iterdir())) == 4
+
+    # Only the most recently used entries are kept
+    results.load_or_calculate(tmp_path, "hash", header, "misc", None, calculate, max_size=10000)
+    assert [path.name.split("-")[0] for path in tmp_path.iterdir()] == ["misc"]
+
+
+def test_descriptor_store(tmp_path):
+    parameters = {"descriptor": "SOAP", "args": {"r_cut": 5.0}}
+    features = np.arange(60, dtype=np.float32).reshape(3, 4, 5)
+
+    store = DescriptorStore(tmp_path, parameters, 5)
+    for i in range(3):
+        store.put(f"configuration {i}", features[i])
+    assert np.array_equal(store.get("configuration 1"), features[1])
+    store.flush()
+
+    # Rows that were put after the last flush are lost
+    store.put("configuration 3", features[0])
+    del store
+
+    store = DescriptorStore(tmp_path, parameters, 5)
+    assert "configuration 2" in store and "configuration 3" not in store
+    store.put("configuration 3", features[2])
+    assert np.array_equal(store.get("configuration 2"), features[2])
+    assert np.array_equal(store.get("configuration 3"), features[2])
+
+    # Other parameters have their own store
+    assert "configuration 0" not in DescriptorStore(tmp_path, {"descriptor": "SOAP", "args": {"r_cut": 6.0}}, 5)
+
+    # A store never grows past its limit, the features that do not fit are kept on disk (not in memory) until the store
+    # is closed
+    store = DescriptorStore(tmp_path / "limited", parameters, 5, max_size=2 * features[0].nbytes)
+    for i in range(3):
+        store.put(f"configuration {i}", features[i])
+    store.flush()
+    assert np.array_equal(store.get("configuration 2"), features[2])
+    assert isinstance(store.get("configuration 2"), np.memmap)
+    assert sum(path.stat().st_size for path in store.path.glob("*.bin")) == 2 * features[0].nbytes
+    assert "configuration 2" not in DescriptorStore(tmp_path / "limited", parameters, 5)
+
+    overflow_path = store._overflow.path
+    store.close()
+    assert not overflow_path.exists()
+
+
+def test_descriptor_store_sparse(tmp_path):
+    features = np.zeros((3, 4, 50), dtype=np.float32)
+    features[:, [0, 2], [3, 40]] = [[1., 2.], [3., 4.], [5., 6.]]
+
+    store = DescriptorStore(tmp_path, {}, 50, sparse=True)
+    for i in range(3):
+        store.put(f"configuration {i}", features[i])
+    store.flush()
+
+    store = DescriptorStore(tmp_path, {}, 50, sparse=True)
+    assert store.get("configuration 1").nnz == 2
+    assert np.array_equal(store.get("configuration 1").toarray(), features[1])
+    assert np.array_equal(store.get("configuration 2")[[0, 2]].toarray(), features[2, [0, 2]])
+
+    # Dense and sparse stores are kept apart
+    assert "configuration 0" not in DescriptorStore(tmp_path, {}, 50)
+
+
+@pytest.mark.parametrize("method", ["random", "stratified", "farthest"])
+def test_sampling(method):
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        section = parsing.split(parsing.load(file))[0]
+
+    config = deepcopy(default_config)
+    config["sampling"]["method"] = method
+    set_config(config)
+
+    # Without replacement, the same for every analysis, and fewer structures are a subset of more
+    few = sampling.select_structures(section, 4)
+    more = sampling.select_structures(section, 8)
+    assert len(np.unique(few)) == 4 and len(np.unique(more)) == 8
+    assert np.array_equal(few, sampling.select_structures(section, 4))
+    assert set(few) <= set(more)
+    assert sampling.select_structures(section, len(section.configurations)) is None
+
+    # Seeded, so a fresh order is the same as well
+    sampling._cache = None
+    assert np.array_equal(few, sampling.select_structures(section, 4))
+
+    if method == "stratified":
+        # Every quarter of the energy range is covered
+        ranks = np.argsort(np.argsort(section.energies))
+        assert sorted(ranks[few] * 4 // len(ranks)) == [0, 1, 2, 3]
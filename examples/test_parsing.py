@@ -0,0 +1,438 @@
+import io
+import json
+import os
+import subprocess
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from fpdataviewer.cli.analysis.misc import calculate_misc, calculate_misc_stream
+from fpdataviewer.mlab import cache, lazy, parsing, validation
+from fpdataviewer.mlab.parsing import MLABBlockReader, ParserException
+
+data_files = [f for f in os.listdir('.') if f.startswith("ML_")]
+
+
+def assert_same_mlab(a, b):
+    assert a.number_of_configurations == b.number_of_configurations
+    assert a.atom_types == b.atom_types
+    assert a.reference_energies == b.reference_energies
+    assert a.atomic_masses == b.atomic_masses
+    assert a.numbers_of_basis_sets == b.numbers_of_basis_sets
+
+    assert [basis_set.name for basis_set in a.basis_sets] == [basis_set.name for basis_set in b.basis_sets]
+    for basis_set_a, basis_set_b in zip(a.basis_sets, b.basis_sets):
+        assert np.array_equal(basis_set_a.indices, basis_set_b.indices)
+
+    assert len(a.configurations) == len(b.configurations)
+    for conf_a, conf_b in zip(a.configurations, b.configurations):
+        assert conf_a.index == conf_b.index
+        assert conf_a.header == conf_b.header
+        assert conf_a.ctifor == conf_b.ctifor
+        assert conf_a.energy == conf_b.energy
+        assert conf_a.stress == conf_b.stress
+        assert np.array_equal(conf_a.lattice_vectors, conf_b.lattice_vectors)
+        assert np.array_equal(conf_a.positions, conf_b.positions)
+        assert np.array_equal(conf_a.forces, conf_b.forces)
+        assert (conf_a.charges is None) == (conf_b.charges is None)
+        if conf_a.charges is not None:
+            assert np.array_equal(conf_a.charges, conf_b.charges)
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_block_engine(data_file):
+    with open(data_file, mode="rt") as file:
+        expected = parsing.load(file)
+    with open(data_file, mode="rt") as file:
+        actual = parsing.load(file, engine="block")
+
+    assert_same_mlab(expected, actual)
+
+
+def test_block_engine_chunk_boundaries():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        text = file.read()
+
+    expected = list(MLABBlockReader(io.StringIO(text)).blocks)
+    actual = list(MLABBlockReader(io.StringIO(text), chunk_size=97).blocks)
+
+    assert expected == actual
+
+
+def test_block_engine_error_lines():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        text = file.read().replace("Total energy (eV)", "Total energy (meV)", 3)
+
+    messages = []
+    for engine in ["line", "block"]:
+        with pytest.raises(ParserException) as e:
+            parsing.load(io.StringIO(text), engine=engine)
+        messages.append(str(e.value))
+
+    assert messages[0] == messages[1]
+    assert messages[0].startswith("on lines ")
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_lazy_load(data_file, tmp_path):
+    path = tmp_path / data_file
+    path.write_bytes(open(data_file, mode="rb").read())
+
+    with open(data_file, mode="rt") as file:
+        expected = parsing.load(file)
+
+    assert_same_mlab(expected, lazy.load(path))
+    assert lazy.get_index_path(path).is_file()
+    assert_same_mlab(expected, lazy.load(path))
+
+
+def test_lazy_index_invalidation(tmp_path):
+    path = tmp_path / "ML_AB"
+    path.write_bytes(open("ML_AB_BiO_small", mode="rb").read())
+
+    lazy.load(path)
+    assert lazy.load_index(path, lazy.get_index_path(path)) is not None
+
+    with path.open(mode="ab") as file:
+        file.write(b"\n")
+
+    assert lazy.load_index(path, lazy.get_index_path(path)) is None
+
+
+def test_lazy_broken_index(tmp_path):
+    path = tmp_path / "ML_AB"
+    path.write_bytes(open("ML_AB_BiO_small", mode="rb").read())
+    index_path = lazy.get_index_path(path)
+
+    lazy.load(path)
+    index_path.write_bytes(index_path.read_bytes()[:100])
+
+    assert lazy.load_index(path, index_path) is None
+
+    with path.open(mode="rt") as file:
+        assert_same_mlab(parsing.load(file), lazy.load(path))
+    assert lazy.load_index(path, index_path) is not None
+    assert set(tmp_path.iterdir()) == {path, index_path}
+
+    empty_path = tmp_path / "ML_AB_empty"
+    empty_path.touch()
+
+    with pytest.raises(ParserException):
+        lazy.load(empty_path)
+
+
+def test_stream():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        expected = parsing.load(file)
+
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        mlab_stream = parsing.iter_configurations(file, engine="block")
+
+        assert mlab_stream.atom_types == expected.atom_types
+        assert len(mlab_stream.basis_sets) == len(expected.basis_sets)
+
+        section_numbers = [section_number for section_number, _ in parsing.split_stream(mlab_stream)]
+
+    assert section_numbers == [0] * len(expected.configurations)
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_stream_consumers(data_file):
+    with open(data_file, mode="rt") as file:
+        mlab = parsing.load(file)
+
+    with open(data_file, mode="rt") as file:
+        misc = calculate_misc_stream(parsing.iter_configurations(file))
+
+    assert len(misc) == len(parsing.split(mlab))
+    for actual, section in zip(misc, parsing.split(mlab)):
+        assert actual.equals(calculate_misc(section))
+
+    with open(data_file, mode="rt") as file:
+        validation.validate_stream(parsing.iter_configurations(file))
+
+
+def test_stream_validation_error():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        text = file.read().replace("Configuration num.      3", "Configuration num.      4", 1)
+
+    with pytest.raises(validation.ValidationException, match="not indexed sequentially"):
+        validation.validate_stream(parsing.iter_configurations(io.StringIO(text)))
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_parallel_load(data_file):
+    with open(data_file, mode="rt") as file:
+        expected = parsing.load(file)
+    with open(data_file, mode="rt") as file:
+        actual = parsing.load(file, engine="block", workers=2)
+
+    assert_same_mlab(expected, actual)
+    assert len({id(conf.header) for conf in actual.configurations}) == len({conf.header for conf in actual.configurations})
+
+
+def test_parallel_load_error_lines(tmp_path):
+    path = tmp_path / "ML_AB"
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        path.write_text(file.read().replace("Total energy (eV)", "Total energy (meV)", 12))
+
+    messages = []
+    for workers in [1, 3]:
+        with pytest.raises(ParserException) as e:
+            with path.open(mode="rt") as file:
+                parsing.load(file, workers=workers)
+        messages.append(str(e.value))
+
+    assert messages[0] == messages[1]
+
+
+def test_cache(tmp_path):
+    path = tmp_path / "ML_AB"
+    cache_dir = tmp_path / "cache"
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        text = file.read()
+    path.write_text(text)
+
+    with path.open(mode="rt") as file:
+        expected = parsing.load(file)
+
+    assert_same_mlab(expected, cache.load(path, cache_dir=cache_dir))
+    assert len(list(cache_dir.iterdir())) == 1
+    assert_same_mlab(expected, cache.load(path, cache_dir=cache_dir))
+
+    # Changed files are parsed again
+    path.write_text(text.replace("Configuration num.      3", "Configuration num.      4", 1))
+    assert cache.load(path, cache_dir=cache_dir).configurations[2].index == 4
+
+    # Entries that do not fit are not kept
+    cache.clear(cache_dir)
+    cache.load(path, cache_dir=cache_dir, max_size=0)
+    assert list(cache_dir.iterdir()) == []
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_scan(data_file):
+    with open(data_file, mode="rt") as file:
+        expected = [(conf.index, conf.header) for conf in parsing.load(file).configurations]
+
+    with open(data_file, mode="rt") as file:
+        assert parsing.scan(file) == expected
+        file.seek(0)
+        assert parsing.scan(io.StringIO(file.read()), engine="line") == expected
+
+
+def test_load_appended(tmp_path):
+    path = tmp_path / "ML_AB"
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        text = file.read()
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        expected = parsing.load(file)
+
+    # Written in pieces that end in the middle of configurations
+    cuts = [text.index("Configuration num.      4") + 100, text.index("Configuration num.      9"), len(text)]
+
+    configurations = []
+    resume_point = None
+    previous = 0
+    for cut in cuts:
+        with path.open(mode="at") as file:
+            file.write(text[previous:cut])
+        previous = cut
+
+        mlab, resume_point = parsing.load_appended(path, resume_point)
+        configurations.extend(mlab.configurations)
+
+    assert len(configurations) == len(expected.configurations) - 1
+
+    mlab, resume_point = parsing.load_appended(path, resume_point, include_last=True)
+    configurations.extend(mlab.configurations)
+
+    assert_same_mlab(expected, replace(mlab, configurations=configurations))
+    assert resume_point.number_of_configurations == len(expected.configurations)
+    assert parsing.load_appended(path, resume_point)[0].configurations == []
+
+    # Rewritten files are parsed from the start
+    path.write_text(text.replace("Total energy (eV)", "Total energy (meV)", 12))
+    with pytest.raises(ParserException) as e:
+        parsing.load_appended(path, resume_point)
+    with pytest.raises(ParserException) as expected_error:
+        with path.open(mode="rt") as file:
+            parsing.load(file)
+
+    assert str(e.value) == str(expected_error.value)
+
+
+@pytest.mark.parametrize("data_file", data_files)
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_split_columnar(data_file, use_cache, tmp_path):
+    with open(data_file, mode="rt") as file:
+        mlab = parsing.load(file)
+
+    if use_cache:
+        cache.load(data_file, cache_dir=tmp_path)
+        mlab = cache.load(data_file, cache_dir=tmp_path)
+
+    for section in parsing.split(mlab):
+        assert section.positions.shape == (len(section.configurations), section.number_of_atoms, 3)
+        assert section.lattice_vectors.shape == (len(section.configurations), 3, 3)
+
+        for i, conf in enumerate(section.configurations):
+            original = mlab.configurations[conf.index - 1]
+
+            assert np.array_equal(conf.positions, original.positions) and conf.positions.shape == original.positions.shape
+            assert np.array_equal(conf.forces, original.forces)
+            assert conf.energy == section.energies[i] == original.energy
+            assert np.shares_memory(conf.positions, section.positions)
+            assert np.shares_memory(conf.lattice_vectors, section.lattice_vectors)
+
+            # Sections are views into the arrays of the loaded file, not copies
+            assert np.shares_memory(original.positions, section.positions)
+            assert np.shares_memory(original.forces, section.forces)
+
+
+def test_basis_set_mask():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        section = parsing.split(parsing.load(file))[0]
+
+    # Bi atoms 4 and 15 of configuration 11 and 16 of configuration 12, O atoms 68, 111 and 112 of configuration 11
+    mask = section.get_basis_set_mask()
+    position = [conf.index for conf in section.configurations].index(11)
+
+    assert np.array_equal(np.flatnonzero(mask[position]), [3, 14, 67, 110, 111])
+    assert np.array_equal(np.flatnonzero(mask[position + 1]), [15])
+    assert mask.sum() == 6
+
+
+def test_basis_set_validation_reports_all_entries():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        mlab = parsing.load(file)
+
+    bi, o = mlab.basis_sets
+    indices = np.array(bi.indices)
+    indices[0] = (16, 1)
+    indices[1] = (11, 161)
+    indices[2] = (12, 100)
+    mlab = replace(mlab, basis_sets=[replace(bi, indices=indices), replace(o, indices=np.array([(20, 1), (1, 2), (11, 68)]))])
+
+    with pytest.raises(validation.ValidationException) as e:
+        validation.validate(mlab)
+
+    assert str(e.value).splitlines() == [
+        "problem validating file: basis set Bi references non-existent configrations 16",
+        "basis set Bi references non-existent atoms 161 in configration 11",
+        "basis set Bi references atoms of other types 100 in configration 12 (listed as O)",
+        "basis set O references non-existent configrations 20",
+        "basis set O references atoms of other types 2 in configration 1 (listed as Bi)",
+    ]
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_load_validated(data_file):
+    with open(data_file, mode="rt") as file:
+        expected = parsing.load(file)
+    with open(data_file, mode="rt") as file:
+        assert_same_mlab(expected, validation.load_validated(file))
+
+
+def test_load_validated_error(tmp_path):
+    path = tmp_path / "ML_AB"
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        path.write_text(file.read().replace("The number of configurations\n--------------------------------------------------\n        15",
+                                            "The number of configurations\n--------------------------------------------------\n        16"))
+
+    with pytest.raises(validation.ValidationException, match="is 16 but 15 were found"):
+        with path.open(mode="rt") as file:
+            validation.load_validated(file)
+
+    # Cached files are validated as well
+    cache.load(path, cache_dir=tmp_path / "cache")
+    with pytest.raises(validation.ValidationException, match="is 16 but 15 were found"):
+        cache.load(path, cache_dir=tmp_path / "cache", validate=True)
+
+
+def test_validation_report(tmp_path):
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        text = file.read()
+
+    # Three unrelated problems, which are all reported at once
+    text = text.replace("The number of configurations\n--------------------------------------------------\n        15",
+                        "The number of configurations\n--------------------------------------------------\n        16")
+    text = text.replace("         11     15\n", "         11    999\n")
+    lines = text.split("\n")
+    lines[982] = lines[982].split()[0] + "  NaN  " + lines[982].split()[2]
+    text = "\n".join(lines)
+
+    path = tmp_path / "ML_AB"
+    path.write_text(text)
+
+    with path.open(mode="rt") as file:
+        problems = validation.report(parsing.iter_configurations(file, engine="block"))
+
+    assert [problem.check for problem in problems] == ["physics", "global", "basis set"]
+    assert problems[0].configuration == 3 and problems[0].lines == (785, 1152)
+    assert "not finite" in problems[0].message
+    assert problems[1].configuration is None and "is 16 but 15 were found" in problems[1].message
+    assert problems[2].configuration == 11 and "999 in configration 11" in problems[2].message
+
+    # Loaded files are checked the same, only without lines
+    with path.open(mode="rt") as file:
+        mlab = parsing.load(file)
+    assert [replace(problem, lines=None) for problem in problems] == validation.report(mlab)
+
+    result = subprocess.run(["fpdataviewer", "validate", "--no-cache", "--json", "-", "-i", str(path)], capture_output=True)
+    report = json.loads(result.stdout)
+    assert report["format_ok"]
+    assert [problem["check"] for problem in report["problems"]] == ["physics", "global", "basis set"]
+    assert report["problems"][0]["lines"] == [785, 1152]
+
+
+def test_physics_report(monkeypatch):
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        mlab = parsing.load(file)
+
+    configurations = list(mlab.configurations)
+    configurations[1] = replace(configurations[1], energy=float("nan"))
+    configurations[4] = replace(configurations[4], lattice_vectors=np.zeros((3, 3)), forces=np.full_like(configurations[4].forces, np.inf))
+    configurations[8] = replace(configurations[8], positions=configurations[8].positions[:-1])
+    configurations[8].positions[0, 0] = np.nan
+    mlab = replace(mlab, configurations=configurations)
+
+    # Chunks of four, so that problems are found in different chunks and in a section with data of the wrong size
+    monkeypatch.setattr(validation, "_physics_chunk_size", 4)
+    problems = [(problem.check, problem.configuration, problem.message) for problem in validation.report(mlab)
+                if problem.check in ("physics", "configuration")]
+
+    assert [(check, configuration) for check, configuration, _ in problems] == \
+           [("physics", 2), ("physics", 5), ("physics", 5), ("configuration", 9), ("physics", 9)]
+    assert "Total energy" in problems[0][2]
+    assert "Forces" in problems[1][2] and "span no volume" in problems[2][2]
+    assert "Atomic positions" in problems[4][2] and "contains 1 values" in problems[4][2]
+
+
+def test_validation_report_format(tmp_path):
+    path = tmp_path / "ML_AB"
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        path.write_text(file.read().replace("Configuration num.      3", "Configuration num.      x"))
+
+    with path.open(mode="rt") as file:
+        problems = validation.report(parsing.iter_configurations(file))
+
+    assert [problem.check for problem in problems] == ["format"]
+    assert problems[0].lines == (785, 786) and problems[0].message.startswith("on lines 785-786:")
+
+    # Cached files are validated from their text as well, so problems keep their lines
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        path.write_text(file.read().replace("         11     15\n", "         11    999\n"))
+    cache.load(path)
+
+    result = subprocess.run(["fpdataviewer", "validate", "--json", "-", "-i", str(path)], capture_output=True)
+    assert json.loads(result.stdout)["problems"][0]["lines"] is not None
+
+    # A broken global header is a format problem too
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        path.write_text(file.read().replace("        15\n", "        x\n", 1))
+
+    result = subprocess.run(["fpdataviewer", "validate", "--no-cache", "--json", "-", "-i", str(path)], capture_output=True)
+    report = json.loads(result.stdout)
+    assert not report["format_ok"] and report["problems"][0]["lines"] == [5, 6]
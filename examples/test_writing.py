@@ -0,0 +1,125 @@
+import io
+import os
+import subprocess
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from fpdataviewer.cli.analysis.duplicates import find_duplicates
+from fpdataviewer.mlab import parsing, validation, writing
+from test_parsing import assert_same_mlab
+
+data_files = [f for f in os.listdir('.') if f.startswith("ML_")]
+
+
+def write_and_load(mlab, configurations=None):
+    stream = io.StringIO()
+    writing.write(stream, mlab, configurations)
+
+    return parsing.load(io.StringIO(stream.getvalue()))
+
+
+@pytest.mark.parametrize("data_file", data_files)
+def test_round_trip(data_file):
+    with open(data_file, mode="rt") as file:
+        mlab = parsing.load(file)
+
+    assert_same_mlab(mlab, write_and_load(mlab))
+    assert_same_mlab(mlab, write_and_load(mlab, iter(mlab.configurations)))
+
+
+@pytest.mark.parametrize("engine", ["line", "block"])
+def test_large_indices(engine):
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        mlab = parsing.load(file)
+
+    # Indices that fill the fields of the format, which write itself never gets to
+    conf = mlab.configurations[0]
+    global_header = writing._create_global_header(mlab, 1, [conf.header], {conf.index: 12345678})
+    basis_sets = [replace(basis_set, indices=np.array([[12345678, 1234567]])) for basis_set in global_header["basis_sets"]]
+
+    stream = io.StringIO()
+    writing._write_global_header(stream, dict(global_header, basis_sets=basis_sets, numbers_of_basis_sets=[1] * len(basis_sets)))
+    stream.write(writing._ConfigurationFormatter().format(conf, 12345678))
+
+    actual = parsing.load(io.StringIO(stream.getvalue()), engine=engine)
+
+    assert actual.configurations[0].index == 12345678
+    assert [np.reshape(basis_set.indices, (-1, 2)).tolist() for basis_set in actual.basis_sets] == [[[12345678, 1234567]]] * len(basis_sets)
+
+
+def test_subset():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        mlab = parsing.load(file)
+
+    selected = writing.subset(mlab, [10, 11, 2])
+    validation.validate(selected)
+
+    assert [conf.energy for conf in selected.configurations] == [mlab.configurations[i].energy for i in [10, 11, 2]]
+    # Basis sets of the original file refer to configurations 11 and 12, which are now the first two
+    assert set(np.unique(np.concatenate([basis_set.indices[:, 0] for basis_set in selected.basis_sets]))) == {1, 2}
+
+    actual = write_and_load(selected)
+    validation.validate(actual)
+    assert_same_mlab(selected, actual)
+
+    # Writing a selection directly gives the same file
+    stream = io.StringIO()
+    writing.write(stream, mlab, [mlab.configurations[i] for i in [10, 11, 2]])
+    assert_same_mlab(selected, parsing.load(io.StringIO(stream.getvalue())))
+
+
+def test_merge():
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        a = parsing.load(file)
+    with open("ML_AB_GRAPHENE", mode="rt") as file:
+        b = parsing.load(file)
+
+    merged = writing.merge([a, b, a])
+    validation.validate(merged)
+
+    assert merged.atom_types == ["Bi", "O", "C"]
+    assert len(merged.configurations) == 2 * len(a.configurations) + len(b.configurations)
+    assert merged.numbers_of_basis_sets == [2 * n for n in a.numbers_of_basis_sets] + b.numbers_of_basis_sets
+
+    assert_same_mlab(merged, write_and_load(merged))
+
+
+def test_convert_to_mlab(tmp_path):
+    output_file = tmp_path / "ML_AB"
+    result = subprocess.run(["fpdataviewer", "convert", "-i", "ML_AB_BiO_small", "-o", str(output_file), "-f", "vasp-mlab", "-t", "vasp-mlab", "-x", "::2", "--no-cache"],
+                            capture_output=True)
+    assert result.returncode == 0
+
+    with open("ML_AB_BiO_small", mode="rt") as file:
+        expected = writing.subset(parsing.load(file), slice(None, None, 2))
+    with output_file.open(mode="rt") as file:
+        assert_same_mlab(expected, parsing.load(file))
+
+
+def test_deduplicate(tmp_path):
+    with open("ML_AB_GRAPHENE", mode="rt") as file:
+        mlab = parsing.load(file)
+
+    # Exact copies, and copies with slightly displaced atoms
+    rng = np.random.default_rng(0)
+    noisy = writing.reindex(replace(mlab, configurations=[replace(conf, positions=conf.positions + rng.normal(0, 1e-4, conf.positions.shape))
+                                                          for conf in mlab.configurations]))
+
+    input_file = tmp_path / "ML_AB_input"
+    with input_file.open(mode="wt") as file:
+        writing.write(file, writing.merge([mlab, mlab, noisy]))
+
+    duplicates = find_duplicates(parsing.split(writing.merge([mlab, mlab, noisy]))[0])
+    assert len(duplicates) == 2 * len(mlab.configurations)
+    assert (duplicates["duplicate_of"] <= len(mlab.configurations)).all()
+    assert duplicates["exact"].sum() == len(mlab.configurations)
+
+    output_file = tmp_path / "ML_AB"
+    result = subprocess.run(["fpdataviewer", "convert", "-i", str(input_file), "-o", str(output_file), "-f", "vasp-mlab", "-t", "vasp-mlab", "--deduplicate", "--no-cache"],
+                            capture_output=True)
+    assert result.returncode == 0
+
+    with output_file.open(mode="rt") as file:
+        assert_same_mlab(mlab, parsing.load(file))
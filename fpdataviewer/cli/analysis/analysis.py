@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+from pathlib import Path
+from typing import Optional
+
 import numpy as np
 
 from fpdataviewer.cli.config import get_config, set_config
@@ -14,16 +17,12 @@ def gather_metadata(args, section: MLABSection) -> dict:
 
     section_metadata = {}
 
-    min_offset = float("inf")
     offset_matrix = np.array([[x, y, z]
                               for x in [-1, 0, 1]
                               for y in [-1, 0, 1]
                               for z in [-1, 0, 1]
                               if not x == y == z == 0])
-    for conf in section.configurations:
-        offset = min(np.linalg.norm(offset_matrix @ conf.lattice_vectors, axis=1))
-        if offset < min_offset:
-            min_offset = offset
+    min_offset = np.min(np.linalg.norm(offset_matrix @ section.lattice_vectors, axis=2))
 
     min_offset /= 2
 
@@ -36,23 +35,50 @@ def gather_metadata(args, section: MLABSection) -> dict:
     set_config(_temporary_config)
 
     from fpdataviewer.cli.analysis.misc import calculate_misc
-    section_metadata["misc"] = calculate_misc(section)
+    section_metadata["misc"] = _load_or_calculate(args, section, "misc", None, lambda: calculate_misc(section))
 
     if "rdf" not in args.skip:
+        from fpdataviewer.cli.analysis import neighbors
+        from fpdataviewer.cli.analysis.bonds import calculate_bonds
         from fpdataviewer.cli.analysis.rdfs import calculate_rdfs
-        section_metadata["rdf"] = calculate_rdfs(section)
+
+        # Bonds follow the RDFs, so the RDF neighbour lists are built with the vectors that bonds need, which lets bonds
+        # take them from the cache. They are released once both are done.
+        section_metadata["rdf"] = _load_or_calculate(args, section, "rdf", [_temporary_config["rdf"], _temporary_config.get("sampling")], lambda: calculate_rdfs(section, with_vectors=True))
+        section_metadata["bonds"] = _load_or_calculate(args, section, "bonds", [_temporary_config["bonds"], _temporary_config.get("sampling")], lambda: calculate_bonds(section))
+
+        neighbors.clear_cache()
 
     if "desc" not in args.skip:
         from fpdataviewer.cli.analysis.descriptors import calculate_descriptors
-        section_metadata["desc"] = calculate_descriptors(section)
+        section_metadata["desc"] = _load_or_calculate(args, section, "desc", [_temporary_config["descriptors"], _temporary_config.get("sampling")], lambda: calculate_descriptors(section, _get_store_dir(args)))
 
     if "img" not in args.skip:
         from fpdataviewer.cli.analysis.images import render_images
-        section_metadata["img"] = render_images(section)
+        section_metadata["img"] = _load_or_calculate(args, section, "img", _temporary_config["rendering"], lambda: render_images(section))
 
     return section_metadata
 
 
+def _load_or_calculate(args, section: MLABSection, stage: str, config, calculate):
+    # Results are kept on disk per stage, so plotting the same file again only costs the plotting itself
+    if getattr(args, "content_hash", None) is None:
+        return calculate()
+
+    from fpdataviewer.cli.analysis import results
+    from fpdataviewer.mlab import cache
+    return results.load_or_calculate(cache.get_default_cache_dir() / "results", args.content_hash, section.header, stage, config, calculate)
+
+
+def _get_store_dir(args) -> Optional[Path]:
+    # Feature vectors outlive the results cache, so that new projections of the same structures reuse them
+    if not args.use_cache:
+        return None
+
+    from fpdataviewer.mlab import cache
+    return cache.get_default_cache_dir() / "descriptors"
+
+
 def find_and_replace(config: dict, old_value: str, new_value: str) -> None:
     for key, value in config.items():
         if isinstance(value, dict):
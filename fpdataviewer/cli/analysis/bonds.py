@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import numpy as np
+from numba import njit
+from numpy.typing import ArrayLike
+
+from fpdataviewer.cli.analysis.neighbors import iter_neighbor_lists
+from fpdataviewer.cli.analysis.sampling import select_structures
+from fpdataviewer.cli.config import get_config
+from fpdataviewer.mlab.mlab import MLABSection
+
+# Coordination numbers above this are counted as this
+_max_coordination = 32
+
+
+def calculate_bonds(section: MLABSection) -> dict:
+    scale = get_config()["bonds"]["scale"]
+    bin_number = get_config()["bonds"]["bins"]
+    structures = get_config()["bonds"]["structures"]
+    threads = get_config()["bonds"].get("threads", 0)
+
+    if isinstance(structures, float) and 0. <= structures <= 1.:
+        structures = int(structures * len(section.configurations))
+
+    cutoffs = _get_cutoffs_from_config(section, scale)
+
+    print(f"\rcalculating coordination numbers and bond angles ... ", end="", flush=True)
+
+    return _calculate_bonds(section, cutoffs, bin_number, structures, threads)
+
+
+def _get_cutoffs_from_config(section: MLABSection, scale: float) -> ArrayLike:
+    # Atoms are bonded when they are closer than the sum of their covalent radii (scaled), unless a cutoff is given
+    from ase.data import atomic_numbers, covalent_radii
+
+    atoms = [atom for atom, _ in section.number_of_atoms_per_type]
+
+    cutoffs = np.full((len(atoms), len(atoms)), np.nan)
+    for i, atom1 in enumerate(atoms):
+        for j, atom2 in enumerate(atoms):
+            if atom1 in atomic_numbers and atom2 in atomic_numbers:
+                cutoffs[i, j] = scale * (covalent_radii[atomic_numbers[atom1]] + covalent_radii[atomic_numbers[atom2]])
+
+    for pair_str, cutoff in get_config()["bonds"].get("cutoffs", {}).items():
+        atom1, atom2 = pair_str.split("-")
+        if atom1 in atoms and atom2 in atoms:
+            cutoffs[atoms.index(atom1), atoms.index(atom2)] = cutoff
+            cutoffs[atoms.index(atom2), atoms.index(atom1)] = cutoff
+
+    # Pairs without a cutoff never bond and are left out, instead of failing the whole plot
+    for i, j in np.argwhere(np.isnan(cutoffs)):
+        if i <= j:
+            print(f"\rno covalent radius known for {atoms[i]}-{atoms[j]}, skipping its bonds (give its cutoff in the config)")
+
+    return np.nan_to_num(cutoffs, nan=0.)
+
+
+def _calculate_bonds(section: MLABSection,
+                     cutoffs: ArrayLike,
+                     number_bins: int,
+                     structure_count: int,
+                     threads: int = 1) -> dict:
+    # Returns the distribution of the number of bonded neighbours of every type around every type of atom, and the
+    # distribution of angles between bonds of every type of atom (in degrees).
+    types = [atom_type for atom_type, _ in section.number_of_atoms_per_type]
+    type_ids = np.asarray(section.header.type_ids, dtype=np.int64)
+
+    selected = select_structures(section, structure_count)
+
+    coordination_counts = np.zeros((len(types), len(types), _max_coordination + 1))
+    angle_counts = np.zeros((len(types), number_bins))
+
+    neighbor_lists = iter_neighbor_lists(section, np.max(cutoffs), selected, threads, with_vectors=True) if np.max(cutoffs) > 0 else []
+
+    for neighbor_list in neighbor_lists:
+        _calculate_bond_bins(neighbor_list.indptr,
+                             neighbor_list.indices,
+                             neighbor_list.vectors,
+                             neighbor_list.distances,
+                             type_ids,
+                             np.ascontiguousarray(cutoffs, dtype=np.float64),
+                             number_bins,
+                             coordination_counts,
+                             angle_counts)
+
+    numbers = np.arange(_max_coordination + 1)
+    highest = max(1, np.max(np.nonzero(coordination_counts.any(axis=(0, 1)))[0], initial=0) + 1)
+
+    bins = np.linspace(0., 180., number_bins + 1)
+
+    coordination = {}
+    angles = {}
+    for center_id, center in enumerate(types):
+        for to_id, to in enumerate(types):
+            if cutoffs[center_id, to_id] <= 0:
+                continue
+
+            total = coordination_counts[center_id, to_id].sum()
+            coordination[(center, to)] = (coordination_counts[center_id, to_id, :highest] / max(total, 1), numbers[:highest])
+
+        total = angle_counts[center_id].sum()
+        angles[center] = (angle_counts[center_id] / max(total, 1) / (bins[1] - bins[0]), bins)
+
+    return {
+        "coordination": coordination,
+        "angles": angles,
+    }
+
+
+@njit
+def _calculate_bond_bins(indptr,
+                         indices,
+                         vectors,
+                         distances,
+                         type_ids,
+                         cutoffs,
+                         number_bins: int,
+                         coordination_counts,
+                         angle_counts) -> None:
+    number_of_types = len(cutoffs)
+    coordination = np.zeros(number_of_types, dtype=np.int64)
+    bonds = np.empty(indices.shape[0], dtype=np.int64)
+
+    for configuration in range(len(indptr)):
+        for center in range(len(indptr[configuration]) - 1):
+            center_type = type_ids[center]
+            coordination[:] = 0
+
+            number_of_bonds = 0
+            for k in range(indptr[configuration, center], indptr[configuration, center + 1]):
+                to_type = type_ids[indices[k]]
+
+                if distances[k] < cutoffs[center_type, to_type]:
+                    coordination[to_type] += 1
+                    bonds[number_of_bonds] = k
+                    number_of_bonds += 1
+
+            for to_type in range(number_of_types):
+                coordination_counts[center_type, to_type, min(coordination[to_type], coordination_counts.shape[2] - 1)] += 1
+
+            for a in range(number_of_bonds):
+                for b in range(a + 1, number_of_bonds):
+                    i, j = bonds[a], bonds[b]
+                    cosine = (vectors[i, 0] * vectors[j, 0] + vectors[i, 1] * vectors[j, 1] + vectors[i, 2] * vectors[j, 2]) / (distances[i] * distances[j])
+                    angle = np.degrees(np.arccos(min(1., max(-1., cosine))))
+
+                    angle_counts[center_type, min(int(angle / 180. * number_bins), number_bins - 1)] += 1
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from numpy.typing import ArrayLike
+from scipy.sparse import csr_matrix
+
+from fpdataviewer.mlab import cache
+from fpdataviewer.mlab.mlab import MLABConfiguration
+
+_store_version = 2
+_default_max_size = 8 * 1024 ** 3
+
+
+def hash_configuration(configuration: MLABConfiguration) -> str:
+    # Descriptors only depend on the atom types, cell and positions of a configuration
+    configuration_hash = hashlib.blake2b(digest_size=16)
+    configuration_hash.update(" ".join(configuration.generate_type_lookup()).encode())
+    configuration_hash.update(np.ascontiguousarray(configuration.lattice_vectors, dtype=np.float64).tobytes())
+    configuration_hash.update(np.ascontiguousarray(configuration.positions, dtype=np.float64).tobytes())
+
+    return configuration_hash.hexdigest()
+
+
+def hash_parameters(parameters: dict) -> str:
+    return hashlib.blake2b(json.dumps(parameters, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class DescriptorStore:
+    # Feature vectors of every atom of a configuration, for one set of descriptor parameters. Features are appended to a
+    # flat float32 file, which is read through a memory map, the index maps configuration hashes to their rows. Sparse
+    # stores keep only nonzero features, with their columns and the offset of every row in two more files, and return
+    # scipy CSR matrices. A store never grows past max_size (None for no limit), features that do not fit anymore go to
+    # a temporary store without a limit, which is removed when the store is closed.
+    def __init__(self,
+                 root: Path,
+                 parameters: dict,
+                 number_of_features: int,
+                 max_size: Optional[int] = _default_max_size,
+                 sparse: bool = False):
+        self.root = root
+        self.parameters = parameters
+        self.path = root / hash_parameters(dict(parameters, sparse=sparse))
+        self.number_of_features = number_of_features
+        self.max_size = max_size
+        self.sparse = sparse
+
+        self._entries = {}
+        self._rows = 0
+        self._values = 0
+        self._memmaps = None
+        self._overflow = None
+        self._overflow_dir = None
+
+        try:
+            with (self.path / "index.json").open(mode="rt") as file:
+                index = json.load(file)
+
+            if index["version"] == _store_version and index["number_of_features"] == number_of_features:
+                self._entries = {key: tuple(rows) for key, rows in index["entries"].items()}
+                self._rows = index["rows"]
+                self._values = index["values"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # Rows written after the last index update are overwritten, files that lost rows are started over
+        self.path.mkdir(parents=True, exist_ok=True)
+        sizes = self._get_file_sizes()
+        for name, size in sizes.items():
+            if (self.path / name).is_file() and (self.path / name).stat().st_size < size:
+                self._entries = {}
+                self._rows = 0
+                self._values = 0
+
+        for name, size in self._get_file_sizes().items():
+            with (self.path / name).open(mode="ab") as file:
+                file.truncate(size)
+
+    def _get_file_sizes(self) -> dict[str, int]:
+        if self.sparse:
+            return {"features.bin": 4 * self._values, "columns.bin": 4 * self._values, "rows.bin": 8 * self._rows}
+        else:
+            return {"features.bin": 4 * self._values}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or self._overflow is not None and key in self._overflow
+
+    def get(self, key: str) -> Union[ArrayLike, csr_matrix]:
+        if key not in self._entries and self._overflow is not None:
+            return self._overflow.get(key)
+
+        start, end = self._entries[key]
+
+        if self._memmaps is None:
+            self._memmaps = {name: np.memmap(self.path / name, dtype=dtype, mode="r", shape=(size // np.dtype(dtype).itemsize,))
+                             for (name, size), dtype in zip(self._get_file_sizes().items(), [np.float32, np.int32, np.int64])
+                             if size > 0}
+
+        if not self.sparse:
+            return self._memmaps["features.bin"][start * self.number_of_features:end * self.number_of_features].reshape(-1, self.number_of_features)
+
+        offsets = np.append(self._memmaps["rows.bin"][start:end], self._memmaps["rows.bin"][end] if end < self._rows else self._values)
+        values = slice(offsets[0], offsets[-1])
+
+        return csr_matrix((self._memmaps["features.bin"][values], self._memmaps["columns.bin"][values], offsets - offsets[0]),
+                          shape=(end - start, self.number_of_features))
+
+    def put(self, key: str, features: Union[ArrayLike, csr_matrix]) -> None:
+        if self.sparse:
+            features = csr_matrix(features, dtype=np.float32)
+            features.sum_duplicates()
+            size = 8 * features.nnz + 8 * features.shape[0]
+        else:
+            features = np.ascontiguousarray(np.reshape(features, (-1, self.number_of_features)), dtype=np.float32)
+            size = 4 * features.size
+
+        if self.max_size is not None and sum(self._get_file_sizes().values()) + size > self.max_size:
+            if self._overflow is None:
+                print(f"\rdescriptor store is full ({self.max_size / 1024 ** 3:.1f} GiB), further feature vectors are kept for this run only")
+
+                self._overflow_dir = tempfile.TemporaryDirectory()
+                self._overflow = DescriptorStore(Path(self._overflow_dir.name), self.parameters, self.number_of_features, None, self.sparse)
+
+            self._overflow.put(key, features)
+            return
+
+        if self.sparse:
+            with (self.path / "features.bin").open(mode="ab") as file:
+                file.write(np.ascontiguousarray(features.data, dtype=np.float32).tobytes())
+            with (self.path / "columns.bin").open(mode="ab") as file:
+                file.write(np.ascontiguousarray(features.indices, dtype=np.int32).tobytes())
+            with (self.path / "rows.bin").open(mode="ab") as file:
+                file.write(np.ascontiguousarray(self._values + features.indptr[:-1], dtype=np.int64).tobytes())
+
+            rows, values = features.shape[0], features.nnz
+        else:
+            with (self.path / "features.bin").open(mode="ab") as file:
+                file.write(features.tobytes())
+
+            rows, values = len(features), features.size
+
+        self._entries[key] = (self._rows, self._rows + rows)
+        self._rows += rows
+        self._values += values
+        self._memmaps = None
+
+    def flush(self) -> None:
+        index = {
+            "version": _store_version,
+            "number_of_features": self.number_of_features,
+            "rows": self._rows,
+            "values": self._values,
+            "entries": self._entries,
+        }
+
+        def write(temporary_path: Path) -> None:
+            with temporary_path.open(mode="wt") as file:
+                json.dump(index, file)
+
+        cache.write_atomically(self.path / "index.json", write)
+
+        # Least recently used stores go first, every flush of a store updates its index
+        if self.max_size is not None:
+            cache.evict(self.root.iterdir(), self.max_size, lambda path: (path / "index.json").stat().st_mtime, keep=self.path)
+
+    def close(self) -> None:
+        self._memmaps = None
+
+        if self._overflow_dir is not None:
+            self._overflow.close()
+            self._overflow_dir.cleanup()
+            self._overflow = None
+            self._overflow_dir = None
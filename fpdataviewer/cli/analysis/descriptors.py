@@ -1,63 +1,206 @@
 from __future__ import annotations
 
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import nullcontext
+from importlib.metadata import version
+from pathlib import Path
+from typing import Optional
+
 import numpy as np
 import pandas as pd
+from ase import Atoms
 from dscribe.descriptors import SOAP, ACSF, LMBTR
-from sklearn.decomposition import PCA
+from numpy.typing import ArrayLike
+from scipy.sparse import vstack
+from sklearn.decomposition import IncrementalPCA, TruncatedSVD
 
+from fpdataviewer.cli.analysis.descriptor_store import DescriptorStore, hash_configuration, hash_parameters
+from fpdataviewer.cli.analysis.sampling import select_structures
 from fpdataviewer.cli.config import get_config
-from fpdataviewer.mlab import ase_adapter
 from fpdataviewer.mlab.mlab import MLABSection
 
+# Feature vectors are created in batches of configurations that take about this many bytes
+_max_batch_size = 1 << 28
+
+_executor = None
+_executor_workers = None
+_worker_descriptor_objects = {}
+
 
-def calculate_descriptors(section: MLABSection) -> dict[str, pd.DataFrame]:
+def calculate_descriptors(section: MLABSection, store_dir: Optional[Path] = None) -> dict[str, pd.DataFrame]:
+    # Feature vectors are kept in a descriptor store in store_dir, or in a temporary one without it
     structures = get_config()["descriptors"]["structures"]
+    workers = get_config()["descriptors"].get("workers", 0)
+    seed = get_config().get("sampling", {}).get("seed", 0)
 
     if isinstance(structures, float) and 0. <= structures <= 1.:
         structures = int(structures * len(section.configurations))
 
-    section_ase = ase_adapter.from_section(section)
-    section_ase = np.random.choice(section_ase, structures) if 1 <= structures < len(section_ase) else section_ase
+    selected = select_structures(section, structures)
+    selected = np.arange(len(section.configurations)) if selected is None else selected
 
-    descriptor_object = get_descriptor_object(section)
+    descriptor_class, descriptor_args = get_descriptor_arguments(section)
+    number_of_features = descriptor_class(**descriptor_args).get_number_of_features()
+    parameters = {"descriptor": descriptor_class.__name__, "version": version("dscribe"), "args": descriptor_args}
+
+    basis_set_mask = section.get_basis_set_mask()
 
     descriptors_per_type = {}
 
-    for type, _ in section.number_of_atoms_per_type:
-        print(f"\rcalculating descriptors for {type} ... ", end="", flush=True)
+    with tempfile.TemporaryDirectory() if store_dir is None else nullcontext(store_dir) as store_dir:
+        store = DescriptorStore(Path(store_dir), parameters, number_of_features, sparse=descriptor_args["sparse"])
+        keys = [hash_configuration(section.configurations[i]) for i in selected]
 
-        centers = [i for i, t in enumerate(section.generate_type_lookup()) if t == type]
+        # Descriptors of all atom types are created in a single pass, and split by type afterwards
+        print(f"\rcalculating descriptors ... ", end="", flush=True)
+        _create_missing(section, selected, keys, descriptor_class, descriptor_args, store, workers)
 
-        feature_vectors = descriptor_object.create(section_ase, centers=[centers for _ in section_ase], n_jobs=-1)
-        feature_vectors = feature_vectors.reshape((-1, feature_vectors.shape[-1]))
+        for type, _ in section.number_of_atoms_per_type:
+            print(f"\rprojecting descriptors for {type} ... ", end="", flush=True)
 
-        pca = PCA(n_components=2, copy=False)
+            centers = [i for i, t in enumerate(section.generate_type_lookup()) if t == type]
 
-        feature_vectors = pca.fit_transform(feature_vectors)
+            feature_vectors = _calculate_principal_components(keys, centers, store, seed)
 
-        all_basis_sets = [(i, j) for basis_set in section.source.basis_sets for i, j in basis_set.indices]
+            energies = np.repeat(section.energies[selected], len(centers))
+            is_basis = basis_set_mask[np.ix_(selected, centers)].reshape(-1)
 
-        energies = [conf.energy for conf in section.configurations for _ in centers]
-        is_basis = [(i, j) in all_basis_sets for i, conf in enumerate(section.configurations) for j in centers]
+            descriptors = pd.DataFrame({
+                "pc_1": feature_vectors[:, 0],
+                "pc_2": feature_vectors[:, 1],
+                "energy": energies,
+                "basis": is_basis,
+            })
 
-        descriptors = pd.DataFrame({
-            "pc_1": feature_vectors[:, 0],
-            "pc_2": feature_vectors[:, 1],
-            "energy": energies,
-            "basis": is_basis,
-        })
+            # Shuffled so that no structures are always drawn on top, with the sampling seed to stay reproducible
+            descriptors_per_type[type] = descriptors.sample(frac=1, random_state=seed).reset_index(drop=True)
 
-        descriptors_per_type[type] = descriptors.sample(frac=1).reset_index(drop=True)
+        store.close()
 
     return descriptors_per_type
 
 
+def _create_missing(section: MLABSection,
+                    selected: ArrayLike,
+                    keys: list[str],
+                    descriptor_class: type,
+                    descriptor_args: dict,
+                    store: DescriptorStore,
+                    workers: int) -> None:
+    # Feature vectors of all atoms are created for configurations that are not in the store yet, in batches of
+    # configurations that are spread over a process pool. Only a few batches per worker are in flight at any time, so
+    # memory stays bounded, and the pool is shared by all sections and kept between them.
+    missing = list({key: i for i, key in zip(selected, keys) if key not in store}.items())
+
+    workers = os.cpu_count() if workers <= 0 else workers
+    batch_size = _get_batch_size(section.header.number_of_atoms, store.number_of_features)
+    batch_size = max(1, min(batch_size, -(-len(missing) // (4 * workers))))
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+
+    def submit(batch: list[tuple[str, int]]) -> Future:
+        # Only the arrays are sent to the workers, which build the atoms themselves
+        return _get_executor(workers).submit(_create_batch,
+                                             descriptor_class,
+                                             descriptor_args,
+                                             section.generate_type_lookup(),
+                                             np.array([section.configurations[i].positions for _, i in batch]),
+                                             np.array([section.configurations[i].lattice_vectors for _, i in batch]))
+
+    pending = deque(submit(batch) for batch in batches[:2 * workers])
+    for i, batch in enumerate(batches):
+        feature_vectors = pending.popleft().result()
+        if i + 2 * workers < len(batches):
+            pending.append(submit(batches[i + 2 * workers]))
+
+        for (key, _), features in zip(batch, feature_vectors):
+            store.put(key, features)
+
+    store.flush()
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    global _executor, _executor_workers
+
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown()
+
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+
+    return _executor
+
+
+def _create_batch(descriptor_class: type, descriptor_args: dict, symbols: tuple[str, ...], positions: ArrayLike, lattice_vectors: ArrayLike) -> ArrayLike:
+    # Descriptor objects are kept per worker, since some (like SOAP) take a while to set up
+    key = hash_parameters({"descriptor": descriptor_class.__name__, "args": descriptor_args})
+    if key not in _worker_descriptor_objects:
+        _worker_descriptor_objects[key] = descriptor_class(**descriptor_args)
+
+    systems = [Atoms(symbols=symbols, positions=conf_positions, cell=conf_lattice_vectors, pbc=True)
+               for conf_positions, conf_lattice_vectors in zip(positions, lattice_vectors)]
+
+    feature_vectors = _worker_descriptor_objects[key].create(systems, n_jobs=1)
+    feature_vectors = feature_vectors.reshape((len(systems), len(symbols), -1))
+
+    # Sparse output (a pydata sparse array) is sent back as a scipy matrix per configuration
+    if descriptor_args["sparse"]:
+        return [feature_vectors[i].to_scipy_sparse().tocsr() for i in range(len(systems))]
+
+    return feature_vectors
+
+
+def _calculate_principal_components(keys: list[str], centers: list[int], store: DescriptorStore, seed: int = 0) -> ArrayLike:
+    # The projection is fitted incrementally, a batch of configurations at a time read from the store
+    if store.sparse:
+        return _calculate_singular_components(keys, centers, store, seed)
+
+    batch_size = _get_batch_size(len(centers), store.number_of_features)
+
+    # Every batch needs at least as many rows as components, a short last batch is fitted with the one before it
+    starts = list(range(0, len(keys), batch_size))
+    if len(starts) > 1 and (len(keys) - starts[-1]) * len(centers) < 2:
+        starts.pop()
+    batches = [keys[start:end] for start, end in zip(starts, starts[1:] + [len(keys)])]
+
+    def load_batch(batch: list[str]) -> ArrayLike:
+        return np.concatenate([store.get(key)[centers] for key in batch])
+
+    pca = IncrementalPCA(n_components=2)
+    for batch in batches:
+        pca.partial_fit(load_batch(batch))
+
+    return np.concatenate([pca.transform(load_batch(batch)) for batch in batches])
+
+
+def _calculate_singular_components(keys: list[str], centers: list[int], store: DescriptorStore, seed: int = 0) -> ArrayLike:
+    # Sparse feature vectors are reduced by a truncated SVD, which works on the sparse matrix directly. Unlike PCA it
+    # does not center the features, which would make them dense. Its randomized solver is seeded, so that the
+    # projection is the same in every run.
+    feature_vectors = vstack([store.get(key)[centers] for key in keys], format="csr")
+
+    return TruncatedSVD(n_components=2, random_state=seed).fit_transform(feature_vectors)
+
+
+def _get_batch_size(number_of_atoms: int, number_of_features: int) -> int:
+    return max(1, _max_batch_size // max(4 * number_of_atoms * number_of_features, 1))
+
+
 def get_descriptor_object(section: MLABSection):
+    descriptor_class, args = get_descriptor_arguments(section)
+
+    return descriptor_class(**args)
+
+
+def get_descriptor_arguments(section: MLABSection) -> tuple[type, dict]:
     global_args = {
         "species": [type for type, _ in section.number_of_atoms_per_type],
         "periodic": True,
         "average": "off",
-        "sparse": False,
+        "sparse": get_config()["descriptors"].get("sparse", False),
         "dtype": "float32",
     }
 
@@ -66,21 +209,21 @@ def get_descriptor_object(section: MLABSection):
         args.update(global_args)
         args.update(get_config()["descriptors"]["soap"])
 
-        return SOAP(**args)
+        return SOAP, args
 
     elif "acsf" in get_config()["descriptors"]:
         args = {}
         args.update(global_args)
         args.update(get_config()["descriptors"]["acsf"])
 
-        return ACSF(**args)
+        return ACSF, args
 
     elif "lmbtr" in get_config()["descriptors"]:
         args = {}
         args.update(global_args)
         args.update(get_config()["descriptors"]["lmbtr"])
 
-        return LMBTR(**args)
+        return LMBTR, args
 
     else:
         raise ValueError("no or unsupported descriptors named in config")
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from numba import njit
+from numpy.typing import ArrayLike
+from sklearn.neighbors import KDTree
+
+from fpdataviewer.mlab.mlab import MLABSection
+
+_chunk_size = 4096
+
+
+def find_duplicates(section: MLABSection,
+                    position_tolerance: float = 1e-6,
+                    energy_tolerance: float = 2e-4,
+                    lattice_tolerance: float = 1e-3,
+                    histogram_tolerance: float = 0.01,
+                    r_max: float = 6.0,
+                    bins: int = 16) -> pd.DataFrame:
+    # Lists every configuration that repeats an earlier one, together with the index of the configuration it repeats,
+    # which is always one that is not a duplicate itself. Exact duplicates have the same lattice and positions up to
+    # position_tolerance. Near duplicates have a fingerprint that is within the tolerances of that of a kept
+    # configuration in every component: the energy per atom, the cell and distance histograms per pair of atom types.
+    indices = np.array([conf.index for conf in section.configurations], dtype=np.int64)
+
+    exact_of = _find_exact_duplicates(section.lattice_vectors, section.positions, position_tolerance)
+    unique = np.flatnonzero(exact_of == np.arange(len(exact_of)))
+
+    fingerprints = calculate_fingerprints(section, unique, energy_tolerance, lattice_tolerance, histogram_tolerance, r_max, bins)
+    near_of = unique[_find_near_duplicates(fingerprints)]
+
+    duplicate_of = near_of[np.searchsorted(unique, exact_of)]
+    is_duplicate = duplicate_of != np.arange(len(duplicate_of))
+
+    return pd.DataFrame({
+        "index": indices[is_duplicate],
+        "duplicate_of": indices[duplicate_of[is_duplicate]],
+        "exact": (exact_of == duplicate_of)[is_duplicate],
+    })
+
+
+def _find_exact_duplicates(lattice_vectors: ArrayLike, positions: ArrayLike, tolerance: float) -> ArrayLike:
+    # Configurations are hashed by their quantized lattice and positions, a chunk at a time to bound the memory used for
+    # the quantized copy. Returns the position of the first configuration with the same hash for every configuration.
+    first = {}
+    exact_of = np.empty(len(positions), dtype=np.int64)
+
+    for start in range(0, len(positions), _chunk_size):
+        end = min(start + _chunk_size, len(positions))
+
+        quantized = np.concatenate((np.reshape(lattice_vectors[start:end], (end - start, -1)),
+                                    np.reshape(positions[start:end], (end - start, -1))), axis=1)
+        quantized = np.ascontiguousarray(np.round(quantized / tolerance).astype(np.int64))
+
+        for i, row in enumerate(quantized):
+            exact_of[start + i] = first.setdefault(row.tobytes(), start + i)
+
+    return exact_of
+
+
+def calculate_fingerprints(section: MLABSection,
+                            selected: ArrayLike,
+                            energy_tolerance: float,
+                            lattice_tolerance: float,
+                            histogram_tolerance: float,
+                            r_max: float,
+                            bins: int) -> ArrayLike:
+    # Every component is scaled by its tolerance, so that near duplicates are at most 1 apart in every component
+    lattice_vectors = np.asarray(section.lattice_vectors[selected], dtype=np.float64)
+    positions = np.ascontiguousarray(np.reshape(section.positions[selected], (len(selected), -1, 3)), dtype=np.float64)
+    number_of_atoms = section.header.number_of_atoms
+    number_of_types = section.header.number_of_atom_types
+
+    # The six lengths a, b, c, a+b, b+c and c+a fix the cell up to rotation
+    a, b, c = lattice_vectors[:, 0], lattice_vectors[:, 1], lattice_vectors[:, 2]
+    lengths = np.linalg.norm(np.stack((a, b, c, a + b, b + c, c + a), axis=1), axis=2)
+
+    # Distances are found by the minimum image convention, which only holds up to half the smallest width of the cell
+    volumes = np.abs(np.linalg.det(lattice_vectors))
+    widths = volumes[:, None] / np.linalg.norm(np.stack((np.cross(b, c), np.cross(c, a), np.cross(a, b)), axis=1), axis=2)
+    r_max = min(r_max, 0.5 * np.min(widths, initial=2 * r_max))
+
+    histograms = np.zeros((len(selected), number_of_types, number_of_types, bins))
+    _calculate_histograms(positions,
+                          lattice_vectors,
+                          np.asarray(section.header.type_ids, dtype=np.int64),
+                          r_max,
+                          bins,
+                          histograms)
+
+    upper = np.triu_indices(number_of_types)
+    histograms = histograms[:, upper[0], upper[1], :].reshape(len(selected), -1) / max(number_of_atoms, 1)
+
+    return np.concatenate((np.reshape(section.energies[selected], (-1, 1)) / max(number_of_atoms, 1) / energy_tolerance,
+                           lengths / lattice_tolerance,
+                           histograms / histogram_tolerance), axis=1)
+
+
+@njit
+def _calculate_histograms(positions,
+                          lattice_vectors,
+                          type_ids,
+                          r_max: float,
+                          bins: int,
+                          histograms) -> None:
+    # Every distance is shared between the two nearest bin centers, so that the histograms change continuously with the
+    # positions. The last center lies at r_max and is left out.
+    for c in range(len(positions)):
+        lattice = lattice_vectors[c]
+        fractional = positions[c] @ np.linalg.inv(lattice)
+
+        for i in range(len(fractional)):
+            for j in range(i + 1, len(fractional)):
+                d0 = fractional[i, 0] - fractional[j, 0]
+                d1 = fractional[i, 1] - fractional[j, 1]
+                d2 = fractional[i, 2] - fractional[j, 2]
+                d0 -= np.round(d0)
+                d1 -= np.round(d1)
+                d2 -= np.round(d2)
+
+                dx = d0 * lattice[0, 0] + d1 * lattice[1, 0] + d2 * lattice[2, 0]
+                dy = d0 * lattice[0, 1] + d1 * lattice[1, 1] + d2 * lattice[2, 1]
+                dz = d0 * lattice[0, 2] + d1 * lattice[1, 2] + d2 * lattice[2, 2]
+
+                distance = np.sqrt(dx ** 2 + dy ** 2 + dz ** 2)
+
+                if distance < r_max:
+                    x = distance / r_max * bins
+                    lower = int(x)
+                    weight = x - lower
+
+                    t1, t2 = min(type_ids[i], type_ids[j]), max(type_ids[i], type_ids[j])
+                    histograms[c, t1, t2, lower] += 1. - weight
+                    if lower + 1 < bins:
+                        histograms[c, t1, t2, lower + 1] += weight
+
+
+def _find_near_duplicates(fingerprints: ArrayLike) -> ArrayLike:
+    # Neighbours within 1 in every component are found with a KD-tree, in O(n log n) for well spread fingerprints. A
+    # configuration is only dropped in favour of an earlier one that is kept, so slowly drifting trajectories are not
+    # chained together into a single duplicate.
+    if len(fingerprints) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    tree = KDTree(fingerprints, metric="chebyshev")
+
+    indptr = [np.zeros(1, dtype=np.int64)]
+    neighbours = []
+    for start in range(0, len(fingerprints), _chunk_size):
+        chunk = tree.query_radius(fingerprints[start:start + _chunk_size], r=1.)
+
+        indptr.append(indptr[-1][-1] + np.cumsum([len(found) for found in chunk], dtype=np.int64))
+        neighbours.extend(chunk)
+
+    near_of = np.empty(len(fingerprints), dtype=np.int64)
+    _resolve_near_duplicates(np.concatenate(indptr), np.concatenate(neighbours).astype(np.int64), near_of)
+
+    return near_of
+
+
+@njit
+def _resolve_near_duplicates(indptr, neighbours, near_of) -> None:
+    for i in range(len(near_of)):
+        near_of[i] = i
+
+        for j in neighbours[indptr[i]:indptr[i + 1]]:
+            if j < near_of[i] and near_of[j] == j:
+                near_of[i] = j
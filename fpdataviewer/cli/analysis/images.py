@@ -2,8 +2,8 @@ from __future__ import annotations
 
 import os
 from io import BytesIO
-from operator import attrgetter
 
+import numpy as np
 from PIL import Image
 from PIL.Image import Image as PILImage
 
@@ -22,8 +22,8 @@ from ovito.vis import Viewport, TachyonRenderer, CoordinateTripodOverlay
 
 
 def render_images(section: MLABSection) -> dict[str, dict[str, PILImage]]:
-    min_energy_conf = min(section.configurations, key=attrgetter("energy"))
-    max_energy_conf = max(section.configurations, key=attrgetter("energy"))
+    min_energy_conf = section.configurations[np.argmin(section.energies)]
+    max_energy_conf = section.configurations[np.argmax(section.energies)]
 
     image_size = (get_config()["rendering"]["width"], get_config()["rendering"]["height"])
 
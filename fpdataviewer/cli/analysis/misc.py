@@ -1,24 +1,46 @@
 from __future__ import annotations
 
+from collections import defaultdict
+from typing import Iterable
+
 import numpy as np
 import pandas as pd
+from numpy.typing import ArrayLike
 
 from fpdataviewer.mlab.mlab import MLABConfiguration, MLABSection
+from fpdataviewer.mlab.parsing import split_stream
+
+
+def _calculate_misc(energies: ArrayLike, lattice_vectors: ArrayLike, stresses: ArrayLike) -> pd.DataFrame:
+    a, b, c = np.linalg.norm(lattice_vectors, axis=2).T
+
+    return pd.DataFrame({
+        "energy": energies,
+        "pressure": -(stresses[:, 0] + stresses[:, 1] + stresses[:, 2]) / 3,
+        "lattice_a": a,
+        "lattice_b": b,
+        "lattice_c": c,
+        "volume": a * b * c,
+    })
 
 
 def calculate_misc(section: MLABSection) -> pd.DataFrame:
-    def conf_to_dict(conf: MLABConfiguration) -> dict[str, float]:
-        a = np.linalg.norm(conf.lattice_vectors[0])
-        b = np.linalg.norm(conf.lattice_vectors[1])
-        c = np.linalg.norm(conf.lattice_vectors[2])
-
-        return {
-            "energy": conf.energy,
-            "pressure": -(conf.stress.xx + conf.stress.yy + conf.stress.zz) / 3,
-            "lattice_a": a,
-            "lattice_b": b,
-            "lattice_c": c,
-            "volume": a * b * c,
-        }
-
-    return pd.DataFrame.from_records([conf_to_dict(conf) for conf in section.configurations])
+    return _calculate_misc(section.energies, section.lattice_vectors, section.stresses)
+
+
+def calculate_misc_stream(configurations: Iterable[MLABConfiguration]) -> list[pd.DataFrame]:
+    # Same statistics as calculate_misc for every section that split would return, in a single pass. Only the few
+    # numbers needed per configuration are kept.
+    energies = defaultdict(list)
+    lattice_vectors = defaultdict(list)
+    stresses = defaultdict(list)
+
+    for section_number, conf in split_stream(configurations):
+        energies[section_number].append(conf.energy)
+        lattice_vectors[section_number].append(conf.lattice_vectors)
+        stresses[section_number].append((conf.stress.xx, conf.stress.yy, conf.stress.zz))
+
+    return [_calculate_misc(np.array(energies[section_number]),
+                            np.array(lattice_vectors[section_number]).reshape(-1, 3, 3),
+                            np.array(stresses[section_number]).reshape(-1, 3))
+            for section_number in range(len(energies))]
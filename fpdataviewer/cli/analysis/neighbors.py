@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import numba
+import numpy as np
+from numba import njit, prange
+from numpy.typing import ArrayLike
+
+from fpdataviewer.mlab.mlab import MLABSection
+
+# TBB does not survive forks, which process pools elsewhere (like descriptors) rely on, so it is only used as a last resort
+numba.config.THREADING_LAYER_PRIORITY = ["omp", "workqueue", "tbb"]
+
+# Configurations are searched a chunk at a time, a chunk holds at most this many atoms, and its lists are estimated to
+# take at most this many bytes
+_chunk_atoms = 1 << 15
+_chunk_bytes = 1 << 28
+
+# Neighbour lists of the last section are kept in memory when they take at most this many bytes
+_max_cache_size = 1 << 28
+
+_cache = None
+
+
+@dataclass(frozen=True)
+class NeighborList:
+    # Periodic neighbours within cutoff of every atom in a chunk of configurations, in compressed sparse row format.
+    # The neighbours of atom i of configuration c are indices[indptr[c, i]:indptr[c, i + 1]], which are indices of atoms
+    # within configuration c, with vectors from atom i to the periodic image of its neighbour and their lengths. An atom
+    # can be a neighbour more than once (as different images), and every pair is listed from both sides. Vectors are
+    # only kept when they were asked for, since they take more memory than indices and distances together.
+    cutoff: float
+    configurations: ArrayLike
+    indptr: ArrayLike
+    indices: ArrayLike
+    vectors: Optional[ArrayLike]
+    distances: ArrayLike
+
+    def __len__(self) -> int:
+        return len(self.configurations)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + (0 if self.vectors is None else self.vectors.nbytes) + self.distances.nbytes
+
+
+def iter_neighbor_lists(section: MLABSection,
+                        cutoff: float,
+                        selected: Optional[ArrayLike] = None,
+                        threads: int = 1,
+                        with_vectors: bool = False) -> Iterator[NeighborList]:
+    # Yields neighbour lists for all (or the selected) configurations of a section, a chunk at a time. Lists are cached
+    # for the last section, so that analyses which follow each other on the same section search neighbours only once.
+    # Lists from the cache can have a larger cutoff than asked for, their distances should be checked against cutoff,
+    # and they can have vectors that were not asked for.
+    global _cache
+
+    configurations = np.arange(len(section.configurations)) if selected is None else np.asarray(selected, dtype=np.int64)
+
+    if _cache is not None:
+        cached_section, cached_configurations, chunks = _cache
+        if cached_section is section and np.array_equal(cached_configurations, configurations) and cutoff <= chunks[0].cutoff \
+                and (chunks[0].vectors is not None or not with_vectors):
+            yield from chunks
+            return
+
+    threads = numba.config.NUMBA_NUM_THREADS if threads <= 0 else min(threads, numba.config.NUMBA_NUM_THREADS)
+
+    chunk_size = _get_chunk_size(section, configurations, cutoff, with_vectors)
+    chunks = []
+    size = 0
+
+    for start in range(0, len(configurations), chunk_size):
+        neighbor_list = build_neighbor_list(section.positions,
+                                            section.lattice_vectors,
+                                            cutoff,
+                                            configurations[start:start + chunk_size],
+                                            threads,
+                                            with_vectors)
+
+        size += neighbor_list.nbytes
+        if chunks is not None:
+            chunks.append(neighbor_list)
+            if size > _max_cache_size:
+                chunks = None
+
+        yield neighbor_list
+
+    if chunks:
+        _cache = (section, configurations, chunks)
+
+
+def _get_chunk_size(section: MLABSection, configurations: ArrayLike, cutoff: float, with_vectors: bool) -> int:
+    # Memory grows with the number of pairs rather than atoms. Every atom has about density * sphere volume neighbours,
+    # which is estimated from the smallest cell, and every neighbour takes an index and a distance (and a vector).
+    number_of_atoms = max(section.header.number_of_atoms, 1)
+    if len(configurations) == 0:
+        return 1
+
+    volume = np.min(np.abs(np.linalg.det(section.lattice_vectors[configurations])))
+    pairs = number_of_atoms ** 2 / max(volume, 1e-12) * 4 / 3 * np.pi * cutoff ** 3
+    pair_size = 4 + 8 + (24 if with_vectors else 0)
+
+    return int(max(1, min(_chunk_atoms // number_of_atoms, _chunk_bytes // max(pairs * pair_size, 1.))))
+
+
+def clear_cache() -> None:
+    global _cache
+
+    _cache = None
+
+
+def build_neighbor_list(positions: ArrayLike,
+                        lattice_vectors: ArrayLike,
+                        cutoff: float,
+                        configurations: ArrayLike,
+                        threads: int = 1,
+                        with_vectors: bool = False) -> NeighborList:
+    positions = np.ascontiguousarray(positions[configurations], dtype=np.float64)
+    lattice_vectors = np.ascontiguousarray(lattice_vectors[configurations], dtype=np.float64)
+
+    numba.set_num_threads(max(1, min(threads, numba.config.NUMBA_NUM_THREADS)))
+
+    # Neighbours are counted first, so that the arrays can be allocated at once and filled in place
+    indptr = np.zeros((len(positions), positions.shape[1] + 1), dtype=np.int64)
+    _search(positions, lattice_vectors, cutoff, indptr, np.empty(0, dtype=np.int32), np.empty((0, 3)), np.empty(0), False)
+
+    indptr[:, 1:] = np.reshape(np.cumsum(indptr[:, 1:]), (len(positions), -1))
+    indptr[1:, 0] = indptr[:-1, -1]
+    total = indptr[-1, -1] if len(indptr) > 0 else 0
+
+    # Indices within a configuration always fit into 32 bits
+    indices = np.empty(total, dtype=np.int32)
+    vectors = np.empty((total if with_vectors else 0, 3))
+    distances = np.empty(total)
+    _search(positions, lattice_vectors, cutoff, indptr, indices, vectors, distances, True)
+
+    return NeighborList(cutoff, np.asarray(configurations), indptr, indices, vectors if with_vectors else None, distances)
+
+
+@njit(parallel=True)
+def _search(positions, lattice_vectors, cutoff: float, indptr, indices, vectors, distances, fill: bool) -> None:
+    # Configurations are independent, so the result does not depend on the number of threads
+    for i in prange(len(positions)):
+        _search_single(positions[i], lattice_vectors[i], cutoff, indptr[i], indices, vectors, distances, fill)
+
+
+@njit
+def _search_single(positions, lattice, cutoff: float, indptr, indices, vectors, distances, fill: bool) -> None:
+    # Neighbours are searched with a cell list. The cell is divided into a grid of bins, and every center is only
+    # compared to the atoms in the bins within cutoff of its own, including their periodic images, so the cost grows
+    # linearly with the number of atoms. Images are found from the widths of the (possibly triclinic) cell, so no
+    # neighbour is missed even when the cutoff exceeds half the cell. Every pair is found once, from the atom with the
+    # lower index, or for pairs with its own images from the image with the positive offset, and is then listed for
+    # both atoms with the same distance. Without fill, only the number of neighbours of every atom is added to indptr.
+    # Vectors are only filled in when vectors has a row for every neighbour.
+    number_of_atoms = len(positions)
+
+    fractional = positions @ np.linalg.inv(lattice)
+    fractional -= np.floor(fractional)
+    wrapped = fractional @ lattice
+
+    # The width of the cell along each axis is the distance between the two faces that the other two axes span. Bins
+    # are at least cutoff wide, but there are never much more bins than atoms.
+    volume = abs(np.linalg.det(lattice))
+    max_shape = int(number_of_atoms ** (1 / 3)) + 1
+    shape = np.empty(3, dtype=np.int64)
+    reach = np.empty(3, dtype=np.int64)
+    for axis in range(3):
+        u = lattice[(axis + 1) % 3]
+        v = lattice[(axis + 2) % 3]
+        face = np.sqrt((u[1] * v[2] - u[2] * v[1]) ** 2 + (u[2] * v[0] - u[0] * v[2]) ** 2 + (u[0] * v[1] - u[1] * v[0]) ** 2)
+        width = volume / face
+
+        shape[axis] = max(1, min(int(width / cutoff), max_shape))
+        reach[axis] = int(np.ceil(cutoff * shape[axis] / width))
+
+    # Atoms are sorted by bin, bin b holds atoms order[starts[b]:starts[b + 1]]
+    bins = np.empty((number_of_atoms, 3), dtype=np.int64)
+    bin_ids = np.empty(number_of_atoms, dtype=np.int64)
+    for atom in range(number_of_atoms):
+        for axis in range(3):
+            bins[atom, axis] = min(int(fractional[atom, axis] * shape[axis]), shape[axis] - 1)
+        bin_ids[atom] = (bins[atom, 0] * shape[1] + bins[atom, 1]) * shape[2] + bins[atom, 2]
+
+    order = np.argsort(bin_ids, kind="mergesort")
+    starts = np.zeros(shape[0] * shape[1] * shape[2] + 1, dtype=np.int64)
+    for atom in range(number_of_atoms):
+        starts[bin_ids[atom] + 1] += 1
+    starts = np.cumsum(starts)
+
+    cursor = indptr[:-1].copy()
+    cutoff2 = cutoff ** 2
+
+    for center in range(number_of_atoms):
+        for da in range(-reach[0], reach[0] + 1):
+            a = bins[center, 0] + da
+            image_a = a // shape[0]
+            a -= image_a * shape[0]
+
+            for db in range(-reach[1], reach[1] + 1):
+                b = bins[center, 1] + db
+                image_b = b // shape[1]
+                b -= image_b * shape[1]
+
+                for dc in range(-reach[2], reach[2] + 1):
+                    c = bins[center, 2] + dc
+                    image_c = c // shape[2]
+                    c -= image_c * shape[2]
+
+                    is_positive = image_a > 0 or image_a == 0 and (image_b > 0 or image_b == 0 and image_c > 0)
+
+                    offset_x = image_a * lattice[0, 0] + image_b * lattice[1, 0] + image_c * lattice[2, 0]
+                    offset_y = image_a * lattice[0, 1] + image_b * lattice[1, 1] + image_c * lattice[2, 1]
+                    offset_z = image_a * lattice[0, 2] + image_b * lattice[1, 2] + image_c * lattice[2, 2]
+
+                    bin_id = (a * shape[1] + b) * shape[2] + c
+                    for k in range(starts[bin_id], starts[bin_id + 1]):
+                        to = order[k]
+
+                        if to < center or to == center and not is_positive:
+                            continue
+
+                        dx = wrapped[to, 0] + offset_x - wrapped[center, 0]
+                        dy = wrapped[to, 1] + offset_y - wrapped[center, 1]
+                        dz = wrapped[to, 2] + offset_z - wrapped[center, 2]
+
+                        distance = dx ** 2 + dy ** 2 + dz ** 2
+
+                        if distance < cutoff2:
+                            if not fill:
+                                indptr[center + 1] += 1
+                                indptr[to + 1] += 1
+                                continue
+
+                            distance = np.sqrt(distance)
+
+                            _add_neighbor(center, to, dx, dy, dz, distance, cursor, indices, vectors, distances)
+                            _add_neighbor(to, center, -dx, -dy, -dz, distance, cursor, indices, vectors, distances)
+
+
+@njit
+def _add_neighbor(atom: int, other: int, dx: float, dy: float, dz: float, distance: float, cursor, indices, vectors, distances) -> None:
+    k = cursor[atom]
+    indices[k] = other
+    if len(vectors) > 0:
+        vectors[k, 0] = dx
+        vectors[k, 1] = dy
+        vectors[k, 2] = dz
+    distances[k] = distance
+    cursor[atom] = k + 1
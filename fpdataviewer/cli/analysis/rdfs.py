@@ -1,32 +1,31 @@
 from __future__ import annotations
 
+import numba
 import numpy as np
-from numba import njit
+from numba import njit, prange
 from numpy.typing import ArrayLike
 
+from fpdataviewer.cli.analysis.neighbors import iter_neighbor_lists
+from fpdataviewer.cli.analysis.sampling import select_structures
 from fpdataviewer.cli.config import get_config
 from fpdataviewer.mlab.mlab import MLABSection
 
 
-def calculate_rdfs(section: MLABSection) -> dict[tuple[str, str], tuple[ArrayLike, ArrayLike]]:
+def calculate_rdfs(section: MLABSection, with_vectors: bool = False) -> dict[tuple[str, str], tuple[ArrayLike, ArrayLike]]:
     rmin = get_config()["rdf"]["r_min"]
     rmax = get_config()["rdf"]["r_max"]
     bin_number = get_config()["rdf"]["bins"]
     structures = get_config()["rdf"]["structures"]
+    threads = get_config()["rdf"].get("threads", 0)
 
     if isinstance(structures, float) and 0. <= structures <= 1.:
         structures = int(structures * len(section.configurations))
 
     pairs = _get_pairs_from_config(section)
-    rdfs = {}
 
-    for center, to in pairs:
-        print(f"\rcalculating radial distribution function for {center}-{to} ... ", end="", flush=True)
+    print(f"\rcalculating radial distribution functions for {len(pairs)} pair{'' if len(pairs) == 1 else 's'} ... ", end="", flush=True)
 
-        bins, data = _calculate_rdf(section, {center}, {to}, rmin, rmax, bin_number, structures)
-        rdfs[(center, to)] = (bins, data)
-
-    return rdfs
+    return _calculate_rdfs(section, pairs, rmin, rmax, bin_number, structures, threads, with_vectors)
 
 
 def _get_pairs_from_config(section: MLABSection) -> list[tuple[str, str]]:
@@ -34,88 +33,134 @@ def _get_pairs_from_config(section: MLABSection) -> list[tuple[str, str]]:
 
     all_pairs = [(atoms[i], atoms[j]) for i in range(len(atoms)) for j in range(i, len(atoms))]
 
-    skipped_pairs = [pair_str.split("-") for pair_str in get_config()["rdf"]["skip_pairs"]]
+    skipped_pairs = [tuple(pair_str.split("-")) for pair_str in get_config()["rdf"]["skip_pairs"]]
 
     return [(atom1, atom2)
             for atom1, atom2 in all_pairs
             if (atom1, atom2) not in skipped_pairs and (atom2, atom1) not in skipped_pairs]
 
 
-def _calculate_rdf(section: MLABSection,
-                   center: set[str],
-                   to: set[str],
-                   rmin: float,
-                   rmax: float,
-                   number_bins: int,
-                   structure_count: int) -> tuple[ArrayLike, ArrayLike]:
-    # TODO: handle invalid atom types
-    counts = np.zeros(number_bins)
-
-    type_lookup = section.header.generate_type_lookup()
-
-    center_indices = [i for i in range(section.header.number_of_atoms) if type_lookup[i] in center]
-    to_indices = [i for i in range(section.header.number_of_atoms) if type_lookup[i] in to]
-
-    pairs = np.array([(center_index, to_index)
-                      for center_index in center_indices
-                      for to_index in to_indices
-                      if center_index != to_index])
-
-    selected_configurations = np.random.choice(section.configurations, structure_count) if 1 <= structure_count < len(section.configurations) else section.configurations
-
-    # TODO: very memory inefficient. we have to copy all positions (basically all data) into a contiguous piece of memory, because numba cannot deal with our MLABSection type.
-    contiguous_positions = np.array([conf.positions for conf in selected_configurations])
-    contiguous_lattice_vectors = np.array([conf.lattice_vectors for conf in selected_configurations])
+def _calculate_rdfs(section: MLABSection,
+                    pairs: list[tuple[str, str]],
+                    rmin: float,
+                    rmax: float,
+                    number_bins: int,
+                    structure_count: int,
+                    threads: int = 1,
+                    with_vectors: bool = False) -> dict[tuple[str, str], tuple[ArrayLike, ArrayLike]]:
+    # All pairs of atom types are binned in a single pass over the distances, into a histogram per pair of type ids.
+    # Pairs that are not asked for are masked out. RDFs do not need vectors, but with_vectors keeps them in the lists,
+    # so that analyses that do (like bonds) can reuse the cached lists afterwards.
+    types = [atom_type for atom_type, _ in section.number_of_atoms_per_type]
+    type_ids = np.asarray(section.header.type_ids, dtype=np.int64)
+    numbers_of_atoms = np.bincount(type_ids, minlength=len(types))
+
+    pair_mask = np.zeros((len(types), len(types)), dtype=np.bool_)
+    for center, to in pairs:
+        pair_mask[types.index(center), types.index(to)] = True
+        pair_mask[types.index(to), types.index(center)] = True
+
+    selected = select_structures(section, structure_count)
+
+    number_of_configurations = len(section.configurations) if selected is None else len(selected)
+
+    counts = np.zeros((len(types), len(types), number_bins))
+
+    # 0 threads uses every core that numba may use, for the neighbour search as well as for binning
+    threads = numba.config.NUMBA_NUM_THREADS if threads <= 0 else min(threads, numba.config.NUMBA_NUM_THREADS)
+
+    for neighbor_list in iter_neighbor_lists(section, rmax, selected, threads, with_vectors):
+        if threads == 1:
+            _calculate_rdf_bins(neighbor_list.indptr,
+                                neighbor_list.indices,
+                                neighbor_list.distances,
+                                type_ids,
+                                pair_mask,
+                                rmin,
+                                rmax,
+                                number_bins,
+                                counts)
+        else:
+            numba.set_num_threads(threads)
+            _calculate_rdf_bins_parallel(neighbor_list.indptr,
+                                         neighbor_list.indices,
+                                         neighbor_list.distances,
+                                         type_ids,
+                                         pair_mask,
+                                         rmin,
+                                         rmax,
+                                         number_bins,
+                                         counts,
+                                         threads)
 
-    _calculate_rdf_bins(contiguous_positions,
-                        contiguous_lattice_vectors,
-                        pairs,
-                        rmin,
-                        rmax,
-                        number_bins,
-                        counts)
+    bins = np.linspace(rmin, rmax, number_bins + 1)
+    shell_volumes = 4 / 3 * np.pi * (bins[1:] ** 3 - bins[:-1] ** 3)
+    total_volume = np.linalg.det(section.lattice_vectors[0])
 
-    counts /= len(selected_configurations) * len(center_indices)
+    rdfs = {}
+    for center, to in pairs:
+        center_id, to_id = types.index(center), types.index(to)
 
-    bins = np.linspace(rmin, rmax, number_bins + 1)
-    for i in range(number_bins):
-        inner_radius = bins[i]
-        outer_radius = bins[i + 1]
-        volume = 4 / 3 * np.pi * (outer_radius**3 - inner_radius**3)
-        counts[i] /= volume
+        density = numbers_of_atoms[to_id] / total_volume
+        rdfs[(center, to)] = (counts[center_id, to_id] / (number_of_configurations * numbers_of_atoms[center_id]) / shell_volumes / density, bins)
 
-    total_volume = np.linalg.det(section.configurations[0].lattice_vectors)
-    density = len(to_indices) / total_volume
-    counts /= density
+    return rdfs
 
-    return counts, bins
 
 @njit
-def _calculate_rdf_bins(positions,
-                        lattice_vectors,
-                        pairs,
+def _calculate_rdf_bins(indptr,
+                        indices,
+                        distances,
+                        type_ids,
+                        pair_mask,
                         rmin: float,
                         rmax: float,
                         number_bins: int,
                         counts) -> None:
-    offset_matrix = np.array([[x, y, z]
-                              for x in [-1, 0, 1]
-                              for y in [-1, 0, 1]
-                              for z in [-1, 0, 1]], dtype=np.float64)
+    for configuration in range(len(indptr)):
+        _calculate_rdf_bins_single(indptr[configuration], indices, distances, type_ids, pair_mask, rmin, rmax, number_bins, counts)
 
-    for i in range(len(positions)):
-        offsets = offset_matrix @ lattice_vectors[i]
 
-        for offset in offsets:
-            for center_index, to_index in pairs:
-                dx = positions[i, center_index, 0] - positions[i, to_index, 0] - offset[0]
-                dy = positions[i, center_index, 1] - positions[i, to_index, 1] - offset[1]
-                dz = positions[i, center_index, 2] - positions[i, to_index, 2] - offset[2]
+@njit(parallel=True)
+def _calculate_rdf_bins_parallel(indptr,
+                                 indices,
+                                 distances,
+                                 type_ids,
+                                 pair_mask,
+                                 rmin: float,
+                                 rmax: float,
+                                 number_bins: int,
+                                 counts,
+                                 threads: int) -> None:
+    # Every thread fills a private histogram for a contiguous chunk of configurations, the histograms are summed at the
+    # end. Counts are kept as integers, so the result is exactly that of _calculate_rdf_bins.
+    chunk_counts = np.zeros((threads, counts.shape[0], counts.shape[1], counts.shape[2]), dtype=np.int64)
 
-                distance = dx ** 2 + dy ** 2 + dz ** 2
+    for chunk in prange(threads):
+        for configuration in range(chunk * len(indptr) // threads, (chunk + 1) * len(indptr) // threads):
+            _calculate_rdf_bins_single(indptr[configuration], indices, distances, type_ids, pair_mask, rmin, rmax, number_bins, chunk_counts[chunk])
 
-                if rmin ** 2 <= distance < rmax ** 2:
-                    distance = np.sqrt(distance)
+    for chunk in range(threads):
+        counts += chunk_counts[chunk]
 
-                    bin = int((distance - rmin) / (rmax - rmin) * number_bins)
-                    counts[bin] += 1
+
+@njit
+def _calculate_rdf_bins_single(indptr,
+                               indices,
+                               distances,
+                               type_ids,
+                               pair_mask,
+                               rmin: float,
+                               rmax: float,
+                               number_bins: int,
+                               counts) -> None:
+    # Every pair is listed from both sides, so it is counted for both orders of its atom types
+    for center in range(len(indptr) - 1):
+        center_type = type_ids[center]
+
+        for k in range(indptr[center], indptr[center + 1]):
+            to_type = type_ids[indices[k]]
+
+            if pair_mask[center_type, to_type] and rmin <= distances[k] < rmax:
+                bin = min(int((distances[k] - rmin) / (rmax - rmin) * number_bins), number_bins - 1)
+                counts[center_type, to_type, bin] += 1
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import pickle
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from fpdataviewer.mlab import cache
+from fpdataviewer.mlab.mlab import MLABConfigurationHeader
+
+T = TypeVar("T")
+
+_results_version = 1
+_results_suffix = ".pkl"
+_default_max_size = 1024 ** 3
+
+
+def get_entry_path(cache_dir: Path, content_hash: str, header: MLABConfigurationHeader, stage: str, config) -> Path:
+    # Results are identified by the contents of the input file, the section (which its header identifies within the
+    # file), the stage of the analysis and the part of the config that the stage reads
+    key = json.dumps({
+        "version": _results_version,
+        "content_hash": content_hash,
+        "header": [header.name, header.number_of_atoms, header.number_of_atoms_per_type],
+        "stage": stage,
+        "config": config,
+    }, sort_keys=True, default=str)
+
+    return cache_dir / f"{stage}-{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}{_results_suffix}"
+
+
+def load_or_calculate(cache_dir: Path,
+                      content_hash: str,
+                      header: MLABConfigurationHeader,
+                      stage: str,
+                      config,
+                      calculate: Callable[[], T],
+                      max_size: int = _default_max_size) -> T:
+    # Returns the stored result of a stage when there is one, otherwise calculates and stores it. Every stage of every
+    # section is a separate entry, least recently used entries are removed first when the cache exceeds max_size.
+    entry_path = get_entry_path(cache_dir, content_hash, header, stage, config)
+
+    try:
+        with entry_path.open(mode="rb") as file:
+            result = pickle.load(file)
+        entry_path.touch()
+        return result
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        pass
+
+    result = calculate()
+
+    def write(temporary_path: Path) -> None:
+        with temporary_path.open(mode="wb") as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cache.write_atomically(entry_path, write)
+
+        cache.evict(cache_dir.glob(f"*{_results_suffix}"), max_size)
+    except (OSError, pickle.PicklingError, TypeError):
+        pass
+
+    return result
+
+
+def clear(cache_dir: Path) -> None:
+    for entry_path in cache_dir.glob(f"*{_results_suffix}"):
+        entry_path.unlink(missing_ok=True)
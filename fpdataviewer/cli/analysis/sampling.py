@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+from numba import njit
+from numpy.typing import ArrayLike
+
+from fpdataviewer.cli.config import get_config
+from fpdataviewer.mlab.mlab import MLABSection
+
+_methods = ["random", "stratified", "farthest"]
+
+_cache = None
+
+
+def select_structures(section: MLABSection, structure_count: int) -> Optional[ArrayLike]:
+    # Returns the sorted indices of the structures that an analysis of structure_count structures should use, or None
+    # for all of them. Structures are taken from the front of a single order per section, so analyses of the same
+    # number of structures use the same ones, and those of fewer structures use a subset of those of more.
+    if not 1 <= structure_count < len(section.configurations):
+        return None
+
+    method = get_config().get("sampling", {}).get("method", "random")
+    seed = get_config().get("sampling", {}).get("seed", 0)
+
+    return np.sort(get_order(section, structure_count, method, seed)[:structure_count])
+
+
+def get_order(section: MLABSection, structure_count: int, method: str = "random", seed: int = 0) -> ArrayLike:
+    # Orders at least the first structure_count structures of a section, the order is kept for the last section
+    global _cache
+
+    if _cache is not None:
+        cached_section, cached_method, cached_seed, ordered, order = _cache
+        if cached_section is section and cached_method == method and cached_seed == seed and structure_count <= ordered:
+            return order
+
+    rng = np.random.default_rng(seed)
+    ordered = len(section.configurations)
+
+    if method == "random":
+        order = rng.permutation(len(section.configurations))
+    elif method == "stratified":
+        order = _order_stratified(section.energies, rng)
+    elif method == "farthest":
+        order = _order_farthest(section, structure_count, rng)
+        ordered = structure_count
+    else:
+        raise ValueError(f"unknown sampling method {method}, use one of {', '.join(_methods)}")
+
+    _cache = (section, method, seed, ordered, order)
+
+    return order
+
+
+def _order_stratified(energies: ArrayLike, rng: np.random.Generator) -> ArrayLike:
+    # Structures are ranked by energy, and ranks are taken in the order of the bit-reversed binary fraction of the rank
+    # (the van der Corput sequence), shifted by a random offset. Every prefix of the order then covers the energy range
+    # evenly, with about as many structures from every part of it.
+    ranks = np.empty(len(energies), dtype=np.int64)
+    ranks[np.argsort(energies, kind="stable")] = np.arange(len(energies))
+
+    radical_inverses = np.zeros(len(energies))
+    remaining = ranks.copy()
+    scale = 0.5
+    while remaining.any():
+        radical_inverses += (remaining & 1) * scale
+        remaining >>= 1
+        scale /= 2
+
+    return np.argsort((radical_inverses + rng.random()) % 1., kind="stable")
+
+
+def _order_farthest(section: MLABSection, structure_count: int, rng: np.random.Generator) -> ArrayLike:
+    # Farthest point sampling on cheap fingerprints (energy per atom, cell and distance histograms, see duplicates):
+    # every next structure is the one farthest from those already taken, which spreads them over the data and skips
+    # (near) duplicates. Only the first structure_count structures are ordered, the rest follow at random. Ordering more
+    # structures later starts from the same structure, so the order keeps its prefix.
+    from fpdataviewer.cli.analysis.duplicates import calculate_fingerprints
+
+    fingerprints = calculate_fingerprints(section, np.arange(len(section.configurations)), 1., 1., 1., 6.0, 16)
+
+    # Standardized, so that every component counts about as much
+    spread = np.std(fingerprints, axis=0)
+    fingerprints = (fingerprints - np.mean(fingerprints, axis=0)) / np.where(spread > 0, spread, 1.)
+
+    order = np.empty(len(fingerprints), dtype=np.int64)
+    taken = np.zeros(len(fingerprints), dtype=np.bool_)
+    _farthest_points(np.ascontiguousarray(fingerprints), rng.integers(len(fingerprints)), structure_count, order, taken)
+
+    order[structure_count:] = rng.permutation(np.flatnonzero(~taken))
+
+    return order
+
+
+@njit
+def _farthest_points(fingerprints, first: int, count: int, order, taken) -> None:
+    distances = np.full(len(fingerprints), np.inf)
+
+    current = first
+    for i in range(count):
+        order[i] = current
+        taken[current] = True
+
+        farthest = -1
+        for j in range(len(fingerprints)):
+            if taken[j]:
+                continue
+
+            distance = 0.
+            for k in range(fingerprints.shape[1]):
+                distance += (fingerprints[j, k] - fingerprints[current, k]) ** 2
+            distances[j] = min(distances[j], distance)
+
+            if farthest < 0 or distances[j] > distances[farthest]:
+                farthest = j
+
+        current = farthest
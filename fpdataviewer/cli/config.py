@@ -4,12 +4,24 @@ default_config = {
     "global": {
         "bins": 100
     },
+    "sampling": {
+        "method": "random",
+        "seed": 0
+    },
     "rdf": {
         "bins": 1000,
         "structures": 1.0,
         "r_min": 0.0,
         "r_max": "auto",
-        "skip_pairs": []
+        "skip_pairs": [],
+        "threads": 0
+    },
+    "bonds": {
+        "bins": 180,
+        "structures": 1.0,
+        "scale": 1.2,
+        "cutoffs": {},
+        "threads": 0
     },
     "rendering": {
         "width": 1024,
@@ -17,6 +29,8 @@ default_config = {
     },
     "descriptors": {
         "structures": 1.0,
+        "workers": 0,
+        "sparse": False,
         "soap": {
             "r_cut": "auto",
             "n_max": 8,
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from fpdataviewer.mlab import cache, parsing, validation
+from fpdataviewer.mlab.mlab import MLAB
+
+
+def load_input(args, validate: bool = False) -> MLAB:
+    # With validate, files are validated while they are parsed, instead of in a second pass afterwards
+    if args.use_cache:
+        return cache.load(args.input_file, cache_dir=cache.get_default_cache_dir(), validate=validate)
+
+    with args.input_file.open(mode="rt") as file:
+        if validate:
+            return validation.load_validated(file)
+        else:
+            return parsing.load(file)
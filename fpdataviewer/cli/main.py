@@ -95,6 +95,14 @@ def register_args_inspect(parser: argparse.ArgumentParser) -> None:
     )
     parser.set_defaults(strict=False)
 
+    parser.add_argument(
+        "--duplicates",
+        "-d",
+        action="store_true",
+        help="also counts structures that repeat earlier ones, exactly or almost",
+        dest="duplicates",
+    )
+
 
 def register_args_convert(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
@@ -131,9 +139,23 @@ def register_args_convert(parser: argparse.ArgumentParser) -> None:
     )
     parser.set_defaults(strict=False)
 
+    parser.add_argument(
+        "--deduplicate",
+        "-d",
+        action="store_true",
+        help="leaves out structures that repeat earlier ones, exactly or almost (only from vasp-mlab)",
+        dest="deduplicate",
+    )
+
 
 def register_args_validate(parser: argparse.ArgumentParser) -> None:
-    pass
+    parser.add_argument(
+        "--json",
+        default=None,
+        metavar="path",
+        help="also writes all problems found to a JSON file\nuse - to print only the JSON report",
+        dest="json_file",
+    )
 
 
 def register_args_io(parser: argparse.ArgumentParser, has_input: bool, has_output: bool) -> None:
@@ -148,6 +170,14 @@ def register_args_io(parser: argparse.ArgumentParser, has_input: bool, has_outpu
             dest="input_file",
         )
 
+        parser.add_argument(
+            "--no-cache",
+            action="store_false",
+            help="parses the input file from scratch instead of reading (and updating) its binary cache",
+            dest="use_cache",
+        )
+        parser.set_defaults(use_cache=True)
+
     if has_output:
         parser.add_argument(
             "--output",
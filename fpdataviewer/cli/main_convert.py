@@ -2,14 +2,26 @@ from __future__ import annotations
 
 import ase.io
 
-from fpdataviewer.mlab import ase_adapter, parsing
+from fpdataviewer.cli.loading import load_input
+from fpdataviewer.mlab import ase_adapter, parsing, writing
+from fpdataviewer.mlab.mlab import MLAB
 
 
 def convert(args) -> None:
+    if args.to_format == "vasp-mlab":
+        _convert_to_mlab(args)
+        return
+
+    if args.deduplicate and args.from_format != "vasp-mlab":
+        raise ValueError("removing duplicates is only supported from vasp-mlab")
+
     if args.from_format == "vasp-mlab":
-        with args.input_file.open(mode="rt") as file:
-            mlab = parsing.load(file)
-            atoms = ase_adapter.from_mlab(mlab)
+        mlab = load_input(args)
+
+        if args.deduplicate:
+            mlab = _deduplicate(mlab)
+
+        atoms = ase_adapter.from_mlab(mlab)
 
         if args.index is not None:
             atoms = atoms[ase.io.string2index(args.index)]
@@ -17,3 +29,37 @@ def convert(args) -> None:
         atoms = ase.io.read(args.input_file, index=args.index, format=args.from_format)
 
     ase.io.write(args.output_file, atoms, format=args.to_format, append=args.append)
+
+
+def _convert_to_mlab(args) -> None:
+    if args.from_format != "vasp-mlab":
+        raise ValueError("conversion to vasp-mlab is only supported from vasp-mlab")
+
+    mlab = load_input(args)
+
+    if args.deduplicate:
+        mlab = _deduplicate(mlab)
+
+    if args.index is not None:
+        index = ase.io.string2index(args.index)
+        mlab = writing.subset(mlab, index if isinstance(index, slice) else [index])
+
+    if args.append and args.output_file.exists():
+        with args.output_file.open(mode="rt") as file:
+            mlab = writing.merge([parsing.load(file), mlab])
+
+    with args.output_file.open(mode="wt") as file:
+        writing.write(file, mlab)
+
+
+def _deduplicate(mlab: MLAB) -> MLAB:
+    # Duplicates are found per group of structures, the first of every set of duplicates is kept
+    from fpdataviewer.cli.analysis.duplicates import find_duplicates
+
+    duplicates = set()
+    for section in parsing.split(mlab):
+        duplicates.update(find_duplicates(section)["index"].tolist())
+
+    print(f"leaving out {len(duplicates)} duplicate structure{'' if len(duplicates) == 1 else 's'}")
+
+    return writing.subset(mlab, [i for i, conf in enumerate(mlab.configurations) if conf.index not in duplicates])
@@ -1,20 +1,34 @@
 from __future__ import annotations
 
+from collections import Counter
+
+from fpdataviewer.cli.loading import load_input
 from fpdataviewer.mlab import parsing, validation
 
 
 def inspect(args) -> None:
-    # Load MLAB file
-    with args.input_file.open(mode="rt") as file:
-        mlab = parsing.load(file)
-    if args.strict:
-        validation.validate(mlab)
-    sections = parsing.split(mlab)
+    # Load MLAB file. Only the headers are needed for the summary, so the numeric data is not parsed unless the file is
+    # validated, and then only one configuration at a time. Finding duplicates needs the positions of all of them.
+    duplicates = {}
+
+    if args.duplicates:
+        from fpdataviewer.cli.analysis.duplicates import find_duplicates
+
+        mlab = load_input(args, validate=args.strict)
+        headers = [conf.header for conf in mlab.configurations]
+        duplicates = {section.header: find_duplicates(section) for section in parsing.split(mlab)}
+    else:
+        with args.input_file.open(mode="rt") as file:
+            if args.strict:
+                headers = [conf.header for conf in validation.iter_validated(parsing.iter_configurations(file, engine="block"))]
+            else:
+                headers = [header for _, header in parsing.scan(file)]
+    sections = Counter(headers)
 
     # Print summary to console
     print(f"file contains {len(sections)} group{'' if len(sections) == 1 else 's'} of structures")
     print()
-    for i, section in enumerate(sections):
+    for i, (section, number_of_configurations) in enumerate(sections.items()):
         atom_repr = ", ".join([f"{name} ({number})" for name, number in section.number_of_atoms_per_type])
         current_group = i + 1
         total_groups = len(sections)
@@ -22,5 +36,9 @@ def inspect(args) -> None:
         print(f"[{current_group}/{total_groups}] name       : {section.name}")
         print(f"[{current_group}/{total_groups}] atoms      : {section.number_of_atoms}")
         print(f"[{current_group}/{total_groups}] atom types : {atom_repr}")
-        print(f"[{current_group}/{total_groups}] structures : {len(section.configurations)} / {len(section.source.configurations)}")
+        print(f"[{current_group}/{total_groups}] structures : {number_of_configurations} / {len(headers)}")
+        if section in duplicates:
+            exact = int(duplicates[section]["exact"].sum())
+            near = len(duplicates[section]) - exact
+            print(f"[{current_group}/{total_groups}] duplicates : {exact} exact, {near} near")
         print()
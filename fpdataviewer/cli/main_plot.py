@@ -3,7 +3,8 @@ from __future__ import annotations
 import json
 
 from fpdataviewer.cli.config import set_config, default_config
-from fpdataviewer.mlab import parsing, validation
+from fpdataviewer.cli.loading import load_input
+from fpdataviewer.mlab import cache
 
 
 def plot(args) -> None:
@@ -17,10 +18,10 @@ def plot(args) -> None:
     set_config(config)
 
     # Load MLAB file
-    with args.input_file.open(mode="rt") as file:
-        mlab = parsing.load(file)
-    if args.strict:
-        validation.validate(mlab)
+    mlab = load_input(args, validate=args.strict)
+
+    # Identifies the file for the analysis results cache
+    args.content_hash = cache.get_content_hash(args.input_file, cache.get_default_cache_dir()) if args.use_cache else None
 
     # Plot
     if args.interactive:
@@ -1,18 +1,47 @@
 from __future__ import annotations
 
-from fpdataviewer.mlab import parsing, validation
+import json
+import sys
+from dataclasses import asdict
+
+from fpdataviewer.mlab import validation
 
 
 def validate(args) -> None:
+    # Every check runs in a single pass, so all problems are found at once. Files are validated while they are parsed,
+    # without keeping them in memory. The binary cache is never used here: it holds no line numbers to locate problems
+    # by, and only files without format problems end up in it.
     with args.input_file.open(mode="rt") as file:
-        mlab = parsing.load(file)
+        problems = validation.report(file, engine="block")
 
-    print("format ok")
+    format_ok = not any(problem.check == "format" for problem in problems)
 
-    try:
-        validation.validate(mlab)
-    except validation.ValidationException as e:
-        print(e)
-        print("note this may not be the only problem!")
-    else:
+    if args.json_file is not None:
+        report = {
+            "file": str(args.input_file),
+            "format_ok": format_ok,
+            "problems": [asdict(problem) for problem in problems],
+        }
+
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+            return
+
+        with open(args.json_file, mode="wt") as file:
+            json.dump(report, file, indent=2)
+
+    for problem in problems:
+        location = ""
+        if problem.lines is not None:
+            location = f"lines {problem.lines[0]}-{problem.lines[1]}: "
+
+        print(f"{location}{problem.message}")
+
+    if format_ok:
+        print("format ok")
+
+    if len(problems) == 0:
         print("no problems found")
+    else:
+        print(f"{len(problems)} problem{'s' if len(problems) != 1 else ''} found")
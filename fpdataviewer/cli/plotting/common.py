@@ -119,6 +119,33 @@ def plot_rdf(rdf: Optional[dict], center_type: Optional[str], ax: Axes) -> None:
     ax.legend()
 
 
+def plot_coordination(coordination: dict, center_type: str, ax: Axes) -> None:
+    to_types = [to for center, to in coordination if center == center_type]
+    width = 0.8 / max(len(to_types), 1)
+
+    for i, to in enumerate(to_types):
+        fractions, numbers = coordination[(center_type, to)]
+        ax.bar(numbers + (i - (len(to_types) - 1) / 2) * width, fractions, width=width, label=f"{center_type}-{to}")
+
+    ax.set_xlabel("coordination number")
+    ax.set_ylabel("fraction of atoms")
+    ax.grid(visible=True)
+    ax.set_axisbelow(True)
+    ax.legend()
+
+
+def plot_angles(angles: dict, center_type: str, ax: Axes) -> None:
+    density, bins = angles[center_type]
+    ax.stairs(density, bins, color=_blue)
+
+    ax.set_xlabel("bond angle [deg]")
+    ax.set_ylabel("density")
+    ax.set_xlim(left=0, right=180)
+    ax.minorticks_on()
+    ax.grid(visible=True)
+    ax.set_axisbelow(True)
+
+
 def plot_descriptors_scatter_grouping(desc: pd.DataFrame, ax: Axes) -> None:
     x_min = desc["pc_1"].min()
     x_max = desc["pc_1"].max()
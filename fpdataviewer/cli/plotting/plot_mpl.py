@@ -133,8 +133,8 @@ def _make_image_page(section: MLABSection, section_metadata: dict, fig: Figure)
     # fig_bottom.set_facecolor("0.75")
 
     # TODO: Are these configuration numbers correct when multiple sections exist?
-    fig_top.suptitle(f"minimum energy configuration (structure {1 + min(range(len(section.configurations)), key=lambda i: section.configurations[i].energy)})", fontsize=10)
-    fig_bottom.suptitle(f"maximum energy configuration (structure {1 + max(range(len(section.configurations)), key=lambda i: section.configurations[i].energy)})", fontsize=10)
+    fig_top.suptitle(f"minimum energy configuration (structure {1 + np.argmin(section.energies)})", fontsize=10)
+    fig_bottom.suptitle(f"maximum energy configuration (structure {1 + np.argmax(section.energies)})", fontsize=10)
 
     grid_top = fig_top.add_gridspec(ncols=3, nrows=1)
     if "img" in section_metadata:
@@ -159,7 +159,7 @@ def _make_type_page(section: MLABSection, section_metadata: dict, fig: Figure, t
     # fig_bottom.set_facecolor("0.75")
 
     fig_top.suptitle(f"principal component analysis of descriptors ({type})", fontsize=10)
-    fig_bottom.suptitle(f"radial distribution functions ({type})", fontsize=10)
+    fig_bottom.suptitle(f"radial distribution functions, coordination numbers and bond angles ({type})", fontsize=10)
 
     grid_top = fig_top.add_gridspec(ncols=3, nrows=1)
     if "desc" in section_metadata:
@@ -167,6 +167,9 @@ def _make_type_page(section: MLABSection, section_metadata: dict, fig: Figure, t
         plot_descriptors_scatter_grouping(section_metadata["desc"][type], fig_top.add_subplot(grid_top[0, 1]))
         plot_descriptors_scatter_energy  (section_metadata["desc"][type], fig_top.add_subplot(grid_top[0, 2]))
 
-    grid_bottom = fig_bottom.add_gridspec(ncols=1, nrows=1)
+    grid_bottom = fig_bottom.add_gridspec(ncols=3, nrows=1)
     if "rdf" in section_metadata:
         plot_rdf(section_metadata["rdf"], type, fig_bottom.add_subplot(grid_bottom[0, 0]))
+    if "bonds" in section_metadata:
+        plot_coordination(section_metadata["bonds"]["coordination"], type, fig_bottom.add_subplot(grid_bottom[0, 1]))
+        plot_angles      (section_metadata["bonds"]["angles"], type, fig_bottom.add_subplot(grid_bottom[0, 2]))
@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Union
+
+import numpy as np
+
+from fpdataviewer.mlab import parsing, validation
+from fpdataviewer.mlab.mlab import MLAB, MLABBasisSet, MLABConfiguration, MLABConfigurationHeader, StressTensor
+
+_cache_version = 2
+_cache_suffix = ".cache"
+_default_max_size = 4 * 1024 ** 3
+
+
+class CacheKey:
+    def __init__(self, path: Path):
+        stat = path.stat()
+
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self._content_hash = None
+
+    @property
+    def content_hash(self) -> str:
+        # Only computed when size and mtime alone cannot decide whether a cache entry is valid
+        if self._content_hash is None:
+            self._content_hash = hash_file(self.path)
+
+        return self._content_hash
+
+
+def hash_file(path: Path, chunk_size: int = 1 << 24) -> str:
+    content_hash = hashlib.blake2b(digest_size=16)
+
+    with path.open(mode="rb") as file:
+        while chunk := file.read(chunk_size):
+            content_hash.update(chunk)
+
+    return content_hash.hexdigest()
+
+
+def get_default_cache_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "fpdataviewer"
+
+
+def get_entry_path(path: Path, cache_dir: Optional[Path]) -> Path:
+    if cache_dir is None:
+        return path.with_name(path.name + _cache_suffix)
+    else:
+        path_hash = hashlib.blake2b(str(path.resolve()).encode(), digest_size=16).hexdigest()
+        return cache_dir / f"{path.name}-{path_hash}{_cache_suffix}"
+
+
+def _is_valid(meta: dict, key: CacheKey) -> bool:
+    if meta.get("version") != _cache_version or meta.get("size") != key.size:
+        return False
+
+    return meta.get("mtime_ns") == key.mtime_ns or meta.get("content_hash") == key.content_hash
+
+
+def _is_cacheable(mlab: MLAB) -> bool:
+    # Arrays are stored stacked, which requires every configuration to have the shapes that validation expects
+    if len(mlab.configurations) == 0:
+        return False
+
+    for conf in mlab.configurations:
+        atoms = conf.number_of_atoms
+
+        if np.shape(conf.lattice_vectors) != (3, 3) \
+                or np.size(conf.positions) != 3 * atoms \
+                or np.size(conf.forces) != 3 * atoms \
+                or conf.charges is not None and np.size(conf.charges) != atoms:
+            return False
+
+    return True
+
+
+def _write_entry(mlab: MLAB, key: CacheKey, entry_path: Path) -> None:
+    headers = {}
+    header_ids = np.array([headers.setdefault(conf.header, len(headers)) for conf in mlab.configurations], dtype=np.int64)
+
+    # Rows are grouped by section, so that the arrays of a section are a single slice of the memory-mapped files, which
+    # split can use without copying. The order maps rows back to the configurations in the file.
+    order = np.argsort(header_ids, kind="stable")
+    configurations = [mlab.configurations[i] for i in order]
+
+    atom_counts = [conf.number_of_atoms for conf in configurations]
+    atom_offsets = np.concatenate(([0], np.cumsum(atom_counts, dtype=np.int64)))
+
+    arrays = {
+        "order": order,
+        "indices": np.array([conf.index for conf in configurations], dtype=np.int64),
+        "header_ids": header_ids[order],
+        "atom_offsets": atom_offsets,
+        "ctifors": np.array([np.nan if conf.ctifor is None else conf.ctifor for conf in configurations]),
+        "has_ctifor": np.array([conf.ctifor is not None for conf in configurations], dtype=bool),
+        "energies": np.array([conf.energy for conf in configurations]),
+        "stresses": np.array([[conf.stress.xx, conf.stress.yy, conf.stress.zz, conf.stress.xy, conf.stress.yz, conf.stress.zx]
+                              for conf in configurations]).reshape(-1, 6),
+        "has_charges": np.array([conf.charges is not None for conf in configurations], dtype=bool),
+    }
+    for i, basis_set in enumerate(mlab.basis_sets):
+        arrays[f"basis_set_{i}"] = np.asarray(basis_set.indices)
+
+    meta = {
+        "version": _cache_version,
+        "size": key.size,
+        "mtime_ns": key.mtime_ns,
+        "content_hash": key.content_hash,
+        "number_of_configurations": mlab.number_of_configurations,
+        "max_number_of_atom_types": mlab.max_number_of_atom_types,
+        "atom_types": mlab.atom_types,
+        "max_number_of_atoms_per_system": mlab.max_number_of_atoms_per_system,
+        "max_number_of_atoms_per_type": mlab.max_number_of_atoms_per_type,
+        "reference_energies": mlab.reference_energies,
+        "atomic_masses": mlab.atomic_masses,
+        "numbers_of_basis_sets": mlab.numbers_of_basis_sets,
+        "basis_sets": [basis_set.name for basis_set in mlab.basis_sets],
+        "headers": [[header.name, header.number_of_atom_types, header.number_of_atoms, header.number_of_atoms_per_type]
+                    for header in headers],
+    }
+
+    def write(temporary_path: Path) -> None:
+        temporary_path.mkdir(parents=True)
+
+        for name, array in arrays.items():
+            np.save(temporary_path / f"{name}.npy", array)
+
+        # The large arrays are copied into their files configuration by configuration, instead of being gathered in
+        # memory first. Charges of configurations without them are left at zero.
+        configuration_offsets = np.arange(len(configurations) + 1)
+
+        for name, offsets, shape, get_values in [("lattice_vectors", configuration_offsets, (3, 3), lambda conf: conf.lattice_vectors),
+                                                 ("positions", atom_offsets, (3,), lambda conf: conf.positions),
+                                                 ("forces", atom_offsets, (3,), lambda conf: conf.forces),
+                                                 ("charges", atom_offsets, (), lambda conf: conf.charges)]:
+            array = np.lib.format.open_memmap(temporary_path / f"{name}.npy", mode="w+", dtype=np.float64, shape=(int(offsets[-1]),) + shape)
+
+            for i, conf in enumerate(configurations):
+                values = get_values(conf)
+                if values is not None:
+                    array[offsets[i]:offsets[i + 1]] = np.reshape(values, (-1,) + shape)
+
+            array.flush()
+            del array
+
+        with (temporary_path / "meta.json").open(mode="wt") as file:
+            json.dump(meta, file)
+
+    write_atomically(entry_path, write)
+
+
+def _read_entry(meta: dict, entry_path: Path) -> MLAB:
+    def load_array(name: str) -> np.ndarray:
+        return np.load(entry_path / f"{name}.npy", mmap_mode="r")
+
+    headers = [MLABConfigurationHeader(name=name,
+                                       number_of_atom_types=number_of_atom_types,
+                                       number_of_atoms=number_of_atoms,
+                                       number_of_atoms_per_type=tuple((type, amount) for type, amount in number_of_atoms_per_type))
+               for name, number_of_atom_types, number_of_atoms, number_of_atoms_per_type in meta["headers"]]
+
+    order = load_array("order")
+    indices = load_array("indices")
+    header_ids = load_array("header_ids")
+    atom_offsets = load_array("atom_offsets")
+    ctifors = load_array("ctifors")
+    has_ctifor = load_array("has_ctifor")
+    lattice_vectors = load_array("lattice_vectors")
+    positions = load_array("positions")
+    energies = load_array("energies")
+    forces = load_array("forces")
+    stresses = load_array("stresses")
+    has_charges = load_array("has_charges")
+    charges = load_array("charges")
+
+    configurations = [None] * len(indices)
+    for i in range(len(indices)):
+        start, end = atom_offsets[i], atom_offsets[i + 1]
+
+        # Squeezed like np.loadtxt does while parsing, so single-atom configurations keep the parsed shapes. The arrays
+        # stay views into the memory-mapped files.
+        configurations[order[i]] = MLABConfiguration(index=int(indices[i]),
+                                                     header=headers[header_ids[i]],
+                                                     ctifor=float(ctifors[i]) if has_ctifor[i] else None,
+                                                     lattice_vectors=lattice_vectors[i],
+                                                     positions=np.squeeze(positions[start:end]),
+                                                     energy=float(energies[i]),
+                                                     forces=np.squeeze(forces[start:end]),
+                                                     stress=StressTensor(*(float(value) for value in stresses[i])),
+                                                     charges=np.squeeze(charges[start:end]) if has_charges[i] else None)
+
+    basis_sets = [MLABBasisSet(name=name, indices=load_array(f"basis_set_{i}")) for i, name in enumerate(meta["basis_sets"])]
+
+    return MLAB(number_of_configurations=meta["number_of_configurations"],
+                max_number_of_atom_types=meta["max_number_of_atom_types"],
+                atom_types=meta["atom_types"],
+                max_number_of_atoms_per_system=meta["max_number_of_atoms_per_system"],
+                max_number_of_atoms_per_type=meta["max_number_of_atoms_per_type"],
+                reference_energies=meta["reference_energies"],
+                atomic_masses=meta["atomic_masses"],
+                numbers_of_basis_sets=meta["numbers_of_basis_sets"],
+                basis_sets=basis_sets,
+                configurations=configurations)
+
+
+def remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def get_size(path: Path) -> int:
+    # Entries are files or directories of files
+    if path.is_dir():
+        return sum(file.stat().st_size for file in path.iterdir())
+    else:
+        return path.stat().st_size
+
+
+def write_atomically(path: Path, write: Callable[[Path], None]) -> None:
+    # write creates the file or directory at the temporary path it is given, which then replaces path. An interrupted
+    # write therefore never leaves a broken entry behind.
+    temporary_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    remove(temporary_path)
+
+    try:
+        write(temporary_path)
+
+        if temporary_path.is_dir():
+            remove(path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        remove(temporary_path)
+        raise
+
+
+def evict(entries: Iterable[Path],
+          max_size: int,
+          get_last_use: Callable[[Path], float] = lambda path: path.stat().st_mtime,
+          keep: Optional[Path] = None) -> int:
+    # Removes the least recently used entries until the rest take at most max_size bytes, except for keep. Returns the
+    # size of the entries that are left, which can still exceed max_size when keep does not fit on its own.
+    found = []
+    for path in entries:
+        try:
+            found.append((get_last_use(path), get_size(path), path))
+        except OSError:
+            continue
+
+    total_size = sum(size for _, size, _ in found)
+
+    for _, size, path in sorted(found):
+        if total_size <= max_size:
+            break
+
+        if path != keep:
+            remove(path)
+            total_size -= size
+
+    return total_size
+
+
+def _evict(cache_dir: Path, max_size: int, keep: Path) -> None:
+    # Every use of an entry touches its meta.json
+    total_size = evict(cache_dir.glob(f"*{_cache_suffix}"), max_size, lambda path: (path / "meta.json").stat().st_mtime, keep)
+
+    # An entry that does not fit on its own is not kept either
+    if total_size > max_size:
+        remove(keep)
+
+
+def get_content_hash(path: Union[str, Path], cache_dir: Optional[Path] = None) -> str:
+    # Taken from the cache entry of the file when its size and modification time still match, which saves reading the
+    # whole file again
+    path = Path(path)
+    key = CacheKey(path)
+
+    try:
+        with (get_entry_path(path, cache_dir) / "meta.json").open(mode="rt") as file:
+            meta = json.load(file)
+
+        if meta.get("version") == _cache_version and meta.get("size") == key.size and meta.get("mtime_ns") == key.mtime_ns:
+            return meta["content_hash"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return key.content_hash
+
+
+def clear(cache_dir: Path) -> None:
+    for entry_path in cache_dir.glob(f"*{_cache_suffix}"):
+        shutil.rmtree(entry_path, ignore_errors=True)
+
+
+def load_cached(path: Union[str, Path], cache_dir: Optional[Path] = None) -> Optional[MLAB]:
+    # Returns None when there is no valid cache entry for the file
+    path = Path(path)
+    key = CacheKey(path)
+    entry_path = get_entry_path(path, cache_dir)
+
+    try:
+        with (entry_path / "meta.json").open(mode="rt") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not _is_valid(meta, key):
+        return None
+
+    if meta["mtime_ns"] != key.mtime_ns:
+        meta["mtime_ns"] = key.mtime_ns
+        with (entry_path / "meta.json").open(mode="wt") as file:
+            json.dump(meta, file)
+    else:
+        (entry_path / "meta.json").touch()
+
+    return _read_entry(meta, entry_path)
+
+
+def load(path: Union[str, Path],
+         cache_dir: Optional[Path] = None,
+         max_size: int = _default_max_size,
+         engine: str = "block",
+         workers: int = 1,
+         validate: bool = False) -> MLAB:
+    # Loads an ML_AB file through a binary cache. Without cache_dir, the cache is a directory next to the input file.
+    # With validate, the file is validated as well: cached files after reading them, others while parsing them.
+    path = Path(path)
+
+    mlab = load_cached(path, cache_dir)
+    if mlab is not None:
+        if validate:
+            validation.validate(mlab)
+
+        return mlab
+
+    key = CacheKey(path)
+    entry_path = get_entry_path(path, cache_dir)
+
+    with path.open(mode="rt") as file:
+        if validate:
+            mlab = validation.load_validated(file, engine=engine)
+        else:
+            mlab = parsing.load(file, engine=engine, workers=workers)
+
+    if _is_cacheable(mlab):
+        try:
+            _write_entry(mlab, key, entry_path)
+
+            if cache_dir is not None:
+                _evict(cache_dir, max_size, keep=entry_path)
+            elif get_size(entry_path) > max_size:
+                shutil.rmtree(entry_path, ignore_errors=True)
+        except OSError:
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    return mlab
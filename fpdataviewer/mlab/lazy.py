@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import io
+import json
+import mmap
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+from fpdataviewer.mlab import cache
+from fpdataviewer.mlab.mlab import MLAB, MLABConfiguration, MLABConfigurationHeader, StressTensor
+from fpdataviewer.mlab.parsing import MLABBlockReader, ParserException, _find_configuration_ranges, _find_preceding_divider, \
+    _read_configuration, _read_global_header, _scan_ranges
+
+_index_version = 1
+_index_suffix = ".idx"
+
+
+@dataclass(frozen=True)
+class MLABIndex:
+    file_size: int
+    file_mtime_ns: int
+
+    global_header_end: int
+
+    starts: ArrayLike
+    ends: ArrayLike
+    lines: ArrayLike
+    indices: ArrayLike
+    header_ids: ArrayLike
+
+    headers: list[MLABConfigurationHeader]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class _MappedFile:
+    def __init__(self, path: Path, index: MLABIndex):
+        self.path = path
+        self.index = index
+        self.header_pool = {header: header for header in index.headers}
+
+        with path.open(mode="rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def reader(self, start: int, end: int, first_line: int) -> MLABBlockReader:
+        text = self.data[start:end].decode()
+        return MLABBlockReader(io.StringIO(text, newline=None), first_line=first_line)
+
+    def read_configuration(self, number: int) -> MLABConfiguration:
+        reader = self.reader(int(self.index.starts[number]), int(self.index.ends[number]), int(self.index.lines[number]))
+        return _read_configuration(reader, self.header_pool)
+
+
+class LazyMLABConfiguration:
+    # Stands in for MLABConfiguration. The index and header come from the index, everything else is parsed from the
+    # memory-mapped file on first access and kept afterwards.
+    def __init__(self, source: _MappedFile, number: int):
+        self.index = int(source.index.indices[number])
+        self.header = source.index.headers[source.index.header_ids[number]]
+
+        self._source = source
+        self._number = number
+        self._configuration = None
+
+    def _load(self) -> MLABConfiguration:
+        if self._configuration is None:
+            self._configuration = self._source.read_configuration(self._number)
+
+        return self._configuration
+
+    @property
+    def ctifor(self) -> Optional[float]:
+        return self._load().ctifor
+
+    @property
+    def lattice_vectors(self) -> ArrayLike:
+        return self._load().lattice_vectors
+
+    @property
+    def positions(self) -> ArrayLike:
+        return self._load().positions
+
+    @property
+    def energy(self) -> float:
+        return self._load().energy
+
+    @property
+    def forces(self) -> ArrayLike:
+        return self._load().forces
+
+    @property
+    def stress(self) -> StressTensor:
+        return self._load().stress
+
+    @property
+    def charges(self) -> Optional[ArrayLike]:
+        return self._load().charges
+
+    @property
+    def name(self) -> str:
+        return self.header.name
+
+    @property
+    def number_of_atom_types(self) -> int:
+        return self.header.number_of_atom_types
+
+    @property
+    def number_of_atoms(self) -> int:
+        return self.header.number_of_atoms
+
+    @property
+    def number_of_atoms_per_type(self) -> tuple[tuple[str, int], ...]:
+        return self.header.number_of_atoms_per_type
+
+    def generate_type_lookup(self) -> tuple[str, ...]:
+        return self.header.generate_type_lookup()
+
+
+def get_index_path(path: Path) -> Path:
+    return path.with_name(path.name + _index_suffix)
+
+
+def build_index(path: Path) -> MLABIndex:
+    stat = path.stat()
+
+    # Empty files cannot be memory-mapped
+    if stat.st_size == 0:
+        raise ParserException("unexpected end of file")
+
+    with path.open(mode="rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        starts, ends, lines = _find_configuration_ranges(data)
+
+        headers = {}
+        indices = []
+        header_ids = []
+
+        for index, header in _scan_ranges(data, starts, ends, lines, "utf-8", {}):
+            indices.append(index)
+            header_ids.append(headers.setdefault(header, len(headers)))
+
+        global_header_end = _find_preceding_divider(data, starts[0]) if len(starts) > 0 else len(data)
+
+    return MLABIndex(file_size=stat.st_size,
+                     file_mtime_ns=stat.st_mtime_ns,
+                     global_header_end=global_header_end,
+                     starts=np.array(starts, dtype=np.int64),
+                     ends=np.array(ends, dtype=np.int64),
+                     lines=np.array(lines, dtype=np.int64),
+                     indices=np.array(indices, dtype=np.int64),
+                     header_ids=np.array(header_ids, dtype=np.int64),
+                     headers=list(headers))
+
+
+def save_index(index: MLABIndex, index_path: Path) -> None:
+    headers = [[header.name, header.number_of_atom_types, header.number_of_atoms, header.number_of_atoms_per_type]
+               for header in index.headers]
+
+    def write(temporary_path: Path) -> None:
+        with temporary_path.open(mode="wb") as file:
+            np.savez(file,
+                     version=_index_version,
+                     file_size=index.file_size,
+                     file_mtime_ns=index.file_mtime_ns,
+                     global_header_end=index.global_header_end,
+                     starts=index.starts,
+                     ends=index.ends,
+                     lines=index.lines,
+                     indices=index.indices,
+                     header_ids=index.header_ids,
+                     headers=json.dumps(headers))
+
+    cache.write_atomically(index_path, write)
+
+
+def load_index(path: Path, index_path: Path) -> Optional[MLABIndex]:
+    # Returns None when there is no index, or when it is outdated or broken
+    try:
+        with np.load(index_path) as data:
+            if int(data["version"]) != _index_version:
+                return None
+
+            stat = path.stat()
+            if int(data["file_size"]) != stat.st_size or int(data["file_mtime_ns"]) != stat.st_mtime_ns:
+                return None
+
+            headers = [MLABConfigurationHeader(name=name,
+                                               number_of_atom_types=number_of_atom_types,
+                                               number_of_atoms=number_of_atoms,
+                                               number_of_atoms_per_type=tuple((type, amount) for type, amount in number_of_atoms_per_type))
+                       for name, number_of_atom_types, number_of_atoms, number_of_atoms_per_type in json.loads(str(data["headers"]))]
+
+            return MLABIndex(file_size=int(data["file_size"]),
+                             file_mtime_ns=int(data["file_mtime_ns"]),
+                             global_header_end=int(data["global_header_end"]),
+                             starts=data["starts"],
+                             ends=data["ends"],
+                             lines=data["lines"],
+                             indices=data["indices"],
+                             header_ids=data["header_ids"],
+                             headers=headers)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def load(path: Union[str, Path], use_index_file: bool = True) -> MLAB:
+    path = Path(path)
+    index_path = get_index_path(path)
+
+    index = load_index(path, index_path) if use_index_file else None
+
+    if index is None:
+        index = build_index(path)
+
+        if use_index_file:
+            try:
+                save_index(index, index_path)
+            except OSError:
+                pass
+
+    source = _MappedFile(path, index)
+
+    global_header = _read_global_header(source.reader(0, index.global_header_end, 1))
+    configurations = [LazyMLABConfiguration(source, number) for number in range(len(index))]
+
+    return MLAB(**global_header,
+                configurations=configurations)
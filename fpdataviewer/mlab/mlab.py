@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from functools import cached_property
 from itertools import chain
 from typing import Optional
 
+import numpy as np
 from numpy.typing import ArrayLike
 
 
@@ -37,6 +39,13 @@ class MLABConfigurationHeader:
         table = [[type] * amount for type, amount in self.number_of_atoms_per_type]
         return tuple(chain.from_iterable(table))
 
+    @cached_property
+    def type_ids(self) -> ArrayLike:
+        # Position in number_of_atoms_per_type of the type of every atom. Computed once, since all configurations of a
+        # section share their header.
+        amounts = [max(amount, 0) for _, amount in self.number_of_atoms_per_type]
+        return np.repeat(np.arange(len(amounts)), amounts)
+
 
 @dataclass(frozen=True)
 class MLABConfiguration:
@@ -96,6 +105,14 @@ class MLABSection:
     configurations: list[MLABConfiguration]
     header: MLABConfigurationHeader
 
+    # Data of all configurations in contiguous arrays, the arrays of the configurations above are views into these
+    lattice_vectors: ArrayLike
+    positions: ArrayLike
+    energies: ArrayLike
+    forces: ArrayLike
+    stresses: ArrayLike
+    charges: Optional[ArrayLike]
+
     @property
     def name(self) -> str:
         return self.header.name
@@ -114,3 +131,16 @@ class MLABSection:
 
     def generate_type_lookup(self) -> tuple[str, ...]:
         return self.header.generate_type_lookup()
+
+    def get_basis_set_mask(self) -> ArrayLike:
+        # Whether every atom of every configuration is in a basis set of the source file. Basis sets refer to
+        # configurations by their index and to atoms by their position in the configuration, both starting at 1.
+        positions = {conf.index: i for i, conf in enumerate(self.configurations)}
+
+        mask = np.zeros((len(self.configurations), self.number_of_atoms), dtype=np.bool_)
+        for basis_set in self.source.basis_sets:
+            for conf_index, atom_index in np.reshape(basis_set.indices, (-1, 2)):
+                if int(conf_index) in positions and 1 <= atom_index <= self.number_of_atoms:
+                    mask[positions[int(conf_index)], atom_index - 1] = True
+
+        return mask
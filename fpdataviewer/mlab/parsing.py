@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import io
+import mmap
 import re
 from collections import defaultdict
-from typing import TextIO, Optional
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import TextIO, Optional, Iterator, Iterable, Union
 
 import numpy as np
 from numpy.typing import ArrayLike
@@ -10,22 +15,30 @@ from numpy.typing import ArrayLike
 from fpdataviewer.mlab.mlab import MLAB, MLABBasisSet, MLABConfiguration, StressTensor, MLABConfigurationHeader, MLABSection
 
 _re_divider = re.compile(r"^\s*(=+|-+|\*+)\s*$")
+_re_divider_candidate = re.compile(r"\n[^\S\n]*[-=*]+[^\S\n]*(?=\n|\Z)")
 _re_basis_set = re.compile(r"^Basis set for ([a-zA-Z0-9]+)$")
 _re_configuration = re.compile(r"^Configuration num\.\s+([0-9]+)$")
 
 
 class ParserException(Exception):
-    def __init__(self, message):
+    # lines are the first and last line of the part of the file that could not be parsed, when known
+    def __init__(self, message, lines: Optional[tuple[int, int]] = None):
         super().__init__(message)
 
+        self.lines = lines
+
+    def __reduce__(self):
+        # Keeps the lines when the exception is passed on from a worker process
+        return type(self), (self.args[0], self.lines)
+
 
 class MLABReader:
-    def __init__(self, stream: TextIO):
+    def __init__(self, stream: TextIO, first_line: int = 1):
         self.stream = stream
 
-        self.line_counter = 1
-        self.buffer_start_line = 1
-        self.buffer_end_line = 1
+        self.line_counter = first_line
+        self.buffer_start_line = first_line
+        self.buffer_end_line = first_line
 
         self.buffer = []
         self.eof = False
@@ -60,10 +73,11 @@ class MLABReader:
             self.buffer_end_line = self.line_counter
 
         if len(self.buffer) == 0 and self.eof:
-            raise ParserException("unexpected end of file")
+            raise ParserException("unexpected end of file", (self.buffer_start_line, self.buffer_end_line))
 
     def error(self, message: str) -> ParserException:
-        return ParserException(f"on lines {self.buffer_start_line}-{self.buffer_end_line}: {message}, found {repr(''.join(self.buffer))}")
+        return ParserException(f"on lines {self.buffer_start_line}-{self.buffer_end_line}: {message}, found {repr(''.join(self.buffer))}",
+                               (self.buffer_start_line, self.buffer_end_line))
 
     def consume_sl_string(self) -> str:
         self.advance()
@@ -110,7 +124,10 @@ class MLABReader:
     def consume_ml_array(self) -> ArrayLike:
         self.advance()
 
-        return np.loadtxt(self.buffer)
+        try:
+            return np.loadtxt(self.buffer)
+        except ValueError:
+            raise self.error("expected array of decimal numbers")
 
     def consume_ml_strings(self) -> list[str]:
         self.advance()
@@ -136,7 +153,10 @@ class MLABReader:
     def consume_ml_basis(self) -> ArrayLike:
         self.advance()
 
-        return np.loadtxt(self.buffer, dtype=int)
+        try:
+            return np.loadtxt(self.buffer, dtype=int)
+        except ValueError:
+            raise self.error("expected array of integers")
 
     def consume_ml_atoms(self) -> list[tuple[str, int]]:
         self.advance()
@@ -194,9 +214,124 @@ class MLABReader:
         return match
 
 
-def load(stream: TextIO) -> MLAB:
-    reader = MLABReader(stream)
+class MLABBlockReader(MLABReader):
+    # Reads the stream in large chunks and splits them on divider lines in bulk, instead of matching every line on its
+    # own. Line numbers are kept identical to MLABReader. Numeric blocks are passed to loadtxt as they are, without
+    # stripping them line by line first, but converting the numbers themselves takes as long as in MLABReader: loadtxt
+    # already parses in C, and np.fromstring or converting the split block at once are no faster. The engine therefore
+    # only gains on the text handling around the numbers.
+    def __init__(self, stream: TextIO, first_line: int = 1, chunk_size: int = 1 << 24):
+        super().__init__(stream, first_line)
+
+        self.chunk_size = chunk_size
+        self.blocks = self._read_blocks()
+        self.block = ""
+
+    def _read_blocks(self) -> Iterator[tuple[str, int, int, bool]]:
+        line = self.line_counter
+        pending = ""
+
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            eof = chunk == ""
+
+            # Only complete lines are searched for dividers, the rest is carried over to the next chunk. Every line
+            # is preceded by a newline in the searched text, which lets the regex skip ahead quickly. The candidate
+            # pattern is cheaper than _re_divider but also accepts mixed lines like "=-=", so matches are checked.
+            text = pending + chunk
+            cut = len(text) if eof else text.rfind("\n") + 1
+            complete, pending = "\n" + text[:cut], text[cut:]
+
+            position = 1
+            for match in _re_divider_candidate.finditer(complete):
+                divider = match.group().strip()
+                if divider.count(divider[0]) != len(divider):
+                    continue
+
+                block = complete[position:match.start() + 1]
+                end_line = line + block.count("\n")
+
+                yield block, line, end_line, False
+
+                line = end_line + 1
+                position = match.end() + 1
+
+            if eof:
+                block = complete[position:]
+                end_line = line + block.count("\n") + (1 if block != "" and not block.endswith("\n") else 0)
+
+                yield block, line, end_line, True
+                return
+
+            pending = complete[position:] + pending
+
+    @property
+    def buffer(self) -> list[str]:
+        # Splitting into stripped lines is deferred, since numeric blocks are converted straight from the block text
+        if self._buffer is None:
+            self._buffer = [line for line in map(str.strip, self.block.split("\n")) if line != ""]
+
+        return self._buffer
+
+    @buffer.setter
+    def buffer(self, value: list[str]) -> None:
+        self._buffer = value
+
+    def advance(self) -> None:
+        if self.keep_buffer:
+            self.keep_buffer = False
+            return
+
+        self.block, self.buffer_start_line, self.buffer_end_line, self.eof = next(self.blocks, ("", self.line_counter, self.line_counter, True))
+        self.line_counter = self.buffer_end_line + 1
+        self.buffer = None
+
+        if self.eof and (self.block == "" or self.block.isspace()):
+            raise ParserException("unexpected end of file", (self.buffer_start_line, self.buffer_end_line))
+
+    def peek_regex(self, pattern: re.Pattern[str]) -> Optional[re.Match]:
+        self.advance()
+
+        # Blocks with more than one line never match, which is decided without splitting them into lines first
+        stripped = self.block.strip()
+        match = None if "\n" in stripped else pattern.fullmatch(stripped)
+
+        if not match:
+            self.keep_buffer = True
+
+        return match
+
+    def consume_ml_array(self) -> ArrayLike:
+        self.advance()
+
+        try:
+            return np.loadtxt(self.block.split("\n"))
+        except ValueError:
+            raise self.error("expected array of decimal numbers")
+
+    def consume_ml_basis(self) -> ArrayLike:
+        self.advance()
+
+        try:
+            return np.loadtxt(self.block.split("\n"), dtype=int)
+        except ValueError:
+            raise self.error("expected array of integers")
+
+
+_engines = {
+    "line": MLABReader,
+    "block": MLABBlockReader,
+}
+
+
+def _create_reader(stream: TextIO, engine: str, first_line: int = 1) -> MLABReader:
+    if engine not in _engines:
+        raise ValueError(f"unknown parser engine {repr(engine)}, expected one of {', '.join(_engines)}")
 
+    return _engines[engine](stream, first_line=first_line)
+
+
+def _read_global_header(reader: MLABReader) -> dict:
     reader.advance() # Initial comment, usually either empty or "1.0 Version"
 
     reader.consume_header("The number of configurations")
@@ -224,7 +359,7 @@ def load(stream: TextIO) -> MLAB:
     numbers_of_basis_sets = reader.consume_ml_ints()
 
     basis_sets = []
-    while name_match := reader.peek_regex(_re_basis_set):
+    while not reader.eof and (name_match := reader.peek_regex(_re_basis_set)):
         name = name_match.group(1)
 
         indices = reader.consume_ml_basis()
@@ -232,95 +367,512 @@ def load(stream: TextIO) -> MLAB:
         basis_sets.append(MLABBasisSet(name=name,
                                        indices=indices))
 
-    header_pool = {}
-    configurations = []
-    while index_match := reader.consume_regex(_re_configuration):
-        try:
-            index = int(index_match.group(1))
-        except ValueError:
-            raise reader.error("invalid configuration number")
+    return {
+        "number_of_configurations": number_of_configurations,
+        "max_number_of_atom_types": max_number_of_atom_types,
+        "atom_types": atom_types,
+        "max_number_of_atoms_per_system": max_number_of_atoms_per_system,
+        "max_number_of_atoms_per_type": max_number_of_atoms_per_type,
+        "reference_energies": reference_energies,
+        "atomic_masses": atomic_masses,
+        "numbers_of_basis_sets": numbers_of_basis_sets,
+        "basis_sets": basis_sets,
+    }
 
-        reader.consume_header("System name")
-        name = reader.consume_sl_string()
 
-        reader.consume_header("The number of atom types")
-        number_of_atom_types = reader.consume_sl_int()
+def _read_configuration_header(reader: MLABReader, header_pool: dict) -> tuple[int, MLABConfigurationHeader]:
+    index_match = reader.consume_regex(_re_configuration)
+    try:
+        index = int(index_match.group(1))
+    except ValueError:
+        raise reader.error("invalid configuration number")
 
-        reader.consume_header("The number of atoms")
-        number_of_atoms = reader.consume_sl_int()
+    reader.consume_header("System name")
+    name = reader.consume_sl_string()
 
-        reader.consume_header("Atom types and atom numbers")
-        number_of_atoms_per_type = tuple(reader.consume_ml_atoms())
+    reader.consume_header("The number of atom types")
+    number_of_atom_types = reader.consume_sl_int()
 
-        header_candidate = MLABConfigurationHeader(name=name,
-                                                   number_of_atom_types=number_of_atom_types,
-                                                   number_of_atoms=number_of_atoms,
-                                                   number_of_atoms_per_type=number_of_atoms_per_type)
+    reader.consume_header("The number of atoms")
+    number_of_atoms = reader.consume_sl_int()
 
-        header = header_pool.get(header_candidate)
-        if header is None:
-            header = header_candidate
-            header_pool[header_candidate] = header_candidate
+    reader.consume_header("Atom types and atom numbers")
+    number_of_atoms_per_type = tuple(reader.consume_ml_atoms())
 
-        if reader.peek_header("CTIFOR"):
-            ctifor = reader.consume_sl_float()
-        else:
-            ctifor = None
+    header_candidate = MLABConfigurationHeader(name=name,
+                                               number_of_atom_types=number_of_atom_types,
+                                               number_of_atoms=number_of_atoms,
+                                               number_of_atoms_per_type=number_of_atoms_per_type)
 
-        reader.consume_header("Primitive lattice vectors (ang.)")
-        lattice_vectors = reader.consume_ml_array()
+    header = header_pool.get(header_candidate)
+    if header is None:
+        header = header_candidate
+        header_pool[header_candidate] = header_candidate
 
-        reader.consume_header("Atomic positions (ang.)")
-        positions = reader.consume_ml_array()
+    return index, header
 
-        reader.consume_header("Total energy (eV)")
-        energy = reader.consume_sl_float()
 
-        reader.consume_header("Forces (eV ang.^-1)")
-        forces = reader.consume_ml_array()
+def _read_configuration(reader: MLABReader, header_pool: dict) -> MLABConfiguration:
+    index, header = _read_configuration_header(reader, header_pool)
 
-        reader.consume_header("Stress (kbar)")
-        reader.consume_header("XX YY ZZ")
-        xx, yy, zz = reader.consume_sl_vector()
-        reader.consume_header("XY YZ ZX")
-        xy, yz, zx = reader.consume_sl_vector()
+    if reader.peek_header("CTIFOR"):
+        ctifor = reader.consume_sl_float()
+    else:
+        ctifor = None
 
-        stress = StressTensor(xx, yy, zz, xy, yz, zx)
+    reader.consume_header("Primitive lattice vectors (ang.)")
+    lattice_vectors = reader.consume_ml_array()
 
-        if not reader.eof and reader.peek_header("Charges (e)"):
-            charges = reader.consume_ml_array()
-        else:
-            charges = None
-
-        configurations.append(MLABConfiguration(index=index,
-                                                header=header,
-                                                ctifor=ctifor,
-                                                lattice_vectors=lattice_vectors,
-                                                positions=positions,
-                                                energy=energy,
-                                                forces=forces,
-                                                stress=stress,
-                                                charges=charges))
+    reader.consume_header("Atomic positions (ang.)")
+    positions = reader.consume_ml_array()
+
+    reader.consume_header("Total energy (eV)")
+    energy = reader.consume_sl_float()
+
+    reader.consume_header("Forces (eV ang.^-1)")
+    forces = reader.consume_ml_array()
+
+    reader.consume_header("Stress (kbar)")
+    reader.consume_header("XX YY ZZ")
+    xx, yy, zz = reader.consume_sl_vector()
+    reader.consume_header("XY YZ ZX")
+    xy, yz, zx = reader.consume_sl_vector()
+
+    stress = StressTensor(xx, yy, zz, xy, yz, zx)
+
+    if not reader.eof and reader.peek_header("Charges (e)"):
+        charges = reader.consume_ml_array()
+    else:
+        charges = None
+
+    return MLABConfiguration(index=index,
+                             header=header,
+                             ctifor=ctifor,
+                             lattice_vectors=lattice_vectors,
+                             positions=positions,
+                             energy=energy,
+                             forces=forces,
+                             stress=stress,
+                             charges=charges)
+
+
+def _read_configurations(reader: MLABReader, header_pool: dict) -> Iterator[MLABConfiguration]:
+    for conf, _ in _read_configurations_with_lines(reader, header_pool):
+        yield conf
+
+
+def _read_configurations_with_lines(reader: MLABReader, header_pool: dict) -> Iterator[tuple[MLABConfiguration, tuple[int, int]]]:
+    # Also yields the first and last line of every configuration, without the dividers around it
+    while True:
+        start = reader.buffer_start_line if reader.keep_buffer else reader.line_counter
+
+        conf = _read_configuration(reader, header_pool)
+
+        end = reader.buffer_start_line - 2 if reader.keep_buffer else reader.buffer_end_line - 1
+
+        yield conf, (start, end)
+
+        if reader.eof:
+            break
+
+
+def _skip_configuration_body(reader: MLABReader) -> None:
+    # Passes over the remaining blocks of a configuration without converting any of them
+    while not reader.eof:
+        if reader.peek_regex(_re_configuration):
+            reader.keep_buffer = True
+            return
+
+        reader.keep_buffer = False
+
+
+def _scan_configurations(reader: MLABReader, header_pool: dict) -> Iterator[tuple[int, MLABConfigurationHeader]]:
+    while True:
+        yield _read_configuration_header(reader, header_pool)
+
+        _skip_configuration_body(reader)
 
         if reader.eof:
             break
 
-    return MLAB(number_of_configurations=number_of_configurations,
-                max_number_of_atom_types=max_number_of_atom_types,
-                atom_types=atom_types,
-                max_number_of_atoms_per_system=max_number_of_atoms_per_system,
-                max_number_of_atoms_per_type=max_number_of_atoms_per_type,
-                reference_energies=reference_energies,
-                atomic_masses=atomic_masses,
-                numbers_of_basis_sets=numbers_of_basis_sets,
-                basis_sets=basis_sets,
+
+def _find_preceding_divider(data: bytes, position: int) -> int:
+    end = position
+    while end > 0:
+        start = data.rfind(b"\n", 0, end - 1) + 1
+        line = data[start:end].strip()
+
+        if line == b"":
+            end = start
+        elif _re_divider.fullmatch(line.decode()):
+            return start
+        else:
+            break
+
+    return position
+
+
+def _find_configuration_ranges(data: bytes, start: int = 0, first_line: int = 1) -> tuple[list[int], list[int], list[int]]:
+    # Locates every "Configuration num." line in a bytes-like object (usually a memory-mapped file), beginning at the
+    # line that starts at offset start. Each range starts at that line and ends before the divider line that precedes
+    # the next configuration, so that the range can be parsed on its own. Returns the starts, ends and the line number of
+    # every start.
+    starts = []
+    lines = []
+
+    line = first_line
+    previous = start
+    position = data.find(b"Configuration num.", start)
+    while position != -1:
+        line_start = data.rfind(b"\n", 0, position) + 1
+
+        if data[line_start:position].strip() == b"":
+            line += data[previous:line_start].count(b"\n")
+            previous = line_start
+
+            starts.append(line_start)
+            lines.append(line)
+
+        position = data.find(b"Configuration num.", position + 1)
+
+    ends = [_find_preceding_divider(data, start) for start in starts[1:]] + [len(data)]
+
+    return starts, ends, lines
+
+
+def _scan_ranges(data: bytes,
+                 starts: list[int],
+                 ends: list[int],
+                 lines: list[int],
+                 encoding: str,
+                 header_pool: dict) -> list[tuple[int, MLABConfigurationHeader]]:
+    scanned = []
+
+    for start, end, line in zip(starts, ends, lines):
+        # Only the blocks up to the atom types are needed, the numeric blocks are never decoded
+        header_end = data.find(b"Primitive lattice vectors", start, end)
+        header_end = end if header_end == -1 else header_end
+
+        text = data[start:header_end].decode(encoding)
+        reader = MLABBlockReader(io.StringIO(text, newline=None), first_line=line)
+
+        scanned.append(_read_configuration_header(reader, header_pool))
+
+    return scanned
+
+
+class MLABStream:
+    # Global header of an ML_AB file, which is parsed up front, followed by a one-shot iterator over its configurations.
+    # Configurations are parsed as they are requested, so only the current one is kept in memory.
+    def __init__(self, reader: MLABReader):
+        global_header = _read_global_header(reader)
+
+        self.number_of_configurations: int = global_header["number_of_configurations"]
+        self.max_number_of_atom_types: int = global_header["max_number_of_atom_types"]
+        self.max_number_of_atoms_per_system: int = global_header["max_number_of_atoms_per_system"]
+        self.max_number_of_atoms_per_type: int = global_header["max_number_of_atoms_per_type"]
+
+        self.atom_types: list[str] = global_header["atom_types"]
+        self.reference_energies: list[float] = global_header["reference_energies"]
+        self.atomic_masses: list[float] = global_header["atomic_masses"]
+        self.numbers_of_basis_sets: list[int] = global_header["numbers_of_basis_sets"]
+
+        self.basis_sets: list[MLABBasisSet] = global_header["basis_sets"]
+
+        # Lines of the configuration that was returned last
+        self.configuration_lines: Optional[tuple[int, int]] = None
+
+        self.configurations = self._read_configurations(reader)
+
+    def _read_configurations(self, reader: MLABReader) -> Iterator[MLABConfiguration]:
+        for conf, self.configuration_lines in _read_configurations_with_lines(reader, {}):
+            yield conf
+
+    def __iter__(self) -> Iterator[MLABConfiguration]:
+        return self.configurations
+
+    def __next__(self) -> MLABConfiguration:
+        return next(self.configurations)
+
+
+def iter_configurations(stream: TextIO, engine: str = "line") -> MLABStream:
+    return MLABStream(_create_reader(stream, engine))
+
+
+def scan(stream: TextIO, engine: str = "block") -> list[tuple[int, MLABConfigurationHeader]]:
+    # Reads only the index and header of every configuration, which is enough to split a file into sections. Streams
+    # opened from a file are memory-mapped and searched for configurations directly, others are read block by block.
+    path = getattr(stream, "name", None)
+    if not isinstance(path, str):
+        reader = _create_reader(stream, engine)
+        _read_global_header(reader)
+
+        return list(_scan_configurations(reader, {}))
+
+    encoding = getattr(stream, "encoding", None) or "utf-8"
+
+    with open(path, mode="rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        starts, ends, lines = _find_configuration_ranges(data)
+
+        global_header_end = _find_preceding_divider(data, starts[0]) if len(starts) > 0 else len(data)
+        global_header_text = data[:global_header_end].decode(encoding)
+        _read_global_header(_create_reader(io.StringIO(global_header_text, newline=None), engine))
+
+        return _scan_ranges(data, starts, ends, lines, encoding, {})
+
+
+def _load_range(path: str, encoding: str, engine: str, start: int, end: int, first_line: int) -> list[MLABConfiguration]:
+    with open(path, mode="rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode(encoding)
+
+    reader = _create_reader(io.StringIO(text, newline=None), engine, first_line)
+
+    return list(_read_configurations(reader, {}))
+
+
+def _load_parallel(stream: TextIO, engine: str, workers: int) -> MLAB:
+    # The file is cut at configuration boundaries into a few pieces per worker, which are parsed in separate processes.
+    # Every piece knows its first line number, so errors report the same lines as a serial parse.
+    path = getattr(stream, "name", None)
+    if not isinstance(path, str):
+        raise ValueError("parsing with multiple workers requires a stream that was opened from a file")
+
+    encoding = getattr(stream, "encoding", None) or "utf-8"
+
+    with open(path, mode="rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        starts, ends, lines = _find_configuration_ranges(data)
+
+        if len(starts) == 0:
+            return load(stream, engine)
+
+        global_header_text = data[:_find_preceding_divider(data, starts[0])].decode(encoding)
+
+    global_header = _read_global_header(_create_reader(io.StringIO(global_header_text, newline=None), engine))
+
+    pieces = np.array_split(np.arange(len(starts)), min(len(starts), 4 * workers))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_load_range, path, encoding, engine, starts[piece[0]], ends[piece[-1]], lines[piece[0]])
+                   for piece in pieces]
+
+        # Headers are deduplicated per worker, so equal headers from different pieces are merged again here
+        header_pool = {}
+        configurations = []
+        for future in futures:
+            for conf in future.result():
+                header = header_pool.setdefault(conf.header, conf.header)
+                configurations.append(conf if header is conf.header else replace(conf, header=header))
+
+    _stack(configurations)
+
+    return MLAB(**global_header,
+                configurations=configurations)
+
+
+def load(stream: TextIO, engine: str = "line", workers: int = 1) -> MLAB:
+    if workers > 1:
+        return _load_parallel(stream, engine, workers)
+
+    mlab_stream = iter_configurations(stream, engine)
+    configurations = list(mlab_stream)
+    _stack(configurations)
+
+    return MLAB(number_of_configurations=mlab_stream.number_of_configurations,
+                max_number_of_atom_types=mlab_stream.max_number_of_atom_types,
+                atom_types=mlab_stream.atom_types,
+                max_number_of_atoms_per_system=mlab_stream.max_number_of_atoms_per_system,
+                max_number_of_atoms_per_type=mlab_stream.max_number_of_atoms_per_type,
+                reference_energies=mlab_stream.reference_energies,
+                atomic_masses=mlab_stream.atomic_masses,
+                numbers_of_basis_sets=mlab_stream.numbers_of_basis_sets,
+                basis_sets=mlab_stream.basis_sets,
                 configurations=configurations)
 
 
+@dataclass(frozen=True)
+class MLABResumePoint:
+    offset: int
+    line: int
+    number_of_configurations: int
+
+    # Last bytes before offset, to notice files that were rewritten instead of appended to
+    fingerprint: bytes
+
+
+_fingerprint_size = 256
+
+
+def load_appended(path: Union[str, Path],
+                  resume_point: Optional[MLABResumePoint] = None,
+                  engine: str = "line",
+                  include_last: bool = False) -> tuple[MLAB, MLABResumePoint]:
+    # Parses the configurations that were appended to a file since resume_point was returned by an earlier call (or all
+    # of them, without a resume point or when the file was rewritten since). The returned MLAB holds the current global
+    # header and the new configurations only. The last configuration of the file may still be being written, so it is
+    # left for the next call unless another configuration follows it or include_last is set.
+    path = Path(path)
+
+    with path.open(mode="rb") as file:
+        if path.stat().st_size == 0:
+            raise ParserException("unexpected end of file")
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if resume_point is not None \
+                    and resume_point.offset <= len(data) \
+                    and data[max(0, resume_point.offset - _fingerprint_size):resume_point.offset] == resume_point.fingerprint:
+                offset, line, number_of_configurations = resume_point.offset, resume_point.line, resume_point.number_of_configurations
+            else:
+                offset, line, number_of_configurations = 0, 1, 0
+
+            first_start = data.find(b"Configuration num.")
+            first_start = len(data) if first_start == -1 else data.rfind(b"\n", 0, first_start) + 1
+
+            global_header_text = data[:_find_preceding_divider(data, first_start)].decode()
+            global_header = _read_global_header(_create_reader(io.StringIO(global_header_text, newline=None), engine))
+
+            starts, ends, lines = _find_configuration_ranges(data, offset, line)
+            if not include_last and len(starts) > 0:
+                # The pending configuration becomes the new resume point
+                offset, line = starts[-1], lines[-1]
+                starts, ends, lines = starts[:-1], ends[:-1], lines[:-1]
+            elif len(starts) > 0:
+                offset, line = len(data), lines[-1] + data[starts[-1]:].count(b"\n")
+
+            if len(starts) > 0:
+                text = data[starts[0]:ends[-1]].decode()
+                configurations = list(_read_configurations(_create_reader(io.StringIO(text, newline=None), engine, lines[0]), {}))
+            else:
+                configurations = []
+
+            fingerprint = data[max(0, offset - _fingerprint_size):offset]
+
+    resume_point = MLABResumePoint(offset=offset,
+                                   line=line,
+                                   number_of_configurations=number_of_configurations + len(configurations),
+                                   fingerprint=fingerprint)
+
+    return MLAB(**global_header,
+                configurations=configurations), resume_point
+
+
+def _find_stacked_view(arrays: list[ArrayLike], shape: tuple[int, ...]) -> Optional[ArrayLike]:
+    # Returns the arrays as a single array of the given shape without copying them, when they are consecutive parts of
+    # one contiguous array, like load and the cache leave them. Returns None otherwise.
+    if len(arrays) == 0 or not all(isinstance(array, np.ndarray) for array in arrays):
+        return None
+
+    size = int(np.prod(shape[1:]))
+
+    root = arrays[0]
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+
+    if size == 0 or root.dtype != np.float64 or not root.flags.c_contiguous:
+        return None
+
+    address = root.__array_interface__["data"][0]
+    offset, remainder = divmod(arrays[0].__array_interface__["data"][0] - address, root.itemsize)
+    if remainder != 0 or offset < 0 or offset + len(arrays) * size > root.size:
+        return None
+
+    for i, array in enumerate(arrays):
+        if array.dtype != root.dtype or array.size != size or not array.flags.c_contiguous \
+                or array.__array_interface__["data"][0] != address + (offset + i * size) * root.itemsize:
+            return None
+
+    return root.reshape(-1)[offset:offset + len(arrays) * size].reshape(shape)
+
+
+def _get_stacked(arrays: list[ArrayLike], shape: tuple[int, ...]) -> ArrayLike:
+    stacked = _find_stacked_view(arrays, shape)
+
+    if stacked is None:
+        stacked = np.empty(shape)
+        for i, array in enumerate(arrays):
+            stacked[i] = np.reshape(array, shape[1:])
+
+    return stacked
+
+
+def _stack_configurations(header: MLABConfigurationHeader,
+                          confs: list[MLABConfiguration]) -> tuple[list[MLABConfiguration], dict[str, Optional[ArrayLike]]]:
+    # Returns the data of configurations with the same header in contiguous arrays, and the configurations with their
+    # arrays replaced by views into those
+    shape = (len(confs), header.number_of_atoms, 3)
+
+    for conf in confs:
+        if np.shape(conf.lattice_vectors) != (3, 3) or np.size(conf.positions) != np.prod(shape[1:]) or np.size(conf.forces) != np.prod(shape[1:]):
+            raise ParserException(f"configuration {conf.index} does not contain data for {header.number_of_atoms} atoms")
+
+    has_charges = all(conf.charges is not None and np.size(conf.charges) == shape[1] for conf in confs)
+
+    arrays = {
+        "lattice_vectors": _get_stacked([conf.lattice_vectors for conf in confs], (len(confs), 3, 3)),
+        "positions": _get_stacked([conf.positions for conf in confs], shape),
+        "energies": np.array([conf.energy for conf in confs], dtype=np.float64).reshape(len(confs)),
+        "forces": _get_stacked([conf.forces for conf in confs], shape),
+        "stresses": np.array([(conf.stress.xx, conf.stress.yy, conf.stress.zz, conf.stress.xy, conf.stress.yz, conf.stress.zx)
+                              for conf in confs], dtype=np.float64).reshape(len(confs), 6),
+        "charges": _get_stacked([conf.charges for conf in confs], shape[:2]) if has_charges else None,
+    }
+
+    # The views keep the shapes of the parsed arrays, which differ for configurations with a single atom
+    views = [MLABConfiguration(index=conf.index,
+                               header=conf.header,
+                               ctifor=conf.ctifor,
+                               lattice_vectors=arrays["lattice_vectors"][i],
+                               positions=arrays["positions"][i].reshape(np.shape(conf.positions)),
+                               energy=conf.energy,
+                               forces=arrays["forces"][i].reshape(np.shape(conf.forces)),
+                               stress=conf.stress,
+                               charges=arrays["charges"][i].reshape(np.shape(conf.charges)) if has_charges else conf.charges)
+             for i, conf in enumerate(confs)]
+
+    return views, arrays
+
+
+def _stack(configurations: list[MLABConfiguration]) -> None:
+    # Moves the data of every section into contiguous arrays once, right after parsing, and replaces the configurations
+    # in the list by views into them. Sections are stacked one by one, so the parsed arrays of a section are freed before
+    # the next one is copied, and split later takes the arrays as they are. Sections with data of the wrong size are
+    # left as they are, for validation to report.
+    sections = defaultdict(list)
+    for i, conf in enumerate(configurations):
+        sections[conf.header].append(i)
+
+    for header, numbers in sections.items():
+        try:
+            views, _ = _stack_configurations(header, [configurations[i] for i in numbers])
+        except ParserException:
+            continue
+
+        for i, view in zip(numbers, views):
+            configurations[i] = view
+
+
+def _create_section(mlab: MLAB, header: MLABConfigurationHeader, confs: list[MLABConfiguration]) -> MLABSection:
+    views, arrays = _stack_configurations(header, confs)
+
+    return MLABSection(source=mlab,
+                       configurations=views,
+                       header=header,
+                       **arrays)
+
+
 def split(mlab: MLAB) -> list[MLABSection]:
     sections = defaultdict(list)
 
     for conf in mlab.configurations:
         sections[conf.header].append(conf)
 
-    return [MLABSection(configurations=confs, source=mlab, header=header) for header, confs in sections.items()]
+    return [_create_section(mlab, header, confs) for header, confs in sections.items()]
+
+
+def split_stream(configurations: Iterable[MLABConfiguration]) -> Iterator[tuple[int, MLABConfiguration]]:
+    # Single-pass counterpart of split: pairs every configuration with the number of its section, in the same order
+    # that split would return the sections in, without keeping the configurations around
+    section_numbers = {}
+
+    for conf in configurations:
+        yield section_numbers.setdefault(conf.header, len(section_numbers)), conf
@@ -1,8 +1,19 @@
 from __future__ import annotations
 
-from typing import Any
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional, Sequence, TextIO, Union
 
-from fpdataviewer.mlab.mlab import MLAB
+import numpy as np
+from numpy.typing import ArrayLike
+
+from fpdataviewer.mlab import parsing
+from fpdataviewer.mlab.mlab import MLAB, MLABConfiguration, MLABConfigurationHeader
+from fpdataviewer.mlab.parsing import MLABStream, ParserException, _stack, _stack_configurations
+
+
+_physics_chunk_size = 1024
 
 
 class ValidationException(Exception):
@@ -10,120 +21,384 @@ class ValidationException(Exception):
         super().__init__(message)
 
 
+@dataclass(frozen=True)
+class ValidationProblem:
+    check: str
+    message: str
+
+    configuration: Optional[int] = None
+    lines: Optional[tuple[int, int]] = None
+
+
 def _error(message: str) -> ValidationException:
     return ValidationException(f"problem validating file: {message}")
 
 
-def _assert_eq(reported: Any, expected: Any, message: str) -> None:
+# Checks yield a message for every problem they find. validate raises the first one, report collects all of them.
+def _check_eq(reported: Any, expected: Any, message: str) -> Iterator[str]:
     if reported != expected:
-        raise _error(message.format(reported, expected))
+        yield message.format(reported, expected)
 
-def _validate_global(mlab: MLAB) -> None:
+
+def _raise_first(messages: Iterator[str]) -> None:
+    for message in messages:
+        raise _error(message)
+
+
+def _check_global(mlab: Union[MLAB, MLABStream],
+                  number_of_configurations: int,
+                  max_number_of_atoms_per_system: int,
+                  max_number_of_atoms_per_type: int,
+                  atom_types: set[str]) -> Iterator[str]:
     # Numbers
-    _assert_eq(mlab.number_of_configurations,
-               len(mlab.configurations),
-               "\'The number of configurations\' is {0} but {1} were found")
+    yield from _check_eq(mlab.number_of_configurations,
+                         number_of_configurations,
+                         "\'The number of configurations\' is {0} but {1} were found")
 
-    _assert_eq(mlab.max_number_of_atom_types,
-               len(mlab.atom_types),
-               "\'The maximum number of atom type\' is {0} but {1} are named")
+    yield from _check_eq(mlab.max_number_of_atom_types,
+                         len(mlab.atom_types),
+                         "\'The maximum number of atom type\' is {0} but {1} are named")
 
-    _assert_eq(mlab.max_number_of_atoms_per_system,
-               max(conf.number_of_atoms for conf in mlab.configurations),
-               "\'The maximum number of atoms per system\' is {0} but the maximum is {1}")
+    yield from _check_eq(mlab.max_number_of_atoms_per_system,
+                         max_number_of_atoms_per_system,
+                         "\'The maximum number of atoms per system\' is {0} but the maximum is {1}")
 
-    _assert_eq(mlab.max_number_of_atoms_per_type,
-               max(amount for conf in mlab.configurations for _, amount in conf.number_of_atoms_per_type),
-               "\'The maximum number of atoms per atom type\' is {0} but the maximum is {1}")
+    yield from _check_eq(mlab.max_number_of_atoms_per_type,
+                         max_number_of_atoms_per_type,
+                         "\'The maximum number of atoms per atom type\' is {0} but the maximum is {1}")
 
     # Atom types
-    _assert_eq(len(mlab.atom_types),
-               len(set(mlab.atom_types)),
-               "\'The atom types in the data file\' contains duplicate elements")
+    yield from _check_eq(len(mlab.atom_types),
+                         len(set(mlab.atom_types)),
+                         "\'The atom types in the data file\' contains duplicate elements")
 
-    _assert_eq(set(mlab.atom_types),
-               {atom_type for conf in mlab.configurations for atom_type, _ in conf.number_of_atoms_per_type},
-               "\'The atom types in the data file\' are {0}, but {1} were found")
+    yield from _check_eq(set(mlab.atom_types),
+                         atom_types,
+                         "\'The atom types in the data file\' are {0}, but {1} were found")
 
     # Per-atom-type values
-    _assert_eq(len(mlab.reference_energies),
-               len(mlab.atom_types),
-               "\'Reference atomic energy\' contains {0} items but {1} types were named")
+    yield from _check_eq(len(mlab.reference_energies),
+                         len(mlab.atom_types),
+                         "\'Reference atomic energy\' contains {0} items but {1} types were named")
+
+    yield from _check_eq(len(mlab.atomic_masses),
+                         len(mlab.atom_types),
+                         "\'Atomic mass\' contains {0} items but {1} types were named")
+
+    yield from _check_eq(len(mlab.numbers_of_basis_sets),
+                         len(mlab.atom_types),
+                         "\'The numbers of basis sets per atom type\' contains {0} items but {1} types were named")
+
+
+def _check_configuration(i: int, conf: MLABConfiguration) -> Iterator[str]:
+    if conf.index != i + 1:
+        yield f"configurations are not indexed sequentially ({i + 1}'s configuration has index {conf.index})"
+
+    yield from _check_eq(conf.number_of_atom_types,
+                         len(conf.number_of_atoms_per_type),
+                         f"in configuration {conf.index}, \'The number of atom types\' is {{0}} but {{1}} are named")
+
+    yield from _check_eq(len({name for name, _ in conf.number_of_atoms_per_type}),
+                         conf.number_of_atom_types,
+                         f"in configuration {conf.index}, \'Atom types and atom numbers\' contains duplicate elements")
+
+    yield from _check_eq(sum([amount for _, amount in conf.number_of_atoms_per_type]),
+                         conf.number_of_atoms,
+                         f"in configuration {conf.index}, \'Atom types and atom numbers\' has a total of {{0}} atoms, but {{1}} only exist")
+
+    yield from _check_eq(conf.lattice_vectors.shape,
+                         (3, 3),
+                         f"in configuration {conf.index}, \'Primitive lattice vectors (ang.)\' has shape {{0}} but expected {{1}}")
+
+    yield from _check_eq(conf.positions.shape,
+                         (conf.number_of_atoms, 3),
+                         f"in configuration {conf.index}, \'Atomic positions (ang.)\' has shape {{0}} but expected {{1}}")
+
+    yield from _check_eq(conf.forces.shape,
+                         (conf.number_of_atoms, 3),
+                         f"in configuration {conf.index}, \'Forces (eV ang.^-1)\' has shape {{0}} but expected {{1}}")
+
+    if conf.charges is not None:
+        yield from _check_eq(conf.charges.shape,
+                             (conf.number_of_atoms,),
+                             f"in configuration {conf.index}, \'Charges (e)\' has shape {{0}} but expected {{1}}")
+
+
+def _get_arrays(conf: MLABConfiguration) -> dict[str, Optional[ArrayLike]]:
+    # The arrays of a single configuration, shaped like the stacked arrays of a section with one configuration
+    return {
+        "lattice_vectors": np.reshape(conf.lattice_vectors, (1,) + np.shape(conf.lattice_vectors)),
+        "positions": np.reshape(conf.positions, (1, -1)),
+        "energies": np.array([conf.energy], dtype=np.float64),
+        "forces": np.reshape(conf.forces, (1, -1)),
+        "stresses": np.array([[conf.stress.xx, conf.stress.yy, conf.stress.zz, conf.stress.xy, conf.stress.yz, conf.stress.zx]], dtype=np.float64),
+        "charges": np.reshape(conf.charges, (1, -1)) if conf.charges is not None else None,
+    }
+
+
+def _check_physics_arrays(numbers: Sequence[int], arrays: dict[str, Optional[ArrayLike]]) -> Iterator[tuple[int, str]]:
+    # Checks the rows of stacked arrays at once, numbers gives the position of the configuration of every row. Arrays
+    # that are missing are not checked.
+    numbers = np.asarray(numbers)
+
+    for name, key in [("Primitive lattice vectors (ang.)", "lattice_vectors"),
+                      ("Atomic positions (ang.)", "positions"),
+                      ("Forces (eV ang.^-1)", "forces"),
+                      ("Charges (e)", "charges")]:
+        if arrays.get(key) is not None:
+            non_finite = np.count_nonzero(~np.isfinite(np.reshape(arrays[key], (len(numbers), -1))), axis=1)
+            for number, count in zip(numbers[non_finite > 0], non_finite[non_finite > 0]):
+                yield int(number), f"\'{name}\' contains {count} values that are not finite"
+
+    if arrays.get("energies") is not None:
+        for number in numbers[~np.isfinite(arrays["energies"])]:
+            yield int(number), "\'Total energy (eV)\' is not finite"
+
+    if arrays.get("stresses") is not None:
+        for number in numbers[~np.isfinite(arrays["stresses"]).all(axis=1)]:
+            yield int(number), "\'Stress (kbar)\' is not finite"
+
+    lattice_vectors = arrays.get("lattice_vectors")
+    if lattice_vectors is not None and lattice_vectors.shape[1:] == (3, 3):
+        finite = np.isfinite(lattice_vectors).all(axis=(1, 2))
+        flat = np.zeros(len(numbers), dtype=bool)
+        flat[finite] = np.abs(np.linalg.det(lattice_vectors[finite])) < 1e-6
+
+        for number in numbers[flat]:
+            yield int(number), "\'Primitive lattice vectors (ang.)\' span no volume"
+
+
+def _check_physics(confs: Sequence[MLABConfiguration]) -> list[tuple[int, str]]:
+    # Values that parse fine but cannot come from a sensible calculation. The configurations are checked a section at a
+    # time on their stacked arrays, problems are returned with the position of their configuration in confs, in order.
+    sections = defaultdict(list)
+    for i, conf in enumerate(confs):
+        sections[conf.header].append(i)
+
+    problems = []
+
+    for header, numbers in sections.items():
+        try:
+            _, arrays = _stack_configurations(header, [confs[i] for i in numbers])
+            groups = [(numbers, arrays)]
+
+            # Charges are only stacked when every configuration has them
+            if arrays["charges"] is None:
+                groups.extend(([i], {"charges": np.reshape(confs[i].charges, (1, -1))}) for i in numbers if confs[i].charges is not None)
+        except ParserException:
+            # Sections with data of the wrong size are reported by the configuration checks, and checked one by one here
+            groups = [([i], _get_arrays(confs[i])) for i in numbers]
+
+        for rows, arrays in groups:
+            problems.extend(_check_physics_arrays(rows, arrays))
+
+    # Stable, so the problems of a configuration stay in the order of the checks
+    problems.sort(key=lambda problem: problem[0])
+
+    return [(number, f"in configuration {confs[number].index}, {message}") for number, message in problems]
+
+
+def _check_basis_sets(mlab: Union[MLAB, MLABStream],
+                      unique_headers: Sequence[MLABConfigurationHeader],
+                      header_ids: ArrayLike) -> Iterator[tuple[str, list[tuple[int, str]]]]:
+    # unique_headers are the distinct headers of all configurations, header_ids gives the position in unique_headers of
+    # the header of every configuration. Problems with the entries of a basis set are yielded once per basis set and
+    # kind, together with the configuration and description of every offending entry.
+    for message in _check_eq(len(mlab.basis_sets),
+                             len({basis_set.name for basis_set in mlab.basis_sets}),
+                             "duplicate basis sets were found"):
+        yield message, []
+
+    for message in _check_eq(set(mlab.atom_types),
+                             {basis_set.name for basis_set in mlab.basis_sets},
+                             "\'The atom types in the data file\' are {0}, but basis sets are named for {1}"):
+        yield message, []
+
+    for basis_set in mlab.basis_sets:
+        if basis_set.name not in mlab.atom_types or mlab.atom_types.index(basis_set.name) >= len(mlab.numbers_of_basis_sets):
+            continue
+
+        for message in _check_eq(mlab.numbers_of_basis_sets[mlab.atom_types.index(basis_set.name)],
+                                 len(basis_set.indices),
+                                 "\'The numbers of basis sets per atom type\' for basis set " + basis_set.name + " is {0}, but {1} were found"):
+            yield message, []
+
+    # The entries of all basis sets are checked at once. Every configuration refers to one of only a few distinct
+    # headers, so the atom types are looked up in a table with a row of matches per header.
+    header_ids = np.asarray(header_ids, dtype=np.int64)
+    numbers_of_atoms = np.array([header.number_of_atoms for header in unique_headers], dtype=np.int64)
+    max_number_of_atoms = max((len(header.type_ids) for header in unique_headers), default=0)
+
+    for basis_set in mlab.basis_sets:
+        indices = np.reshape(basis_set.indices, (-1, 2)).astype(np.int64)
+        conf_indices, atom_indices = indices[:, 0], indices[:, 1]
+
+        invalid_conf = (conf_indices < 1) | (conf_indices > len(header_ids))
+        if invalid_conf.any():
+            yield f"basis set {basis_set.name} references non-existent configrations ", \
+                [(int(conf_index), str(conf_index)) for conf_index in conf_indices[invalid_conf]]
+
+        conf_indices, atom_indices = conf_indices[~invalid_conf], atom_indices[~invalid_conf]
+        entry_header_ids = header_ids[conf_indices - 1]
+
+        invalid_atom = (atom_indices < 1) | (atom_indices > numbers_of_atoms[entry_header_ids])
+        if invalid_atom.any():
+            yield f"basis set {basis_set.name} references non-existent atoms ", \
+                [(int(conf_index), f"{atom_index} in configration {conf_index}")
+                 for conf_index, atom_index in zip(conf_indices[invalid_atom], atom_indices[invalid_atom])]
+
+        conf_indices, atom_indices, entry_header_ids = conf_indices[~invalid_atom], atom_indices[~invalid_atom], entry_header_ids[~invalid_atom]
+
+        matches = np.zeros((len(unique_headers), max_number_of_atoms + 1), dtype=bool)
+        for header_id, header in enumerate(unique_headers):
+            types = [atom_type for atom_type, _ in header.number_of_atoms_per_type]
+            if basis_set.name in types:
+                matches[header_id, 1:len(header.type_ids) + 1] = header.type_ids == types.index(basis_set.name)
+
+        wrong_type = ~matches[entry_header_ids, np.minimum(atom_indices, max_number_of_atoms)]
+        if wrong_type.any():
+            lookups = {header_id: header.generate_type_lookup() + ("nothing",) * max(0, header.number_of_atoms - len(header.type_ids))
+                       for header_id, header in enumerate(unique_headers)}
+            yield f"basis set {basis_set.name} references atoms of other types ", \
+                [(int(conf_index), f"{atom_index} in configration {conf_index} (listed as {lookups[header_id][atom_index - 1]})")
+                 for conf_index, atom_index, header_id in zip(conf_indices[wrong_type], atom_indices[wrong_type], entry_header_ids[wrong_type])]
 
-    _assert_eq(len(mlab.atomic_masses),
-               len(mlab.atom_types),
-               "\'Atomic mass\' contains {0} items but {1} types were named")
 
-    _assert_eq(len(mlab.numbers_of_basis_sets),
-               len(mlab.atom_types),
-               "\'The numbers of basis sets per atom type\' contains {0} items but {1} types were named")
+def _validate_basis_sets(mlab: Union[MLAB, MLABStream], unique_headers: Sequence[MLABConfigurationHeader], header_ids: ArrayLike) -> None:
+    # Everything wrong with the basis sets is raised at once, one line per basis set and kind of problem
+    problems = [message + ", ".join(entry for _, entry in entries) for message, entries in _check_basis_sets(mlab, unique_headers, header_ids)]
 
+    if len(problems) > 0:
+        raise _error("\n".join(problems))
+
+
+def _check_headers(mlab: Union[MLAB, MLABStream], number_of_configurations: int, unique_headers: Sequence[MLABConfigurationHeader]) -> Iterator[str]:
+    # The global maxima and atom types only depend on the distinct headers
+    yield from _check_global(mlab,
+                             number_of_configurations,
+                             max((header.number_of_atoms for header in unique_headers), default=0),
+                             max((amount for header in unique_headers for _, amount in header.number_of_atoms_per_type), default=0),
+                             {atom_type for header in unique_headers for atom_type, _ in header.number_of_atoms_per_type})
+
+
+def validate(mlab: MLAB) -> None:
+    unique_headers = {}
+    header_ids = [unique_headers.setdefault(conf.header, len(unique_headers)) for conf in mlab.configurations]
+
+    _raise_first(_check_headers(mlab, len(mlab.configurations), list(unique_headers)))
 
-def _validate_configurations(mlab: MLAB) -> None:
     for i, conf in enumerate(mlab.configurations):
-        if conf.index != i + 1:
-            raise _error(f"configurations are not indexed sequentially ({i + 1}'s configuration has index {conf.index})")
+        _raise_first(_check_configuration(i, conf))
 
-        _assert_eq(conf.number_of_atom_types,
-                   len(conf.number_of_atoms_per_type),
-                   f"in configuration {conf.index}, \'The number of atom types\' is {0} but {1} are named")
+    _validate_basis_sets(mlab, list(unique_headers), header_ids)
 
-        _assert_eq(len({name for name, _ in conf.number_of_atoms_per_type}),
-                   conf.number_of_atom_types,
-                   f"in configuration {conf.index}, \'Atom types and atom numbers\' contains duplicate elements")
 
-        _assert_eq(sum([amount for _, amount in conf.number_of_atoms_per_type]),
-                   conf.number_of_atoms,
-                   f"in configuration {conf.index}, \'Atom types and atom numbers\' has a total of {0} atoms, but {1} only exist")
+def iter_validated(mlab_stream: MLABStream) -> Iterator[MLABConfiguration]:
+    # Passes on the configurations of the stream while checking the same as validate. Per-configuration problems are
+    # reported as soon as they are found, problems with the global header and basis sets once all configurations have
+    # been read. Apart from the distinct headers, only a small integer per configuration is kept for the basis set
+    # checks, so validating a stream needs (almost) constant memory.
+    unique_headers = {}
+    header_ids = array("q")
 
-        _assert_eq(conf.lattice_vectors.shape,
-                   (3, 3),
-                   f"in configuration {conf.index}, \'Primitive lattice vectors (ang.)\' has shape {0} but expected {1}")
+    for i, conf in enumerate(mlab_stream):
+        _raise_first(_check_configuration(i, conf))
 
-        _assert_eq(conf.positions.shape,
-                   (conf.number_of_atoms, 3),
-                   f"in configuration {conf.index}, \'Atomic positions (ang.)\' has shape {0} but expected {1}")
+        header_ids.append(unique_headers.setdefault(conf.header, len(unique_headers)))
 
-        _assert_eq(conf.forces.shape,
-                   (conf.number_of_atoms, 3),
-                   f"in configuration {conf.index}, \'Forces (eV ang.^-1)\' has shape {0} but expected {1}")
+        yield conf
 
-        if conf.charges is not None:
-            _assert_eq(conf.charges.shape,
-                       (conf.number_of_atoms,),
-                       f"in configuration {conf.index}, \'Charges (e)\' has shape {0} but expected {1}")
+    _raise_first(_check_headers(mlab_stream, len(header_ids), list(unique_headers)))
 
+    _validate_basis_sets(mlab_stream, list(unique_headers), header_ids)
 
-def _validate_basis_sets(mlab: MLAB) -> None:
-    _assert_eq(len(mlab.basis_sets),
-               len({basis_set.name for basis_set in mlab.basis_sets}),
-               "duplicate basis sets were found")
 
-    _assert_eq(set(mlab.atom_types),
-               {basis_set.name for basis_set in mlab.basis_sets},
-               "\'The atom types in the data file\' are {0}, but basis sets are named for {1}")
+def validate_stream(mlab_stream: MLABStream) -> None:
+    for _ in iter_validated(mlab_stream):
+        pass
 
-    for basis_set in mlab.basis_sets:
-        _assert_eq(mlab.numbers_of_basis_sets[mlab.atom_types.index(basis_set.name)],
-                   len(basis_set.indices),
-                   "\'The numbers of basis sets per atom type\' for basis set " + basis_set.name + " is {0}, but {1} were found")
 
-        for conf_index, atom_index in basis_set.indices:
-            if not 1 <= conf_index <= mlab.number_of_configurations:
-                raise _error(f"basis set {basis_set.name} references non-existent configration {conf_index}")
+def load_validated(stream: TextIO, engine: str = "line") -> MLAB:
+    # Parses and validates a file in a single pass
+    mlab_stream = parsing.iter_configurations(stream, engine)
+    configurations = list(iter_validated(mlab_stream))
+    _stack(configurations)
 
-            conf = mlab.configurations[conf_index - 1]
+    return MLAB(number_of_configurations=mlab_stream.number_of_configurations,
+                max_number_of_atom_types=mlab_stream.max_number_of_atom_types,
+                atom_types=mlab_stream.atom_types,
+                max_number_of_atoms_per_system=mlab_stream.max_number_of_atoms_per_system,
+                max_number_of_atoms_per_type=mlab_stream.max_number_of_atoms_per_type,
+                reference_energies=mlab_stream.reference_energies,
+                atomic_masses=mlab_stream.atomic_masses,
+                numbers_of_basis_sets=mlab_stream.numbers_of_basis_sets,
+                basis_sets=mlab_stream.basis_sets,
+                configurations=configurations)
 
-            if not 1 <= atom_index <= conf.number_of_atoms:
-                raise _error(f"basis set {basis_set.name} references non-existent atom {atom_index} in configration {conf_index}")
 
-            actual_atom = conf.generate_type_lookup()[atom_index - 1]
+def report(mlab: Union[MLAB, MLABStream, TextIO], engine: str = "block") -> list[ValidationProblem]:
+    # Runs every check in a single pass and collects all problems instead of stopping at the first one. Text streams are
+    # parsed while they are checked, for them and for MLABStreams problems are located by the lines of their
+    # configuration in the file. A file that cannot be parsed is checked up to where parsing failed, which is reported
+    # as a problem of its own, at the lines that could not be parsed.
+    problems = []
 
-            if actual_atom != basis_set.name:
-                raise _error(f"basis set {basis_set.name} references atom {atom_index}, which is listed as {actual_atom}")
+    unique_headers = {}
+    header_ids = array("q")
+    line_starts = array("q")
+    line_ends = array("q")
 
+    def get_lines(conf_index: int) -> Optional[tuple[int, int]]:
+        if len(line_starts) == 0 or not 1 <= conf_index <= len(line_starts):
+            return None
 
-def validate(mlab: MLAB) -> None:
-    _validate_global(mlab)
-    _validate_configurations(mlab)
-    _validate_basis_sets(mlab)
+        return line_starts[conf_index - 1], line_ends[conf_index - 1]
+
+    # The physics checks run on chunks of configurations, the problems of a configuration are still reported together
+    chunk = []
+
+    def check_chunk() -> None:
+        physics = defaultdict(list)
+        for number, message in _check_physics([conf for conf, _, _ in chunk]):
+            physics[number].append(message)
+
+        for number, (conf, lines, messages) in enumerate(chunk):
+            problems.extend(ValidationProblem("configuration", message, conf.index, lines) for message in messages)
+            problems.extend(ValidationProblem("physics", message, conf.index, lines) for message in physics[number])
+
+        chunk.clear()
+
+    try:
+        # Created in here, so that a broken global header is reported like any other format problem
+        if not isinstance(mlab, (MLAB, MLABStream)):
+            mlab = parsing.iter_configurations(mlab, engine)
+
+        for i, conf in enumerate(mlab if isinstance(mlab, MLABStream) else mlab.configurations):
+            lines = getattr(mlab, "configuration_lines", None)
+            if lines is not None:
+                line_starts.append(lines[0])
+                line_ends.append(lines[1])
+
+            chunk.append((conf, lines, list(_check_configuration(i, conf))))
+            if len(chunk) == _physics_chunk_size:
+                check_chunk()
+
+            header_ids.append(unique_headers.setdefault(conf.header, len(unique_headers)))
+    except ParserException as e:
+        check_chunk()
+        problems.append(ValidationProblem("format", str(e), lines=e.lines))
+        return problems
+
+    check_chunk()
+
+    problems.extend(ValidationProblem("global", message) for message in _check_headers(mlab, len(header_ids), list(unique_headers)))
+
+    for message, entries in _check_basis_sets(mlab, list(unique_headers), header_ids):
+        if len(entries) == 0:
+            problems.append(ValidationProblem("basis set", message))
+
+        # Basis set entries are located by position in the file, configuration indices may be broken themselves
+        problems.extend(ValidationProblem("basis set", message + entry, conf_index, get_lines(conf_index))
+                        for conf_index, entry in entries)
+
+    return problems
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Sequence, TextIO, Union
+
+import numpy as np
+
+from fpdataviewer.mlab.mlab import MLAB, MLABBasisSet, MLABConfiguration, MLABConfigurationHeader
+from fpdataviewer.mlab.parsing import MLABStream
+
+_major_divider = "*" * 50
+_minor_divider = "=" * 50
+_header_divider = "-" * 50
+
+# A leading space keeps numbers apart even when they fill the field, e.g. with three-digit exponents
+_float_format = " %23.16E"
+
+
+def _section(header: str, content: str, divider: str = _major_divider) -> str:
+    return f"{divider}\n     {header}\n{_header_divider}\n{content}\n"
+
+
+def _format_floats(values: Sequence[float], per_line: int) -> str:
+    line_format = _float_format * per_line
+    lines, rest = divmod(len(values), per_line)
+
+    return "\n".join([line_format] * lines + ([_float_format * rest] if rest > 0 else [])) % tuple(values)
+
+
+class _ConfigurationFormatter:
+    # Every configuration is formatted with a single %-operation on a template, which only depends on the header and on
+    # which optional blocks are present. Templates are built once and reused for all configurations that share them.
+    def __init__(self):
+        self.templates = {}
+
+    def _create_template(self, header: MLABConfigurationHeader, has_ctifor: bool, has_charges: bool) -> str:
+        def floats(number: int, per_line: int) -> str:
+            lines, rest = divmod(number, per_line)
+            return "\n".join([_float_format * per_line] * lines + ([_float_format * rest] if rest > 0 else []))
+
+        # Text from the header is escaped, it is not part of the formatted values
+        atoms = "\n".join(f"     {atom_type:<2} {amount:6d}" for atom_type, amount in header.number_of_atoms_per_type).replace("%", "%%")
+
+        template = f"{_major_divider}\n     Configuration num. %6d\n" \
+            + _section("System name", f"     {header.name.replace('%', '%%')}", _minor_divider) \
+            + _section("The number of atom types", f"{header.number_of_atom_types:8d}", _minor_divider) \
+            + _section("The number of atoms", f"{header.number_of_atoms:11d}", _minor_divider) \
+            + _section("Atom types and atom numbers", atoms, _major_divider)
+
+        if has_ctifor:
+            template += _section("CTIFOR", floats(1, 1), _minor_divider)
+
+        template += _section("Primitive lattice vectors (ang.)", floats(9, 3), _minor_divider) \
+            + _section("Atomic positions (ang.)", floats(3 * header.number_of_atoms, 3), _minor_divider) \
+            + _section("Total energy (eV)", floats(1, 1), _minor_divider) \
+            + _section("Forces (eV ang.^-1)", floats(3 * header.number_of_atoms, 3), _minor_divider) \
+            + _section("Stress (kbar)", "     XX YY ZZ", _minor_divider) \
+            + f"{_header_divider}\n{floats(3, 3)}\n" \
+            + _section("XY YZ ZX", floats(3, 3), _header_divider)
+
+        if has_charges:
+            template += _section("Charges (e)", floats(header.number_of_atoms, 1), _minor_divider)
+
+        return template
+
+    def format(self, conf: MLABConfiguration, index: int) -> str:
+        key = (conf.header, conf.ctifor is not None, conf.charges is not None)
+
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = self._create_template(*key)
+
+        values = [index]
+        if conf.ctifor is not None:
+            values.append(conf.ctifor)
+        values.extend(np.ravel(conf.lattice_vectors).tolist())
+        values.extend(np.ravel(conf.positions).tolist())
+        values.append(conf.energy)
+        values.extend(np.ravel(conf.forces).tolist())
+        values.extend((conf.stress.xx, conf.stress.yy, conf.stress.zz, conf.stress.xy, conf.stress.yz, conf.stress.zx))
+        if conf.charges is not None:
+            values.extend(np.ravel(conf.charges).tolist())
+
+        return template % tuple(values)
+
+
+def _create_global_header(source: Union[MLAB, MLABStream],
+                          number_of_configurations: int,
+                          headers: Iterable[MLABConfigurationHeader],
+                          new_indices: dict[int, int]) -> dict:
+    # Recomputes the global header for the configurations with the given headers. Atom types that no configuration
+    # contains are left out, new ones are appended. Basis set entries refer to configurations by their index: entries of
+    # configurations that are left out are dropped, the others follow the configurations to their new index.
+    max_number_of_atoms_per_system = 0
+    max_number_of_atoms_per_type = 0
+    found_types = set()
+
+    for header in headers:
+        max_number_of_atoms_per_system = max(max_number_of_atoms_per_system, header.number_of_atoms)
+        for atom_type, amount in header.number_of_atoms_per_type:
+            max_number_of_atoms_per_type = max(max_number_of_atoms_per_type, amount)
+            found_types.add(atom_type)
+
+    atom_types = [atom_type for atom_type in source.atom_types if atom_type in found_types]
+    atom_types += sorted(found_types.difference(atom_types))
+
+    reference_energies = dict(zip(source.atom_types, source.reference_energies))
+    atomic_masses = dict(zip(source.atom_types, source.atomic_masses))
+    source_basis_sets = {basis_set.name: np.reshape(basis_set.indices, (-1, 2)) for basis_set in source.basis_sets}
+
+    basis_sets = []
+    for atom_type in atom_types:
+        indices = source_basis_sets.get(atom_type, np.empty((0, 2), dtype=int))
+        remapped = [(new_indices[conf_index], atom_index) for conf_index, atom_index in indices.tolist() if conf_index in new_indices]
+
+        basis_sets.append(MLABBasisSet(name=atom_type, indices=np.array(remapped, dtype=int).reshape(-1, 2)))
+
+    return {
+        "number_of_configurations": number_of_configurations,
+        "max_number_of_atom_types": len(atom_types),
+        "atom_types": atom_types,
+        "max_number_of_atoms_per_system": max_number_of_atoms_per_system,
+        "max_number_of_atoms_per_type": max_number_of_atoms_per_type,
+        "reference_energies": [reference_energies.get(atom_type, 0.) for atom_type in atom_types],
+        "atomic_masses": [atomic_masses.get(atom_type, 0.) for atom_type in atom_types],
+        "numbers_of_basis_sets": [len(basis_set.indices) for basis_set in basis_sets],
+        "basis_sets": basis_sets,
+    }
+
+
+def _write_global_header(stream: TextIO, global_header: dict) -> None:
+    stream.write(" 1.0 Version\n")
+    stream.write(_section("The number of configurations", f"{global_header['number_of_configurations']:10d}"))
+    stream.write(_section("The maximum number of atom type", f"{global_header['max_number_of_atom_types']:8d}"))
+    stream.write(_section("The atom types in the data file", "     " + " ".join(global_header["atom_types"])))
+    stream.write(_section("The maximum number of atoms per system", f"{global_header['max_number_of_atoms_per_system']:15d}"))
+    stream.write(_section("The maximum number of atoms per atom type", f"{global_header['max_number_of_atoms_per_type']:15d}"))
+    stream.write(_section("Reference atomic energy (eV)", _format_floats(global_header["reference_energies"], 3)))
+    stream.write(_section("Atomic mass", _format_floats(global_header["atomic_masses"], 3)))
+    stream.write(_section("The numbers of basis sets per atom type", "".join(f"{number:8d}" for number in global_header["numbers_of_basis_sets"])))
+
+    # Separated like the floats, large indices fill their fields
+    for basis_set in global_header["basis_sets"]:
+        indices = np.reshape(basis_set.indices, (-1, 2))
+        stream.write(_section(f"Basis set for {basis_set.name}", "\n".join(["%10d %6d"] * len(indices)) % tuple(indices.ravel().tolist())))
+
+
+def _format_configurations(configurations: list[MLABConfiguration], first_index: int) -> str:
+    formatter = _ConfigurationFormatter()
+
+    return "".join([formatter.format(conf, first_index + i) for i, conf in enumerate(configurations)])
+
+
+def _format_chunks(chunks: Iterable[tuple[int, list[MLABConfiguration]]], workers: int) -> Iterator[str]:
+    # Yields the formatted chunks in order. With several workers, a few chunks per worker are formatted ahead.
+    if workers <= 1:
+        for first_index, configurations in chunks:
+            yield _format_configurations(configurations, first_index)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        for first_index, configurations in chunks:
+            pending.append(executor.submit(_format_configurations, configurations, first_index))
+
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def write(stream: TextIO,
+          source: Union[MLAB, MLABStream],
+          configurations: Optional[Iterable[MLABConfiguration]] = None,
+          workers: int = 1,
+          chunk_size: int = 256) -> None:
+    # Writes configurations (by default all of source) in the ML_AB format, numbered from 1 in the order they are given.
+    # The atom types, reference energies, atomic masses and basis sets are taken from source, and all counts are
+    # recomputed. When configurations is not a list, it is consumed once and written to a temporary file first, since the
+    # global header depends on all of them. Chunks of configurations are formatted in separate processes with workers > 1.
+    if configurations is None:
+        configurations = source.configurations
+
+    headers = {}
+    new_indices = {}
+    number_of_configurations = 0
+
+    def chunks() -> Iterator[tuple[int, list[MLABConfiguration]]]:
+        nonlocal number_of_configurations
+        iterator = iter(configurations)
+
+        while chunk := list(islice(iterator, chunk_size)):
+            first_index = number_of_configurations + 1
+
+            for conf in chunk:
+                number_of_configurations += 1
+                new_indices.setdefault(conf.index, number_of_configurations)
+                headers[conf.header] = None
+
+            yield first_index, chunk
+
+    if isinstance(configurations, list):
+        # Only the headers and indices are needed before the configurations can be written
+        for _ in chunks():
+            pass
+
+        _write_global_header(stream, _create_global_header(source, number_of_configurations, headers, new_indices))
+
+        number_of_configurations = 0
+        for text in _format_chunks(chunks(), workers):
+            stream.write(text)
+    else:
+        with tempfile.TemporaryFile(mode="w+t") as body:
+            for text in _format_chunks(chunks(), workers):
+                body.write(text)
+
+            _write_global_header(stream, _create_global_header(source, number_of_configurations, headers, new_indices))
+
+            body.seek(0)
+            shutil.copyfileobj(body, stream)
+
+
+def subset(mlab: MLAB, selection: Union[slice, Sequence[int]]) -> MLAB:
+    # Selects configurations by their position, renumbers them and keeps the basis set entries that refer to them
+    if isinstance(selection, slice):
+        configurations = mlab.configurations[selection]
+    else:
+        configurations = [mlab.configurations[i] for i in selection]
+
+    return reindex(replace(mlab, configurations=configurations))
+
+
+def reindex(mlab: MLAB) -> MLAB:
+    # Numbers the configurations from 1 and brings the global header in line with them
+    new_indices = {conf.index: i + 1 for i, conf in enumerate(mlab.configurations)}
+    headers = {conf.header: None for conf in mlab.configurations}
+
+    return MLAB(**_create_global_header(mlab, len(mlab.configurations), headers, new_indices),
+                configurations=[conf if conf.index == i + 1 else replace(conf, index=i + 1) for i, conf in enumerate(mlab.configurations)])
+
+
+def merge(mlabs: Sequence[MLAB]) -> MLAB:
+    # Appends the configurations of all files in order. Atom types keep the order in which they first appear, the
+    # reference energies and masses of a type are taken from the first file that names it.
+    atom_types = []
+    reference_energies = {}
+    atomic_masses = {}
+    basis_sets = {}
+    configurations = []
+
+    for mlab in mlabs:
+        offset = len(configurations)
+        new_indices = {conf.index: offset + i + 1 for i, conf in enumerate(mlab.configurations)}
+
+        for atom_type, reference_energy, atomic_mass in zip(mlab.atom_types, mlab.reference_energies, mlab.atomic_masses):
+            if atom_type not in reference_energies:
+                atom_types.append(atom_type)
+                reference_energies[atom_type] = reference_energy
+                atomic_masses[atom_type] = atomic_mass
+
+        for basis_set in mlab.basis_sets:
+            basis_sets.setdefault(basis_set.name, []).extend((new_indices[conf_index], atom_index)
+                                                             for conf_index, atom_index in np.reshape(basis_set.indices, (-1, 2)).tolist()
+                                                             if conf_index in new_indices)
+
+        configurations.extend(replace(conf, index=offset + i + 1) for i, conf in enumerate(mlab.configurations))
+
+    # The counts are filled in by reindex
+    merged = MLAB(number_of_configurations=len(configurations),
+                  max_number_of_atom_types=len(atom_types),
+                  max_number_of_atoms_per_system=0,
+                  max_number_of_atoms_per_type=0,
+                  atom_types=atom_types,
+                  reference_energies=[reference_energies[atom_type] for atom_type in atom_types],
+                  atomic_masses=[atomic_masses[atom_type] for atom_type in atom_types],
+                  numbers_of_basis_sets=[],
+                  basis_sets=[MLABBasisSet(name=name, indices=np.array(indices, dtype=int).reshape(-1, 2)) for name, indices in basis_sets.items()],
+                  configurations=configurations)
+
+    return reindex(merged)